@@ -0,0 +1,71 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Runs plans of many directories against the fake Pig and HDFS of the test
+harness (unit_tests/harness.py) and reports planning time, job throughput,
+achieved concurrency and, with failures injected, the rounds needed to
+resume the failed directories.
+
+Usage:
+    python benchmarks/bench_scale.py [directories] [parallel] [latency]
+                                     [failure-rate]
+"""
+
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path[:0] = [os.path.abspath(ROOT),
+                os.path.abspath(os.path.join(ROOT, "unit_tests"))]
+
+from harness import FakeCluster, merge_until_done
+
+
+def main():
+    directories = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    parallel = sys.argv[2] if len(sys.argv) > 2 else "32"
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
+    failure_rate = float(sys.argv[4]) if len(sys.argv) > 4 else 0.0
+
+    with FakeCluster(latency=latency, failure_rate=failure_rate, seed=1,
+                     output_bytes=1024) as cluster:
+        names = cluster.make_directories("/data/in", directories,
+                                         files_per_dir=1, lines_per_file=1)
+
+        start = time.time()
+        cluster.plan(names, parallel=parallel)
+        planning = time.time() - start
+
+        start = time.time()
+        # The first failure of a round stops it; allow enough rounds
+        rounds = merge_until_done(cluster, names, max_rounds=directories,
+                                  parallel=parallel)
+        elapsed = time.time() - start
+
+        events = cluster.events()
+        print("directories     %d" % directories)
+        print("planning        %.2f s" % planning)
+        print("execution       %.2f s in %d rounds" % (elapsed, len(rounds)))
+        print("attempts        %d (%d failed)" % (
+            sum(1 for e in events if e[1] == "start"),
+            sum(1 for e in events if e[1] == "fail")))
+        print("throughput      %.1f jobs/s" % cluster.throughput())
+        print("concurrency     %d of %s" % (cluster.max_concurrency(),
+                                            parallel))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures the wall clock time of filemerge invocations that have nothing to
+do, which is the common case for wrappers calling filemerge at high frequency:
+an empty list of directories, and a window of days without data on the fake
+HDFS of the test harness (unit_tests/harness.py).
+
+Usage:
+    python benchmarks/bench_startup.py [number-of-runs]
+"""
+
+import os
+import sys
+import time
+import tempfile
+import subprocess as sp
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path[:0] = [os.path.abspath(ROOT),
+                os.path.abspath(os.path.join(ROOT, "unit_tests"))]
+
+from harness import FakeCluster
+
+SCRIPT = os.path.abspath(os.path.join(ROOT, "filemerge", "filemerge.py"))
+
+
+def timed_runs(cmd, runs):
+    """
+    Runs *cmd* *runs* times and returns the sorted wall clock times in ms
+    """
+    timings = []
+    with open(os.devnull, "w") as devnull:
+        for _ in range(runs):
+            start = time.time()
+            sp.check_call(cmd, stdout=devnull, stderr=devnull)
+            timings.append(1000.0 * (time.time() - start))
+    return sorted(timings)
+
+
+def report(name, timings):
+    print("%-24s min %7.1f ms   median %7.1f ms   mean %7.1f ms" % (
+        name, timings[0], timings[len(timings) // 2],
+        sum(timings) / len(timings)))
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    # Empty list of directories: the plan is empty and filemerge exits
+    fd, empty_list = tempfile.mkstemp(suffix=".txt")
+    os.close(fd)
+    try:
+        common = [sys.executable, SCRIPT, "-t", "bench", "-i", "/in",
+                  "-o", "/out", "-q", "default", "--log-level", "WARNING"]
+        report("interpreter only", timed_runs([sys.executable, "-c", "pass"],
+                                              runs))
+        report("empty plan", timed_runs(common + ["-f", empty_list], runs))
+
+        # One listing finds no input files; no Pig job is launched
+        with FakeCluster() as cluster:
+            report("week without data", timed_runs(common + ["-w", "7"],
+                                                   runs))
+            if cluster.events():
+                raise RuntimeError("Pig ran for a window without data")
+    finally:
+        os.remove(empty_list)
+
+
+if __name__ == "__main__":
+    main()
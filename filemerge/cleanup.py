@@ -0,0 +1,352 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Removal of merged source files. Sources are deleted or archived only after a
+verified merge, and only if the input listing taken before the merge matches
+the verified input in file count and size. Every action is appended to a
+journal (one JSON document per line) before it is carried out, so that it can
+be undone with :func:`undo`.
+
+Once the sources of an output are removed, the output holds the only copy of
+their records. A cleanup therefore leaves a CLEANUP_FILE in the output, and a
+later merge of new sources into the same output folds the existing output
+into its input: the output is first moved to PREVIOUS_DIR, merged along with
+the new sources and removed together with them.
+
+Source directories left without data are removed along with the files that
+merges and Hadoop jobs leave next to the data (SIDECAR_FILES), so repeated
+promotions of tiered compaction leave no empty directories behind.
+"""
+
+import os
+import json
+import time
+import posixpath
+import logging
+import hdfs
+from headers import HEADER_FILE
+from index import INDEX_FILE
+
+
+logger = logging.getLogger(__name__)
+
+DELETE = "delete"
+ARCHIVE = "archive"
+
+# Marker left in an output whose sources have been removed
+CLEANUP_FILE = "_cleanup.json"
+
+# Directory below the output prefix holding outputs being folded into a merge
+PREVIOUS_DIR = "_previous"
+
+# Files left next to the data of a directory: the Hadoop job marker and the
+# header, index and cleanup files of filemerge outputs
+SIDECAR_FILES = ("_SUCCESS", HEADER_FILE, INDEX_FILE, CLEANUP_FILE)
+
+
+class CleanupException(RuntimeError):
+    pass
+
+
+def check_unchanged(snapshot, verification):
+    """
+    Checks that the files listed before the merge are exactly the files that
+    were verified after it
+
+    :type snapshot: list
+    :param snapshot: List of tuples containing file path and size, taken
+                     before the merge
+
+    :type verification: dict
+    :param verification: result of verify.verify_merge
+
+    :rtype: None
+    :return: None
+
+    :exception: CleanupException
+    """
+    if not verification.get("verified"):
+        raise CleanupException("Merge output has not been verified")
+    if not verification.get("input_records"):
+        raise CleanupException("Merge read no records; nothing to clean up")
+
+    expected = (len(snapshot), sum(size for _, size in snapshot))
+    found = (verification["input_files"], verification["input_bytes"])
+    if expected != found:
+        raise CleanupException(
+            "Input changed during the merge: %d files/%d bytes before, "
+            "%d files/%d bytes after" % (expected + found))
+
+
+def archive_destinations(files, input_prefix, archive_prefix):
+    """
+    Groups *files* by the archive directory they are moved to. The layout of
+    the files below *input_prefix* is preserved below *archive_prefix*.
+
+    :type files: list
+    :param files: List of tuples containing file path and size
+
+    :type input_prefix: str
+    :param input_prefix: root folder of the source data
+
+    :type archive_prefix: str
+    :param archive_prefix: root folder of the archive
+
+    :rtype: dict
+    :return: Mapping of archive directory to list of source paths
+    """
+    root = input_prefix.rstrip("/") + "/"
+    groups = dict()
+    for fpath, _ in files:
+        if not fpath.startswith(root):
+            raise CleanupException("'%s' is not below '%s'" % (fpath, root))
+        relative_dir = posixpath.dirname(fpath[len(root):])
+        destination = posixpath.join(archive_prefix, relative_dir)
+        groups.setdefault(destination.rstrip("/"), []).append(fpath)
+    return groups
+
+
+def append_journal(journal_path, entry):
+    """
+    Appends *entry* to the journal at *journal_path*
+
+    :type journal_path: str
+    :param journal_path: path to the local journal file
+
+    :type entry: dict
+    :param entry: journal entry
+
+    :rtype: None
+    :return: None
+    """
+    journal_dir = os.path.dirname(journal_path)
+    if journal_dir and not os.path.exists(journal_dir):
+        os.makedirs(journal_dir, 0o700)
+    with open(journal_path, "a") as fh:
+        fh.write(json.dumps(entry, sort_keys=True) + "\n")
+
+
+def read_journal(journal_path):
+    """
+    Reads all entries of the journal at *journal_path*
+
+    :type journal_path: str
+    :param journal_path: path to the local journal file
+
+    :rtype: list
+    :return: List of journal entries
+    """
+    with open(journal_path) as fh:
+        return [json.loads(line) for line in fh if line.strip()]
+
+
+def cleanup_source(action, files, dirname, input_prefix, journal_path,
+                   archive_prefix=None, previous=None, output_path=None):
+    """
+    Deletes or archives merged source files with one bulk operation per
+    directory, after recording the operation in the journal. The files of a
+    previous output folded into the merge are deleted in either case.
+
+    :type action: str
+    :param action: DELETE or ARCHIVE
+
+    :type files: list
+    :param files: List of tuples containing file path and size
+
+    :type dirname: str
+    :param dirname: base directory name of the merge
+
+    :type input_prefix: str
+    :param input_prefix: root folder of the source data
+
+    :type journal_path: str
+    :param journal_path: path to the local journal file
+
+    :type archive_prefix: str
+    :param archive_prefix: root folder of the archive (ARCHIVE only)
+
+    :type previous: list
+    :param previous: List of tuples containing file path and size of the
+                     previous output folded into the merge
+
+    :type output_path: str
+    :param output_path: HDFS output directory of the merge, which an undo
+                        removes
+
+    :rtype: dict
+    :return: Cleanup metrics
+    """
+    previous = previous or []
+    entry = {
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "action": action,
+        "dirname": dirname,
+        "input_prefix": input_prefix,
+        "archive_prefix": archive_prefix,
+        "output_path": output_path,
+        "files": [[fpath, size] for fpath, size in files],
+        "previous": [[fpath, size] for fpath, size in previous]
+    }
+    append_journal(journal_path, entry)
+
+    paths = [fpath for fpath, _ in files]
+    replaced = [fpath for fpath, _ in previous]
+    if action == DELETE:
+        hdfs.rm(paths + replaced)
+    elif action == ARCHIVE:
+        groups = archive_destinations(files, input_prefix, archive_prefix)
+        hdfs.mkdir(sorted(groups))
+        for destination in sorted(groups):
+            hdfs.mv(groups[destination], destination)
+        hdfs.rm(replaced)
+    else:
+        raise CleanupException("Unsupported cleanup action '%s'" % action)
+
+    remove_empty_dirs(files, input_prefix)
+
+    logger.info("Cleanup of %s: %s %d files", dirname, action, len(paths))
+    return {"action": action,
+            "files": len(paths),
+            "bytes": sum(size for _, size in files),
+            "previous_files": len(replaced)}
+
+
+def remove_empty_dirs(files, input_prefix):
+    """
+    Removes the directories below *input_prefix* that held *files* and hold
+    nothing but sidecar files now. Their sidecar files are deleted first,
+    then the directories, children before their parents; a directory that
+    is not empty by then, e.g. because late files arrived, is kept.
+
+    :type files: list
+    :param files: List of tuples containing file path and size, removed
+                  from HDFS
+
+    :type input_prefix: str
+    :param input_prefix: root folder of the source data, which is kept
+
+    :rtype: None
+    :return: None
+    """
+    root = input_prefix.rstrip("/") + "/"
+    directories = set()
+    for fpath, _ in files:
+        parent = posixpath.dirname(fpath)
+        while parent.startswith(root) and parent not in directories:
+            directories.add(parent)
+            parent = posixpath.dirname(parent)
+    if not directories:
+        return
+
+    ordered = sorted(directories)
+    sidecars, empty = [], []
+    for directory, listed in zip(ordered, hdfs.ls_each(
+            ordered, include_hidden=True)):
+        if all(posixpath.basename(fpath) in SIDECAR_FILES and
+               posixpath.dirname(fpath) in directories
+               for fpath, _ in listed):
+            sidecars.extend(fpath for fpath, _ in listed)
+            empty.append(directory)
+
+    if sidecars:
+        hdfs.rm(sorted(set(sidecars)))
+    if empty:
+        hdfs.rmdir(sorted(empty, key=lambda d: (-d.count("/"), d)))
+        logger.debug("Removed emptied directories: %s", ", ".join(empty))
+
+
+def mark_output(output_path, metrics):
+    """
+    Leaves a CLEANUP_FILE in *output_path*, recording that the sources of the
+    output have been removed
+
+    :type output_path: str
+    :param output_path: HDFS output directory of the merge
+
+    :type metrics: dict
+    :param metrics: Cleanup metrics, as returned by :func:`cleanup_source`
+
+    :rtype: None
+    :return: None
+    """
+    marker = dict(metrics, time=time.strftime("%Y-%m-%d %H:%M:%S"))
+    hdfs.put_text(posixpath.join(output_path, CLEANUP_FILE),
+                  json.dumps(marker, sort_keys=True) + "\n")
+
+
+def undo(entry, trash_root=None):
+    """
+    Restores the state before the cleanup of a journal entry. The merged
+    output, which holds the records of the restored files, is removed first,
+    along with a copy of it staged in PREVIOUS_DIR by a later fold. Archived
+    files are then moved back from the archive; deleted files, including
+    those of a previous output folded into the merge, are moved back from the
+    HDFS trash checkpoint under *trash_root* (e.g.
+    '/user/<name>/.Trash/Current'). The entries of a directory are undone
+    newest first.
+
+    :type entry: dict
+    :param entry: journal entry
+
+    :type trash_root: str
+    :param trash_root: HDFS trash directory holding the deleted files
+
+    :rtype: None
+    :return: None
+    """
+    output_path = entry.get("output_path")
+    if not output_path:
+        # Restoring the files next to the output would duplicate records
+        raise CleanupException(
+            "Journal entry of %s does not name its output" % entry["dirname"])
+    files = [(fpath, size) for fpath, size in entry["files"]]
+    previous = [fpath for fpath, _ in entry.get("previous", [])]
+    if previous and not trash_root:
+        raise CleanupException("Restoring deleted files needs trash_root")
+    trash = trash_root.rstrip("/") if trash_root else None
+
+    groups = dict()
+    for fpath, _ in files:
+        groups.setdefault(posixpath.dirname(fpath), []).append(fpath)
+
+    if entry["action"] == ARCHIVE:
+        archived = archive_destinations(files, entry["input_prefix"],
+                                        entry["archive_prefix"])
+        sources = dict()
+        for destination, paths in archived.items():
+            for fpath in paths:
+                sources[fpath] = posixpath.join(destination,
+                                                posixpath.basename(fpath))
+    elif entry["action"] == DELETE:
+        if not trash_root:
+            raise CleanupException("Restoring deleted files needs trash_root")
+        sources = dict((fpath, trash + fpath) for fpath, _ in files)
+    else:
+        raise CleanupException(
+            "Unsupported cleanup action '%s'" % entry["action"])
+
+    for fpath in previous:
+        sources[fpath] = trash + fpath
+        groups.setdefault(posixpath.dirname(fpath), []).append(fpath)
+
+    hdfs.rmr(output_path)
+    hdfs.rmr(posixpath.join(posixpath.dirname(output_path), PREVIOUS_DIR,
+                            posixpath.basename(output_path)))
+    hdfs.mkdir(sorted(groups))
+    for original_dir in sorted(groups):
+        hdfs.mv([sources[fpath] for fpath in groups[original_dir]],
+                original_dir)
+    logger.info("Restored %d files of %s and removed its output %s",
+                len(files) + len(previous), entry["dirname"], output_path)
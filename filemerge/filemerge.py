@@ -14,19 +14,66 @@
 
 import os
 import re
+import sys
 import logging
 import datetime
 import subprocess as sp
-from calendar import monthrange
 # We use optparse (vs argparse) for Python2.6 compatibility
 from optparse import OptionParser
 from templates import PIG_TEMPLATE, DATE_TEMPLATE
+# Modules needed only once there is something to merge (verify, supervisor,
+# cleanup, hdfs, json, calendar) are imported where they are used. filemerge
+# is invoked very frequently from wrappers and empty runs should exit fast.
 
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.DEBUG,
-                    format='%(asctime)s [%(levelname)s] [func=%(funcName)s] %(message)s',
-                    datefmt='%Y-%m-%d %H:%M:%S')
+
+LOG_FORMAT = '%(asctime)s [%(levelname)s] [func=%(funcName)s] %(message)s'
+LOG_DATEFMT = '%Y-%m-%d %H:%M:%S'
+LOG_LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR"]
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats log records as single line JSON documents
+    """
+
+    def format(self, record):
+        import json
+
+        entry = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "func": record.funcName,
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, sort_keys=True)
+
+
+def configure_logging(level="DEBUG", log_format="text"):
+    """
+    Configures the root logger
+
+    :type level: str
+    :param level: name of the log level
+
+    :type log_format: str
+    :param log_format: 'text' or 'json'
+
+    :rtype: None
+    :return: None
+    """
+    if log_format == "json":
+        handler = logging.StreamHandler()
+        handler.setFormatter(JsonFormatter(datefmt=LOG_DATEFMT))
+        root = logging.getLogger()
+        root.addHandler(handler)
+        root.setLevel(getattr(logging, level))
+    else:
+        logging.basicConfig(level=getattr(logging, level),
+                            format=LOG_FORMAT, datefmt=LOG_DATEFMT)
 
 
 class MissingRequiredOptionsException(RuntimeError):
@@ -37,6 +84,10 @@ class InvalidSourceException(RuntimeError):
     pass
 
 
+class ConflictingOptionsException(RuntimeError):
+    pass
+
+
 def add_options(_parser):
     """
     Adds options to the passed in '_parser'
@@ -102,7 +153,105 @@ def add_options(_parser):
 
     _parser.add_option("-r", "--dry-run",
                        dest="dry_run", action="store_true", default=False,
-                       help="Dry run; create, but dont execute the Pig script")
+                       help="Dry run; write the Pig script and a parameter file "
+                            "per job and log the pig commands, but dont "
+                            "run them")
+
+    _parser.add_option("-p", "--parallel",
+                       dest="parallel", action="store", default="1",
+                       help="Number of Pig jobs to run concurrently")
+
+    _parser.add_option("--log-level",
+                       dest="log_level", action="store", default="DEBUG",
+                       type="choice", choices=LOG_LEVELS,
+                       help="Log level (DEBUG, INFO, WARNING, ERROR)")
+
+    _parser.add_option("--log-format",
+                       dest="log_format", action="store", default="text",
+                       type="choice", choices=["text", "json"],
+                       help="Log format (text or json)")
+
+    _parser.add_option("--header",
+                       dest="header", action="store_true", default=False,
+                       help="Input files start with a header row; store it "
+                            "once, in the output's _header file")
+
+    _parser.add_option("--engine",
+                       dest="engine", action="store", default="pig",
+                       type="choice", choices=["pig", "local"],
+                       help="Merge engine (pig or local)")
+
+    _parser.add_option("-v", "--verify",
+                       dest="verify", action="store_true", default=False,
+                       help="Verify record counts and digests of the output")
+
+    _parser.add_option("--verify-workers",
+                       dest="verify_workers", action="store", default="4",
+                       help="Number of parallel streams used for verification")
+
+    _parser.add_option("--metrics-file",
+                       dest="metrics_file", action="store",
+                       help="File to write the run metrics to (JSON)")
+
+    _parser.add_option("--delete-source",
+                       dest="delete_source", action="store_true", default=False,
+                       help="Delete the merged input files (requires --verify)")
+
+    _parser.add_option("--archive-source",
+                       dest="archive_source", action="store",
+                       help="Move the merged input files to this HDFS directory"
+                            " (requires --verify)")
+
+    _parser.add_option("--journal",
+                       dest="journal", action="store",
+                       help="Journal of source cleanups (default: "
+                            "journal/<topic>.jsonl)")
+
+    _parser.add_option("--sort-key",
+                       dest="sort_key", action="store", type="int",
+                       help="Sort the output by this field (zero based) and "
+                            "index the key range of every output file")
+
+    _parser.add_option("--delimiter",
+                       dest="delimiter", action="store", default="\\t",
+                       help="Field delimiter for --sort-key (default: tab)")
+
+    _parser.add_option("--sort-buffer",
+                       dest="sort_buffer", action="store", default="100000",
+                       help="Lines sorted in memory by the local engine")
+
+    _parser.add_option("--overlap",
+                       dest="overlap", action="store", default="reject",
+                       type="choice", choices=["reject", "dedupe", "ignore"],
+                       help="Input files matched by more than one directory: "
+                            "reject the plan, dedupe, or ignore")
+
+    _parser.add_option("--tiered",
+                       dest="tiered", action="store_true", default=False,
+                       help="Merge raw data hourly, then roll it up into "
+                            "daily and monthly outputs")
+
+    _parser.add_option("--tier-window",
+                       dest="tier_window", action="store", default="7",
+                       help="Days in which raw and hourly data is looked for "
+                            "by --tiered")
+
+    _parser.add_option("--script-retention",
+                       dest="script_retention", action="store", default="30",
+                       help="Days after which unused Pig scripts are deleted")
+
+    _parser.add_option("--resource-profile",
+                       dest="resource_profile", action="store", default="none",
+                       help="Resource profile of the Pig jobs: none (cluster "
+                            "defaults), auto (derived from the input size) or "
+                            "a profile name; split combination is off, so "
+                            "split sizes only affect files larger than a "
+                            "split")
+
+    _parser.add_option("--resource-profiles",
+                       dest="resource_profiles", action="store",
+                       help="JSON file with resource profiles replacing the "
+                            "built-in ones")
 
 
 def get_compression_codec(codec_type):
@@ -157,7 +306,7 @@ def check_options(_parser, _options):
                 "Required option '%s' missing" % attr)
 
     # Create mapping of all sources for which values have been supplied
-    all_sources = ["year", "file", "directory", "window", "lookback"]
+    all_sources = ["year", "file", "directory", "window", "lookback", "tiered"]
     sources = dict()
     for src in all_sources:
         opt_val = getattr(_options, src)
@@ -168,7 +317,42 @@ def check_options(_parser, _options):
     if len(sources.keys()) != 1:
         _parser.print_help()
         raise InvalidSourceException(
-            "Exactly one of these options required: [-y | -D | -f | -w | -l]")
+            "Exactly one of these options required: "
+            "[-y | -D | -f | -w | -l | --tiered]")
+
+    # Source cleanup is only safe after a verified merge
+    if _options.delete_source and _options.archive_source:
+        _parser.print_help()
+        raise ConflictingOptionsException(
+            "At most one of these options allowed: "
+            "[--delete-source | --archive-source]")
+
+    if (_options.delete_source or _options.archive_source) \
+            and not _options.verify:
+        _parser.print_help()
+        raise MissingRequiredOptionsException(
+            "Option '--verify' required for source cleanup")
+
+    # Tiers read the outputs of the tier below, which are then removed
+    if _options.tiered:
+        if not (_options.verify and
+                (_options.delete_source or _options.archive_source)):
+            _parser.print_help()
+            raise MissingRequiredOptionsException(
+                "Option '--tiered' requires '--verify' and one of "
+                "[--delete-source | --archive-source]")
+        if _options.header and _options.engine != "local":
+            _parser.print_help()
+            raise ConflictingOptionsException(
+                "Option '--tiered' with '--header' requires '--engine=local'")
+
+    # The local engine compresses output itself
+    if _options.engine == "local" and _options.codec:
+        from local import COMPRESSORS
+        if _options.codec.lower() not in COMPRESSORS:
+            _parser.print_help()
+            raise ConflictingOptionsException(
+                "Codec '%s' not supported by the local engine" % _options.codec)
 
     # At this time, we've ensured that sources contains only one key. Return its
     # value
@@ -195,6 +379,8 @@ def getpaths_fromymd(input_prefix_, year_, month_=None, day_=None):
     :return: List of tuples containing input path and base directory name
     """
 
+    from calendar import monthrange
+
     # Assign start and end month
     if not month_:
         start_month, end_month = 1, 12
@@ -378,33 +564,57 @@ def materialize(template, substitutions):
 
     script_str = template
     for param, value in substitutions.items():
-        script_str = re.sub(param, str(value), script_str)
+        # Use a function so backslashes in the value are kept verbatim
+        replacement = str(value)
+        script_str = re.sub(param, lambda match: replacement, script_str)
 
     return script_str
 
 
-def runpig(script_path):
+def job_metrics(job):
     """
-    Runs the generated Pig script
+    Collects the run metrics of a merge job
 
-    :type script_path: str
-    :param script_path: path to pig script
+    :type job: PigJob
+    :param job: finished (or failed) job
 
-    :rtype: str
-    :return: result of the shell call
+    :rtype: dict
+    :return: Metrics of the job
     """
-    cmd = "pig -f %s" % script_path
-    result = sp.check_call(cmd.split(" "))
-    return result
+    record = {"dirname": job.name,
+              "input_path": job.input_path,
+              "output_path": job.output_path}
+    record.update(job.summary())
+    record.update(job.metrics)
+    return record
 
 
-def main():
+def write_metrics(metrics_file, run_metrics):
     """
-    Main method
+    Writes the per-directory metrics of a run as a JSON document
+
+    :type metrics_file: str
+    :param metrics_file: path to the metrics file
+
+    :type run_metrics: list
+    :param run_metrics: List of dictionaries, one per merged directory
 
     :rtype: None
     :return: None
     """
+    import json
+
+    with open(metrics_file, "w") as fh:
+        json.dump(run_metrics, fh, indent=2, sort_keys=True)
+
+
+def main():
+    """
+    Main method
+
+    :rtype: int
+    :return: exit code
+    """
 
     USAGE_MSG = \
     """
@@ -419,8 +629,22 @@ def main():
                         [--dir=<directory relative to input-prefix>]
                         [--file=<file with list of directories, relative to input-prefix>]
                         [--window=<window size in days>]
+                        [--tiered [--tier-window=<days>]]
+                        [--script-retention=<days>]
+                        [--resource-profile=<none|auto|name>]
+                        [--resource-profiles=<path>]
                         [--codec=<valid hadoop compression codec>]
                         [-r]
+                        [--parallel=<number of concurrent Pig jobs>]
+                        [--verify [--verify-workers=<n>]]
+                        [--metrics-file=<path>]
+                        [--delete-source | --archive-source=<HDFS-location>]
+                        [--journal=<path>]
+                        [--log-level=<level>] [--log-format=<text|json>]
+                        [--header] [--engine=<pig|local>]
+                        [--sort-key=<field> [--delimiter=<delimiter>]]
+                        [--sort-buffer=<lines>]
+                        [--overlap=<reject|dedupe|ignore>]
 
     """
 
@@ -428,52 +652,53 @@ def main():
     parser = OptionParser(USAGE_MSG)
     add_options(parser)
     options, args = parser.parse_args()
+    configure_logging(options.log_level, options.log_format)
     mode = check_options(parser, options)
 
+    # Tiers compute their own inputs, one tier after the other
+    if mode == "tiered":
+        from tiers import run_tiers
+        run_tiers(options)
+        return 0
+
     input_paths = getpaths(options, mode=mode)
 
-    # Assign number of reducers
-    num_reducers = options.num_reducers if options.num_reducers else 10
+    # Nothing to merge; exit before any further setup
+    if not input_paths:
+        logger.info("No directories to merge for topic '%s'", options.topic)
+        return 0
 
-    # Assign compression codec
-    if options.codec:
-        set_compression_enabled = "set output.compression.enabled true"
-        set_compression_codec = "set output.compression.codec %s" % \
-                                get_compression_codec(options.codec)
-    else:
-        set_compression_enabled = "set output.compression.enabled false"
-        set_compression_codec = ""
-
-    for dirname, ipath in input_paths:
-        substitutions = {
-            "@OUTPUT_PATH": os.path.join(options.output_prefix, dirname),
-            "@INPUT_PATH": ipath,
-            "@NUM_REDUCERS": num_reducers,
-            "@SET_COMPRESSION_ENABLED": set_compression_enabled,
-            "@SET_COMPRESSION_CODEC": set_compression_codec,
-            "@QUEUE": options.queue
-        }
+    from plan import MergePlan
 
-        # Generate the Pig script using substitutions
-        if not os.path.exists("scripts"):
-            os.mkdir("scripts", 0o700)
-        pig_script_str = materialize(PIG_TEMPLATE, substitutions)
-        filename = os.path.join("scripts", "%s-%s.pig" %(options.topic, dirname))
-
-        # Write the script to a file
-        with open(filename, "w") as pigfile:
-            pigfile.write(pig_script_str)
-
-        # Run the Pig file
-        if not options.dry_run:
-            try:
-                runpig(filename)
-            except sp.CalledProcessError as ex:
-                logger.error(ex.message)
-                raise
-            except Exception as ex:
-                logger.info("Error: %s", ex.message)
-                raise
+    plan = MergePlan(options, mode)
+    try:
+        plan.discover(input_paths)
+
+        # No directory has input files, e.g. a day without data
+        if not plan.jobs:
+            logger.info("No input files to merge for topic '%s'",
+                        options.topic)
+            return 0
+
+        plan.schedule()
+
+        if options.dry_run:
+            plan.dry_run()
+            return 0
+
+        # Run the Pig files
+        try:
+            plan.execute()
+        except sp.CalledProcessError as ex:
+            logger.error("Pig job failed: %s", ex)
+            raise
+        finally:
+            if options.metrics_file:
+                write_metrics(options.metrics_file, plan.report())
+    finally:
+        plan.close()
+
+    return 0
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,611 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Thin wrappers around the ``hadoop fs`` command line. Like the Pig invocation
+in ``filemerge.py``, HDFS access is performed by shelling out, so the only
+runtime requirement is a ``hadoop`` command in the path of the runtime user.
+"""
+
+import os
+import re
+import bz2
+import zlib
+import logging
+import subprocess as sp
+
+
+logger = logging.getLogger(__name__)
+
+HADOOP = "hadoop"
+
+GLOB_CHARS = "*?[{"
+
+# Characters of a glob that are not matched literally
+GLOB_SPECIAL = GLOB_CHARS + "\\"
+
+
+def fs_command(*args):
+    """
+    Builds a ``hadoop fs`` command line
+
+    :type args: str
+    :param args: arguments to the ``hadoop fs`` command
+
+    :rtype: list
+    :return: command line suitable for the subprocess module
+    """
+    return [HADOOP, "fs"] + list(args)
+
+
+def split_paths(path_):
+    """
+    Splits a Pig style comma separated input path into individual paths
+
+    :type path_: str
+    :param path_: single path, glob or comma separated list of them
+
+    :rtype: list
+    :return: List of paths
+    """
+    return [p for p in path_.split(",") if p]
+
+
+def glob_root(path_):
+    """
+    Returns the longest leading part of *path_* that contains no glob
+    characters
+
+    :type path_: str
+    :param path_: HDFS path or glob
+
+    :rtype: str
+    :return: Literal root of the glob
+    """
+    root = []
+    for part in path_.split("/"):
+        if any(c in part for c in GLOB_CHARS):
+            break
+        root.append(part)
+    return "/".join(root)
+
+
+def literal_prefix(path_):
+    """
+    Returns the part of *path_* before its first glob character
+
+    :type path_: str
+    :param path_: HDFS path or glob
+
+    :rtype: str
+    :return: Literal prefix of the glob
+    """
+    for i, c in enumerate(path_):
+        if c in GLOB_SPECIAL:
+            return path_[:i]
+    return path_
+
+
+def glob_regex(path_):
+    """
+    Translates a Hadoop glob into a regular expression matching the paths
+    that ``hadoop fs -ls -R`` lists for it: the matches of the glob and
+    everything below them. Supports '*', '?', '[...]', '{a,b}' and '\\'
+    escapes; like in Hadoop, wildcards do not match '/'.
+
+    :type path_: str
+    :param path_: HDFS path or glob
+
+    :rtype: re.RegexObject
+    :return: Compiled regular expression
+    """
+    if len(path_) > 1:
+        path_ = path_.rstrip("/")
+    parts = []
+    braces = 0
+    i = 0
+    while i < len(path_):
+        c = path_[i]
+        if c == "\\" and i + 1 < len(path_):
+            parts.append(re.escape(path_[i + 1]))
+            i += 1
+        elif c == "*":
+            parts.append("[^/]*")
+        elif c == "?":
+            parts.append("[^/]")
+        elif c == "[" and "]" in path_[i + 2:]:
+            end = path_.index("]", i + 2)
+            chars = path_[i + 1:end]
+            if chars[:1] == "!":
+                chars = "^" + chars[1:]
+            parts.append("[%s]" % chars.replace("\\", "\\\\"))
+            i = end
+        elif c == "{":
+            braces += 1
+            parts.append("(?:")
+        elif c == "}" and braces:
+            braces -= 1
+            parts.append(")")
+        elif c == "," and braces:
+            parts.append("|")
+        else:
+            parts.append(re.escape(c))
+        i += 1
+    return re.compile("%s(?:/.*)?$" % "".join(parts))
+
+
+def is_hidden(path_, root_):
+    """
+    Checks whether Hadoop input formats would skip *path_*. As in Hadoop's
+    default path filter, names starting with '_' or '.' are hidden; only the
+    components below the literal *root_* are considered.
+
+    :type path_: str
+    :param path_: listed file path
+
+    :type root_: str
+    :param root_: literal root of the glob that produced the listing
+
+    :rtype: bool
+    :return: True if the file would be skipped by Hadoop
+    """
+    rel = path_[len(root_):] if path_.startswith(root_) else path_
+    return any(part[:1] in ("_", ".") for part in rel.split("/") if part)
+
+
+def _run(cmd, missing_ok=False):
+    """
+    Runs *cmd* and returns its standard output. A failure caused by a path
+    that does not exist is ignored when *missing_ok* is set.
+    """
+    proc = sp.Popen(cmd, stdout=sp.PIPE, stderr=sp.PIPE)
+    out, err = proc.communicate()
+    if proc.returncode != 0:
+        if missing_ok and "No such file or directory" in err:
+            return out
+        logger.error(err.strip())
+        raise sp.CalledProcessError(proc.returncode, " ".join(cmd))
+    return out
+
+
+def _parse_listing(output):
+    """
+    Parses ``hadoop fs -ls`` output into (type, size, path) tuples
+    """
+    entries = []
+    for line in output.splitlines():
+        fields = line.split(None, 7)
+        if len(fields) != 8 or fields[0][:1] not in ("-", "d"):
+            continue
+        entries.append((fields[0][0], int(fields[4]), fields[7]))
+    return entries
+
+
+def ls(path_, include_hidden=False):
+    """
+    Recursively lists the data files matched by *path_*, skipping directories
+    and hidden files the same way Hadoop input formats do
+
+    :type path_: str
+    :param path_: path, glob or comma separated list of them
+
+    :type include_hidden: bool
+    :param include_hidden: also list hidden files such as '_SUCCESS'
+
+    :rtype: list
+    :return: List of tuples containing file path and size in bytes
+    """
+    paths = split_paths(path_)
+    roots = [glob_root(p) for p in paths]
+    listing = _run(fs_command("-ls", "-R", *paths), missing_ok=True)
+
+    files = []
+    for kind, size, fpath in _parse_listing(listing):
+        if kind != "-":
+            continue
+        if not include_hidden and any(
+                fpath.startswith(r) and is_hidden(fpath, r) for r in roots):
+            continue
+        files.append((fpath, size))
+    return files
+
+
+def _attribute(chunk, listing, include_hidden):
+    """
+    Attributes the files of a ``hadoop fs -ls -R`` listing of the globs in
+    *chunk* to the globs matching them
+
+    :rtype: dict
+    :return: Mapping of path index to list of tuples containing file path and
+             size; None if some file matches none of the globs
+    """
+    matchers = dict()
+    for i, pattern in chunk:
+        matchers.setdefault(literal_prefix(pattern), []).append(
+            (i, glob_regex(pattern), glob_root(pattern)))
+    lengths = sorted(set(len(prefix) for prefix in matchers))
+
+    files = dict((i, []) for i, _ in chunk)
+    seen = set()
+    for kind, size, fpath in _parse_listing(listing):
+        if kind != "-" or fpath in seen:
+            continue
+        seen.add(fpath)
+        owners = set()
+        for length in lengths:
+            for i, regex, root in matchers.get(fpath[:length], ()):
+                if i in owners or not regex.match(fpath):
+                    continue
+                owners.add(i)
+                if include_hidden or not is_hidden(fpath, root):
+                    files[i].append((fpath, size))
+        if not owners:
+            logger.warning("'%s' matches none of the listed globs", fpath)
+            return None
+    return files
+
+
+def ls_each(paths_, include_hidden=False):
+    """
+    Lists the files matched by each of *paths_* like :func:`ls`, with one
+    ``hadoop fs -ls -R`` call per ARG_BATCH_SIZE globs instead of one per
+    path. Should a listed file match none of the globs of its call, these
+    globs are listed one by one instead.
+
+    :type paths_: list
+    :param paths_: paths, globs or comma separated lists of them
+
+    :type include_hidden: bool
+    :param include_hidden: also list hidden files such as '_SUCCESS'
+
+    :rtype: list
+    :return: One list of tuples containing file path and size per path
+    """
+    globs = [(i, pattern) for i, path_ in enumerate(paths_)
+             for pattern in split_paths(path_)]
+    listings = [[] for _ in paths_]
+    for chunk in _chunks(globs):
+        listing = _run(fs_command("-ls", "-R", *[p for _, p in chunk]),
+                       missing_ok=True)
+        files = _attribute(chunk, listing, include_hidden)
+        if files is None:
+            files = dict((i, []) for i, _ in chunk)
+            for i, pattern in chunk:
+                files[i].extend(ls(pattern, include_hidden))
+        for i, listed in files.items():
+            listings[i].extend(listed)
+    return listings
+
+
+def text(paths_):
+    """
+    Streams the decoded lines of one or more HDFS files. ``hadoop fs -text``
+    decompresses files written with any of the supported codecs.
+
+    :type paths_: list
+    :param paths_: HDFS file paths
+
+    :rtype: generator
+    :return: Lines of the files, in order, including line terminators
+    """
+    cmd = fs_command("-text", *paths_)
+    proc = sp.Popen(cmd, stdout=sp.PIPE)
+    exhausted = False
+    try:
+        for line in proc.stdout:
+            yield line
+        exhausted = True
+    finally:
+        # Consumers that stop early leave the process running; kill it
+        if not exhausted and proc.poll() is None:
+            proc.kill()
+        proc.stdout.close()
+
+    if proc.wait() != 0:
+        raise sp.CalledProcessError(proc.returncode, " ".join(cmd))
+
+
+# Maximum number of paths passed to a single ``hadoop fs`` call, which keeps
+# command lines well below the operating system limit
+ARG_BATCH_SIZE = 1000
+
+
+def _chunks(paths_):
+    """
+    Splits *paths_* into chunks of at most ARG_BATCH_SIZE paths
+    """
+    return [paths_[i:i + ARG_BATCH_SIZE]
+            for i in range(0, len(paths_), ARG_BATCH_SIZE)]
+
+
+# Maximum number of bytes streamed by a single ``hadoop fs -cat`` call of
+# read_each, and size of the reads from its output
+CAT_BATCH_BYTES = 64 * 1024 * 1024
+READ_SIZE = 64 * 1024
+
+# Leading bytes of gzip files; ``hadoop fs -text`` detects gzip by content
+GZIP_MAGIC = "\x1f\x8b"
+
+# Decompressors of the other codecs decoded by read_each, by file extension
+DECOMPRESSORS = {".bz2": bz2.BZ2Decompressor,
+                 ".deflate": zlib.decompressobj}
+
+# Leading bytes of container formats, and extensions of codecs, that only
+# ``hadoop fs -text`` decodes
+TEXT_ONLY_MAGIC = ("SEQ", "Obj\x01")
+TEXT_ONLY_EXTENSIONS = (".snappy", ".lz4", ".lzo", ".zst")
+
+# Extensions of compressed files
+CODEC_EXTENSIONS = (".gz",) + tuple(DECOMPRESSORS) + TEXT_ONLY_EXTENSIONS
+
+# Number of bytes printed by ``hadoop fs -tail``
+TAIL_BYTES = 1024
+
+
+class _Decoder(object):
+    """
+    Decompresses a file made of one or more concatenated compressed streams
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.decompressor = factory()
+
+    def decode(self, data):
+        decoded = []
+        while data:
+            try:
+                decoded.append(self.decompressor.decompress(data))
+            except EOFError:
+                # bz2 rejects data after the end of its stream
+                self.decompressor = self.factory()
+                continue
+            data = self.decompressor.unused_data
+            if data:
+                self.decompressor = self.factory()
+        return "".join(decoded)
+
+
+class _Slice(object):
+    """
+    Reads the bytes of one file from the output of ``hadoop fs -cat``
+    """
+
+    def __init__(self, stream, path_, size):
+        self.stream = stream
+        self.path = path_
+        self.remaining = size
+
+    def read(self):
+        wanted = min(READ_SIZE, self.remaining)
+        data = self.stream.read(wanted)
+        if len(data) < wanted:
+            raise IOError("'%s' is shorter than listed" % self.path)
+        self.remaining -= wanted
+        return data
+
+    def skip(self):
+        while self.remaining:
+            self.read()
+
+
+def _decoded_lines(slice_):
+    """
+    Decodes the lines of a file like ``hadoop fs -text``; formats decoded by
+    ``hadoop fs -text`` only are skipped in the batch and read on their own
+    """
+    data = slice_.read()
+    extension = os.path.splitext(slice_.path)[1]
+    if data.startswith(TEXT_ONLY_MAGIC) or extension in TEXT_ONLY_EXTENSIONS:
+        slice_.skip()
+        for line in text([slice_.path]):
+            yield line
+        return
+
+    decoder = None
+    if data.startswith(GZIP_MAGIC):
+        decoder = _Decoder(lambda: zlib.decompressobj(16 + zlib.MAX_WBITS))
+    elif extension in DECOMPRESSORS:
+        decoder = _Decoder(DECOMPRESSORS[extension])
+
+    pending = ""
+    while data:
+        lines = (pending + (decoder.decode(data) if decoder else data)) \
+            .split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line + "\n"
+        data = slice_.read()
+    if pending:
+        yield pending
+
+
+def _size_batches(files):
+    """
+    Splits *files* into batches of at most ARG_BATCH_SIZE files and, unless
+    a single file is larger, CAT_BATCH_BYTES bytes
+    """
+    batches, batch, nbytes = [], [], 0
+    for fpath, size in files:
+        if batch and (len(batch) >= ARG_BATCH_SIZE or
+                      nbytes + size > CAT_BATCH_BYTES):
+            batches.append(batch)
+            batch, nbytes = [], 0
+        batch.append((fpath, size))
+        nbytes += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def read_each(files):
+    """
+    Streams the decoded lines of many HDFS files, file by file, with few
+    ``hadoop fs`` calls. One ``hadoop fs -cat`` streams the raw bytes of a
+    batch of files, which are split at the listed sizes; gzip, bzip2 and
+    deflate files are decoded here. A file only ``hadoop fs -text`` can
+    decode, such as a SequenceFile, is read by its own call. A file whose
+    size changed since it was listed raises IOError.
+
+    :type files: list
+    :param files: List of tuples containing file path and size
+
+    :rtype: generator
+    :return: Tuples containing file path and a generator of the lines of the
+             file, including line terminators; lines not read before the
+             next tuple is requested are skipped
+    """
+    for batch in _size_batches(files):
+        cmd = fs_command("-cat", *[fpath for fpath, _ in batch])
+        proc = sp.Popen(cmd, stdout=sp.PIPE)
+        exhausted = False
+        try:
+            for fpath, size in batch:
+                slice_ = _Slice(proc.stdout, fpath, size)
+                lines = _decoded_lines(slice_)
+                yield fpath, lines
+                lines.close()
+                slice_.skip()
+            if proc.stdout.read(1):
+                raise IOError("Files of '%s' grew since they were listed" %
+                              os.path.dirname(batch[-1][0]))
+            exhausted = True
+        finally:
+            # Consumers that stop early leave the process running; kill it
+            if not exhausted and proc.poll() is None:
+                proc.kill()
+            proc.stdout.close()
+
+        if proc.wait() != 0:
+            raise sp.CalledProcessError(proc.returncode, " ".join(cmd))
+
+
+def tail(path_):
+    """
+    Returns the last TAIL_BYTES bytes of an HDFS file, undecoded
+
+    :type path_: str
+    :param path_: HDFS file path
+
+    :rtype: str
+    :return: End of the file
+    """
+    return _run(fs_command("-tail", path_))
+
+
+def mkdir(paths_):
+    """
+    Creates directories (and their parents) in bulk
+
+    :type paths_: list
+    :param paths_: HDFS directories to create
+
+    :rtype: None
+    :return: None
+    """
+    for chunk in _chunks(paths_):
+        _run(fs_command("-mkdir", "-p", *chunk))
+
+
+def rm(paths_):
+    """
+    Deletes files in bulk. Deleted files go to the HDFS trash when it is
+    enabled on the cluster.
+
+    :type paths_: list
+    :param paths_: HDFS paths to delete
+
+    :rtype: None
+    :return: None
+    """
+    for chunk in _chunks(paths_):
+        _run(fs_command("-rm", *chunk))
+
+
+def mv(paths_, destination_):
+    """
+    Moves files into the directory *destination_* in bulk
+
+    :type paths_: list
+    :param paths_: HDFS paths to move
+
+    :type destination_: str
+    :param destination_: existing HDFS directory
+
+    :rtype: None
+    :return: None
+    """
+    for chunk in _chunks(paths_):
+        _run(fs_command("-mv", *(chunk + [destination_])))
+
+
+def rmdir(paths_):
+    """
+    Removes directories in bulk, like ``rmdir``; directories that are not
+    empty are left in place
+
+    :type paths_: list
+    :param paths_: HDFS directories, children before their parents
+
+    :rtype: None
+    :return: None
+    """
+    for chunk in _chunks(paths_):
+        _run(fs_command("-rmdir", "--ignore-fail-on-non-empty", *chunk))
+
+
+def rmr(path_):
+    """
+    Recursively deletes *path_* if it exists, like Pig's ``rmf``
+
+    :type path_: str
+    :param path_: HDFS path
+
+    :rtype: None
+    :return: None
+    """
+    _run(fs_command("-rm", "-r", "-f", path_))
+
+
+def put(path_):
+    """
+    Starts a ``hadoop fs -put`` that writes its standard input to *path_*
+
+    :type path_: str
+    :param path_: HDFS file to create
+
+    :rtype: subprocess.Popen
+    :return: the process; write to its stdin, then close it and wait
+    """
+    return sp.Popen(fs_command("-put", "-", path_), stdin=sp.PIPE)
+
+
+def put_text(path_, text_):
+    """
+    Writes *text_* to the HDFS file *path_*
+
+    :type path_: str
+    :param path_: HDFS file to create
+
+    :type text_: str
+    :param text_: file content
+
+    :rtype: None
+    :return: None
+    """
+    cmd = fs_command("-put", "-f", "-", path_)
+    proc = sp.Popen(cmd, stdin=sp.PIPE)
+    proc.communicate(text_)
+    if proc.returncode != 0:
+        raise sp.CalledProcessError(proc.returncode, " ".join(cmd))
@@ -0,0 +1,161 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Header handling for CSV/TSV topics in which every small file starts with the
+same header row.
+"""
+
+import logging
+import hdfs
+
+
+logger = logging.getLogger(__name__)
+
+# Name of the file holding the header of a Pig merge, next to the part files.
+# Hadoop input formats skip files starting with '_'.
+HEADER_FILE = "_header"
+
+# Files up to this size have their first lines read in batches; a larger
+# file is read by its own ``hadoop fs -text``, stopped after the first line
+BATCH_FILE_BYTES = 1024 * 1024
+
+
+class HeaderMismatchException(RuntimeError):
+    pass
+
+
+def first_line(path_):
+    """
+    Reads the first line of an HDFS file
+
+    :type path_: str
+    :param path_: HDFS file path
+
+    :rtype: str
+    :return: First line without its terminator, None for an empty file
+    """
+    lines = hdfs.text([path_])
+    try:
+        for line in lines:
+            return line.rstrip("\r\n")
+        return None
+    finally:
+        lines.close()
+
+
+def check_header(path_, expected, found):
+    """
+    Raises HeaderMismatchException if *found* differs from *expected*
+    """
+    if found != expected:
+        raise HeaderMismatchException(
+            "Header of '%s' differs: %r != %r" % (path_, found, expected))
+
+
+def _batch_first_lines(files):
+    """
+    Reads the first line of every file of a batch with one ``hadoop fs`` call
+    """
+    found = []
+    for fpath, lines in hdfs.read_each(files):
+        line = next(lines, None)
+        found.append((fpath, line.rstrip("\r\n")
+                      if line is not None else None))
+    return found
+
+
+def first_lines(files, workers=4, pool=None):
+    """
+    Reads the first line of every file. Small files are read in batches, one
+    ``hadoop fs`` call per batch and worker, instead of one per file.
+
+    :type files: list
+    :param files: List of tuples containing file path and size
+
+    :type workers: int
+    :param workers: number of concurrent ``hadoop fs`` calls
+
+    :type pool: multiprocessing.pool.ThreadPool
+    :param pool: thread pool reading the files; None for a new pool of
+                 *workers* threads
+
+    :rtype: dict
+    :return: First line of every file, None for a file without lines
+    """
+    from multiprocessing.pool import ThreadPool
+
+    small = [(fpath, size) for fpath, size in files
+             if size <= BATCH_FILE_BYTES]
+    large = [fpath for fpath, size in files if size > BATCH_FILE_BYTES]
+    size = max(1, min(hdfs.ARG_BATCH_SIZE, -(-len(small) // max(1, workers))))
+    batches = [small[i:i + size] for i in range(0, len(small), size)]
+
+    own_pool = pool is None
+    if own_pool:
+        pool = ThreadPool(max(1, workers))
+    try:
+        found = dict(pair for pairs in pool.map(_batch_first_lines, batches)
+                     for pair in pairs)
+        found.update(zip(large, pool.map(first_line, large)))
+    finally:
+        if own_pool:
+            pool.terminate()
+    return found
+
+
+def detect_header(files, workers=4, pool=None):
+    """
+    Reads the first line of every file and checks that they are identical
+
+    :type files: list
+    :param files: List of tuples containing file path and size
+
+    :type workers: int
+    :param workers: number of concurrent ``hadoop fs`` calls
+
+    :type pool: multiprocessing.pool.ThreadPool
+    :param pool: thread pool reading the files; None for a new pool of
+                 *workers* threads
+
+    :rtype: str
+    :return: The common header, None if there are no non-empty files
+
+    :exception: HeaderMismatchException
+    """
+    files = [(fpath, size) for fpath, size in files if size > 0]
+    found = first_lines(files, workers, pool)
+    lines = [(fpath, found[fpath]) for fpath, _ in files
+             if found[fpath] is not None]
+    if not lines:
+        return None
+
+    header = lines[0][1]
+    for fpath, line in lines:
+        check_header(fpath, header, line)
+    logger.info("Detected header %r in %d files", header, len(lines))
+    return header
+
+
+def pig_string(value):
+    """
+    Quotes *value* as a Pig string literal
+
+    :type value: str
+    :param value: string to quote
+
+    :rtype: str
+    :return: Pig string literal
+    """
+    return "'%s'" % value.replace("\\", "\\\\").replace("'", "\\'")
@@ -0,0 +1,238 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Sort keys and range indexes of sorted merges. A sorted merge writes an index
+next to its output listing the smallest and largest key of every output file,
+so readers looking for a key range only open the files that overlap it.
+"""
+
+import json
+import posixpath
+import logging
+import hdfs
+from headers import first_line
+
+
+logger = logging.getLogger(__name__)
+
+# Name of the index file in the output directory. Hadoop input formats skip
+# files starting with '_'.
+INDEX_FILE = "_index.json"
+
+
+def sort_key(line, field, delimiter):
+    """
+    Extracts the sort key of *line*. Lines with fewer fields get an empty
+    key, which sorts first, like the null keys of a Pig ORDER.
+
+    :type line: str
+    :param line: line of text
+
+    :type field: int
+    :param field: zero based position of the key field
+
+    :type delimiter: str
+    :param delimiter: field delimiter
+
+    :rtype: str
+    :return: Sort key
+    """
+    fields = line.rstrip("\r\n").split(delimiter, field + 1)
+    return fields[field] if len(fields) > field else ""
+
+
+def pig_regex(delimiter):
+    """
+    Escapes *delimiter* for use as a Java regular expression in STRSPLIT
+    """
+    return "".join("\\" + c if c in ".$|()[]{}^?*+\\" else c
+                   for c in delimiter)
+
+
+def last_line(path_, size):
+    """
+    Returns the last line of an uncompressed file, read from its end
+
+    :type path_: str
+    :param path_: HDFS file path
+
+    :type size: int
+    :param size: file size
+
+    :rtype: str
+    :return: Last line without its terminator, None if it is longer than
+             the end read by ``hadoop fs -tail``
+    """
+    data = hdfs.tail(path_)
+    if data.endswith("\n"):
+        data = data[:-1]
+    lines = data.split("\n")
+    if len(lines) < 2 and size > hdfs.TAIL_BYTES:
+        return None
+    return lines[-1].rstrip("\r")
+
+
+def key_range(path_, size, field, delimiter, header=False):
+    """
+    Returns the key range of an output file of a sorted merge. Only the
+    first and the last line of an uncompressed file are read; the record
+    count of such a file is not known and left as None. A compressed file,
+    a file with a header row or a last line longer than the end read by
+    ``hadoop fs -tail`` is streamed in full.
+
+    :type path_: str
+    :param path_: HDFS file path
+
+    :type size: int
+    :param size: file size
+
+    :type field: int
+    :param field: zero based position of the key field
+
+    :type delimiter: str
+    :param delimiter: field delimiter
+
+    :type header: bool
+    :param header: whether the file starts with a header row
+
+    :rtype: dict
+    :return: Index entry with the file name, min and max key and records
+    """
+    entry = {"file": posixpath.basename(path_), "records": 0,
+             "min": None, "max": None}
+    if size == 0:
+        return entry
+
+    compressed = posixpath.splitext(path_)[1] in hdfs.CODEC_EXTENSIONS
+    if not compressed and not header:
+        last = last_line(path_, size)
+        if last is not None:
+            entry.update(records=None,
+                         min=sort_key(first_line(path_), field, delimiter),
+                         max=sort_key(last, field, delimiter))
+            return entry
+
+    first = last = None
+    records = 0
+    lines = hdfs.text([path_])
+    if header:
+        next(lines, None)
+    for line in lines:
+        if first is None:
+            first = line
+        last = line
+        records += 1
+
+    entry["records"] = records
+    if records:
+        entry["min"] = sort_key(first, field, delimiter)
+        entry["max"] = sort_key(last, field, delimiter)
+    return entry
+
+
+def build_index(output_path, field, delimiter, header=False, workers=4,
+                pool=None):
+    """
+    Reads the ends of the output files of a sorted merge and returns their
+    key ranges
+
+    :type output_path: str
+    :param output_path: output directory
+
+    :type field: int
+    :param field: zero based position of the key field
+
+    :type delimiter: str
+    :param delimiter: field delimiter
+
+    :type header: bool
+    :param header: whether the output files start with a header row
+
+    :type workers: int
+    :param workers: number of files read concurrently
+
+    :type pool: multiprocessing.pool.ThreadPool
+    :param pool: thread pool reading the files; None for a new pool of
+                 *workers* threads
+
+    :rtype: list
+    :return: Index entries in file name order
+    """
+    from multiprocessing.pool import ThreadPool
+
+    files = sorted(hdfs.ls(output_path))
+    own_pool = pool is None
+    if own_pool:
+        pool = ThreadPool(max(1, workers))
+    try:
+        return pool.map(lambda f: key_range(f[0], f[1], field, delimiter,
+                                            header), files)
+    finally:
+        if own_pool:
+            pool.terminate()
+
+
+def write_index(output_path, entries, field, delimiter):
+    """
+    Writes the index of a sorted merge to *output_path*
+
+    :type output_path: str
+    :param output_path: output directory
+
+    :type entries: list
+    :param entries: index entries, one per output file
+
+    :type field: int
+    :param field: zero based position of the key field
+
+    :type delimiter: str
+    :param delimiter: field delimiter
+
+    :rtype: None
+    :return: None
+    """
+    document = {"sort_key": field, "delimiter": delimiter, "files": entries}
+    hdfs.put_text(posixpath.join(output_path, INDEX_FILE),
+                  json.dumps(document, indent=2, sort_keys=True) + "\n")
+    logger.info("Wrote index of %d files to %s", len(entries), output_path)
+
+
+def select_files(index, low=None, high=None):
+    """
+    Returns the files of an index that may hold keys between *low* and *high*
+    (inclusive)
+
+    :type index: dict
+    :param index: parsed index document
+
+    :type low: str
+    :param low: smallest key of interest, None for no lower bound
+
+    :type high: str
+    :param high: largest key of interest, None for no upper bound
+
+    :rtype: list
+    :return: File names
+    """
+    selected = []
+    for entry in index["files"]:
+        if entry["min"] is None:
+            continue
+        if low is not None and entry["max"] < low:
+            continue
+        if high is not None and entry["min"] > high:
+            continue
+        selected.append(entry["file"])
+    return selected
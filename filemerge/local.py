@@ -0,0 +1,479 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Local streaming merge engine. Instead of a map-reduce job, the input files
+are streamed through the edge node, many per ``hadoop fs -cat`` call, and
+written back with ``hadoop fs -put``. This suits directories that are too
+small to justify a Pig job.
+
+The engine runs as a separate process, launched by the supervisor in place of
+``pig``, and reports progress and counters on standard error in the format
+Pig uses, so both engines are monitored and cancelled the same way.
+"""
+
+import os
+import sys
+import bz2
+import zlib
+import heapq
+import shutil
+import logging
+import tempfile
+import threading
+import subprocess as sp
+from optparse import OptionParser
+import hdfs
+from headers import HEADER_FILE, check_header
+from index import sort_key, write_index
+
+
+logger = logging.getLogger(__name__)
+
+# Supported output codecs: file extension and compressor factory. The
+# extension lets ``hadoop fs -text`` and Hadoop input formats decode the file.
+COMPRESSORS = {
+    "gzip": (".gz",
+             lambda: zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)),
+    "bzip": (".bz2", bz2.BZ2Compressor)
+}
+
+OUTPUT_TEMPLATE = "part-m-%05d"
+
+# Maximum number of sorted runs read at the same time by the external merge
+MAX_FAN_IN = 64
+
+
+class OutputFile(object):
+    """
+    HDFS file written through a ``hadoop fs -put`` process, optionally
+    compressed
+    """
+
+    def __init__(self, path_, codec=None):
+        extension, compressor = COMPRESSORS[codec] if codec else ("", None)
+        self.path = path_ + extension
+        self.compressor = compressor() if compressor else None
+        self.records = 0
+        self.proc = hdfs.put(self.path)
+
+    def write(self, line):
+        if not line.endswith("\n"):
+            line += "\n"
+        self.records += 1
+        if self.compressor:
+            line = self.compressor.compress(line)
+        self.proc.stdin.write(line)
+
+    def close(self):
+        if self.compressor:
+            self.proc.stdin.write(self.compressor.flush())
+        self.proc.stdin.close()
+        if self.proc.wait() != 0:
+            raise sp.CalledProcessError(self.proc.returncode,
+                                        "hadoop fs -put - %s" % self.path)
+
+
+class Progress(object):
+    """
+    Thread safe progress counter that prints Pig style completion lines
+    """
+
+    def __init__(self, total_bytes, stream=None):
+        self.total = max(1, total_bytes)
+        self.done = 0
+        self.percent = -1
+        self.stream = stream or sys.stderr
+        self._lock = threading.Lock()
+
+    def add(self, nbytes):
+        with self._lock:
+            self.done += nbytes
+            percent = min(100, 100 * self.done // self.total)
+            if percent != self.percent:
+                self.percent = percent
+                self.stream.write("LocalMerge - %d%% complete\n" % percent)
+                self.stream.flush()
+
+
+def assign_outputs(files, num_outputs):
+    """
+    Distributes *files* over at most *num_outputs* outputs of similar size,
+    placing the largest files first into the least loaded output
+
+    :type files: list
+    :param files: List of tuples containing file path and size
+
+    :type num_outputs: int
+    :param num_outputs: maximum number of output files
+
+    :rtype: list
+    :return: List of lists of files, one per output
+    """
+    count = max(1, min(num_outputs, len(files)))
+    heap = [(0, i) for i in range(count)]
+    groups = [[] for _ in range(count)]
+    for fpath, size in sorted(files, key=lambda f: (-f[1], f[0])):
+        load, i = heapq.heappop(heap)
+        groups[i].append((fpath, size))
+        heapq.heappush(heap, (load + size, i))
+    return [group for group in groups if group]
+
+
+def input_lines(files, header=None, progress=None):
+    """
+    Streams the lines of *files*, dropping and checking the header row of
+    every file when *header* is given. The files are read in batches, see
+    hdfs.read_each.
+
+    :type files: list
+    :param files: List of tuples containing file path and size
+
+    :type header: str
+    :param header: expected header, None if the files have no header
+
+    :type progress: Progress
+    :param progress: progress counter updated after every file
+
+    :rtype: generator
+    :return: Lines of the files
+    """
+    sizes = dict(files)
+    for fpath, lines in hdfs.read_each(files):
+        for i, line in enumerate(lines):
+            if i == 0 and header is not None:
+                check_header(fpath, header, line.rstrip("\r\n"))
+                continue
+            yield line
+        if progress:
+            progress.add(sizes[fpath])
+
+
+def leading_line(files):
+    """
+    Returns the first line of the first of *files* that has lines, without
+    its terminator, or None
+    """
+    found = hdfs.read_each(files)
+    try:
+        for _, lines in found:
+            for line in lines:
+                return line.rstrip("\r\n")
+        return None
+    finally:
+        found.close()
+
+
+def write_output(path_, lines, header=None, codec=None):
+    """
+    Writes *lines* to the output file *path_*, preceded by *header*
+
+    :rtype: int
+    :return: Number of data records written
+    """
+    output = OutputFile(path_, codec)
+    try:
+        if header is not None:
+            output.write(header)
+        for line in lines:
+            output.write(line)
+    finally:
+        output.close()
+    return output.records - (1 if header is not None else 0)
+
+
+def spill(run, tmpdir):
+    """
+    Sorts *run* in memory and writes its lines to a new file in *tmpdir*
+
+    :type run: list
+    :param run: List of tuples containing sort key and line
+
+    :type tmpdir: str
+    :param tmpdir: local directory for the sorted runs
+
+    :rtype: str
+    :return: Path of the run file
+    """
+    run.sort()
+    fd, path_ = tempfile.mkstemp(suffix=".run", dir=tmpdir)
+    with os.fdopen(fd, "w") as fh:
+        fh.writelines(line for _, line in run)
+    return path_
+
+
+def sorted_runs(lines, key, buffer_size, tmpdir):
+    """
+    Splits *lines* into sorted runs of at most *buffer_size* lines each,
+    spilled to local files
+
+    :type lines: iterable
+    :param lines: lines to sort
+
+    :type key: callable
+    :param key: returns the sort key of a line
+
+    :type buffer_size: int
+    :param buffer_size: maximum number of lines held in memory
+
+    :type tmpdir: str
+    :param tmpdir: local directory for the sorted runs
+
+    :rtype: tuple
+    :return: Tuple containing the run files and the total bytes of the lines
+    """
+    runs, run, nbytes = [], [], 0
+    for line in lines:
+        if not line.endswith("\n"):
+            line += "\n"
+        nbytes += len(line)
+        run.append((key(line), line))
+        if len(run) >= buffer_size:
+            runs.append(spill(run, tmpdir))
+            run = []
+    if run:
+        runs.append(spill(run, tmpdir))
+    return runs, nbytes
+
+
+def read_run(path_, key):
+    """
+    Reads a run file as (key, line) tuples
+    """
+    with open(path_) as fh:
+        for line in fh:
+            yield key(line), line
+
+
+def merge_runs(runs, key, tmpdir):
+    """
+    Merges sorted run files into one sorted stream of lines. With more than
+    MAX_FAN_IN runs, groups of runs are first merged into larger runs, so the
+    number of open files stays bounded.
+
+    :type runs: list
+    :param runs: paths of the run files
+
+    :type key: callable
+    :param key: returns the sort key of a line
+
+    :type tmpdir: str
+    :param tmpdir: local directory for the sorted runs
+
+    :rtype: generator
+    :return: Lines in key order
+    """
+    runs = list(runs)
+    while len(runs) > MAX_FAN_IN:
+        group, runs = runs[:MAX_FAN_IN], runs[MAX_FAN_IN:]
+        fd, path_ = tempfile.mkstemp(suffix=".run", dir=tmpdir)
+        with os.fdopen(fd, "w") as fh:
+            fh.writelines(line for _, line in
+                          heapq.merge(*[read_run(r, key) for r in group]))
+        for run in group:
+            os.remove(run)
+        runs.append(path_)
+    return (line for _, line in heapq.merge(*[read_run(r, key)
+                                              for r in runs]))
+
+
+def write_sorted(output_path, lines, key, target_bytes, num_outputs,
+                 header=None, codec=None):
+    """
+    Writes sorted *lines* to consecutive output files of about
+    *target_bytes* each, and returns the key range of every file
+
+    :rtype: tuple
+    :return: Tuple containing the number of records and the index entries
+    """
+    entries, output, records = [], None, 0
+    low = high = None
+    written = 0
+
+    def close(output):
+        output.close()
+        count = output.records - (1 if header is not None else 0)
+        entries.append({"file": os.path.basename(output.path),
+                        "records": count, "min": low, "max": high})
+        return count
+
+    for line in lines:
+        if output is None or (written >= target_bytes and
+                              len(entries) < num_outputs - 1):
+            if output is not None:
+                records += close(output)
+            written = 0
+            path_ = os.path.join(output_path, OUTPUT_TEMPLATE % len(entries))
+            output = OutputFile(path_, codec)
+            if header is not None:
+                output.write(header)
+            low = key(line)
+        high = key(line)
+        output.write(line)
+        written += len(line)
+
+    if output is not None:
+        records += close(output)
+    return records, entries
+
+
+def merge(input_path, output_path, num_outputs=1, header=False, codec=None,
+          workers=4, sort_field=None, delimiter="\t", sort_buffer=100000):
+    """
+    Merges the files matched by *input_path* into at most *num_outputs*
+    files below *output_path*. The output directory is replaced. With
+    *sort_field*, records are sorted by that field with an external merge
+    sort holding at most *sort_buffer* lines in memory, and an index of the
+    key range of every output file is written.
+
+    :type input_path: str
+    :param input_path: input path or glob
+
+    :type output_path: str
+    :param output_path: output directory
+
+    :type num_outputs: int
+    :param num_outputs: maximum number of output files
+
+    :type header: bool
+    :param header: whether every input file starts with a header row
+
+    :type codec: str
+    :param codec: output compression ('gzip', 'bzip' or None)
+
+    :type workers: int
+    :param workers: number of output files written concurrently
+
+    :type sort_field: int
+    :param sort_field: zero based position of the sort key, None to not sort
+
+    :type delimiter: str
+    :param delimiter: field delimiter
+
+    :type sort_buffer: int
+    :param sort_buffer: maximum number of lines sorted in memory
+
+    :rtype: dict
+    :return: Counters of the merge
+    """
+    from multiprocessing.pool import ThreadPool
+
+    files = hdfs.ls(input_path)
+    if not files:
+        raise IOError("Input path '%s' matches no files" % input_path)
+    total_bytes = sum(size for _, size in files)
+
+    header_row = None
+    if header:
+        header_row = leading_line([(fpath, size) for fpath, size in files
+                                   if size > 0])
+
+    hdfs.rmr(output_path)
+    hdfs.mkdir([output_path])
+    progress = Progress(total_bytes)
+
+    def write_group(args):
+        i, group = args
+        path_ = os.path.join(output_path, OUTPUT_TEMPLATE % i)
+        return write_output(path_, input_lines(group, header_row, progress),
+                            header_row, codec)
+
+    if sort_field is not None:
+        key = lambda line: sort_key(line, sort_field, delimiter)
+        tmpdir = tempfile.mkdtemp(prefix="filemerge-sort-")
+        try:
+            runs, nbytes = sorted_runs(
+                input_lines(files, header_row, progress), key,
+                sort_buffer, tmpdir)
+            records, entries = write_sorted(
+                output_path, merge_runs(runs, key, tmpdir), key,
+                max(1, nbytes // max(1, num_outputs)), num_outputs,
+                header_row, codec)
+        finally:
+            shutil.rmtree(tmpdir)
+        write_index(output_path, entries, sort_field, delimiter)
+        outputs = len(entries)
+    else:
+        groups = assign_outputs(files, num_outputs)
+        pool = ThreadPool(max(1, min(workers, len(groups))))
+        try:
+            records = sum(pool.map(write_group, enumerate(groups)))
+        finally:
+            pool.terminate()
+        outputs = len(groups)
+
+    if header:
+        hdfs.put_text(os.path.join(output_path, HEADER_FILE),
+                      header_row + "\n" if header_row is not None else "")
+    hdfs.put_text(os.path.join(output_path, "_SUCCESS"), "")
+
+    return {"records": records, "bytes": total_bytes, "inputs": len(files),
+            "outputs": outputs}
+
+
+def main():
+    """
+    Runs a local merge; invoked by the supervisor
+
+    :rtype: int
+    :return: exit code
+    """
+    parser = OptionParser("python local.py -i <input> -o <output> [options]")
+    parser.add_option("-i", "--input", dest="input", action="store",
+                      help="Input path or glob")
+    parser.add_option("-o", "--output", dest="output", action="store",
+                      help="Output directory")
+    parser.add_option("-n", "--num-outputs", dest="num_outputs",
+                      action="store", default="1",
+                      help="Maximum number of output files")
+    parser.add_option("--header", dest="header", action="store_true",
+                      default=False, help="Input files have a header row")
+    parser.add_option("-c", "--codec", dest="codec", action="store",
+                      help="Output compression codec (gzip or bzip)")
+    parser.add_option("-w", "--workers", dest="workers", action="store",
+                      default="4", help="Output files written concurrently")
+    parser.add_option("--sort-key", dest="sort_key", action="store",
+                      help="Zero based position of the field to sort by")
+    parser.add_option("--delimiter", dest="delimiter", action="store",
+                      default="\t", help="Field delimiter")
+    parser.add_option("--sort-buffer", dest="sort_buffer", action="store",
+                      default="100000", help="Lines sorted in memory")
+    options, _ = parser.parse_args()
+    if not options.input or not options.output:
+        parser.error("Options '--input' and '--output' are required")
+
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s [%(levelname)s] %(message)s")
+    try:
+        sort_field = int(options.sort_key) \
+            if options.sort_key is not None else None
+        counters = merge(options.input, options.output,
+                         int(options.num_outputs), options.header,
+                         options.codec, int(options.workers), sort_field,
+                         options.delimiter, int(options.sort_buffer))
+    except Exception as ex:
+        logger.error("Local merge failed: %s", ex)
+        return 1
+
+    sys.stderr.write(
+        "Successfully read %(records)d records (%(bytes)d bytes) from: "
+        "\"%(input)s\"\n"
+        "Successfully stored %(records)d records in: \"%(output)s\"\n"
+        "Total records written : %(records)d\n" %
+        dict(counters, input=options.input, output=options.output))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
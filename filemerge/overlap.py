@@ -0,0 +1,241 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Detection of input files matched by more than one entry of a merge plan.
+Input paths are globs such as 'prefix/d_2015*' and 'prefix/d_20150225*';
+two globs can only match the same file if the literal part of one is a prefix
+of the literal part of the other, so only the listings of such candidates are
+compared. Discovery lists every entry anyway and passes its listings in, so
+the check lists nothing itself.
+"""
+
+import posixpath
+import logging
+import hdfs
+
+
+logger = logging.getLogger(__name__)
+
+REJECT = "reject"
+DEDUPE = "dedupe"
+IGNORE = "ignore"
+
+
+class OverlappingInputException(RuntimeError):
+    pass
+
+
+def candidate_overlaps(input_paths):
+    """
+    Finds the pairs of plan entries whose globs may match the same files
+
+    :type input_paths: list
+    :param input_paths: List of tuples containing directory name and input
+                        path glob
+
+    :rtype: list
+    :return: List of tuples with the directory names of the broader and the
+             narrower entry
+    """
+    entries = sorted((hdfs.literal_prefix(p), name)
+                     for name, ipath in input_paths
+                     for p in hdfs.split_paths(ipath))
+
+    # In sorted order, a literal follows every literal that is a prefix of it
+    pairs, ancestors = set(), []
+    for prefix, name in entries:
+        while ancestors and not prefix.startswith(ancestors[-1][0]):
+            ancestors.pop()
+        for _, other in ancestors:
+            if other != name:
+                pairs.add((other, name))
+        ancestors.append((prefix, name))
+    return sorted(pairs)
+
+
+def specificity(ipath):
+    """
+    Returns the length of the longest literal prefix of *ipath*; files matched
+    by several entries are assigned to the most specific one
+    """
+    return max(len(hdfs.literal_prefix(p)) for p in hdfs.split_paths(ipath))
+
+
+def find_overlaps(input_paths, listings=None):
+    """
+    Compares the files of the entries that may overlap and returns the files
+    matched by more than one entry
+
+    :type input_paths: list
+    :param input_paths: List of tuples containing directory name and input
+                        path glob
+
+    :type listings: dict
+    :param listings: mapping of directory name to the files of its input
+                     path; None to list the candidate entries with
+                     hdfs.ls_each
+
+    :rtype: tuple
+    :return: Tuple containing a mapping of file path to the directory names
+             matching it (shared files only), and a mapping of directory name
+             to its listing (candidate entries only)
+    """
+    pairs = candidate_overlaps(input_paths)
+    if not pairs:
+        return dict(), dict()
+
+    names = sorted(set(name for pair in pairs for name in pair))
+    if listings is None:
+        globs = dict(input_paths)
+        listings = dict(zip(names, hdfs.ls_each([globs[n] for n in names])))
+    else:
+        listings = dict((name, listings[name]) for name in names)
+
+    owners = dict()
+    for name in names:
+        for fpath, _ in listings[name]:
+            owners.setdefault(fpath, []).append(name)
+    shared = dict((fpath, found) for fpath, found in owners.items()
+                  if len(found) > 1)
+    return shared, listings
+
+
+def compact_paths(files, removed, root):
+    """
+    Expresses *files* as a small list of paths: a directory is used in place
+    of its files if it holds none of the *removed* files
+
+    :type files: list
+    :param files: file paths to keep
+
+    :type removed: set
+    :param removed: file paths to leave out
+
+    :type root: str
+    :param root: directory below which paths are compacted
+
+    :rtype: list
+    :return: Sorted list of directories and files
+    """
+    root = root.rstrip("/")
+    tainted = set()
+    for fpath in removed:
+        parent = posixpath.dirname(fpath)
+        while len(parent) > len(root):
+            tainted.add(parent)
+            parent = posixpath.dirname(parent)
+
+    paths = set()
+    for fpath in files:
+        if not fpath.startswith(root + "/"):
+            paths.add(fpath)
+            continue
+        parts = fpath[len(root):].strip("/").split("/")
+        path_ = root
+        for part in parts[:-1]:
+            path_ = posixpath.join(path_, part)
+            if path_ not in tainted:
+                break
+        else:
+            path_ = fpath
+        paths.add(path_)
+    return sorted(paths)
+
+
+def check_overlaps(input_paths, action=REJECT, listings=None):
+    """
+    Makes sure that no input file is merged into more than one output. With
+    REJECT, overlapping entries raise an exception; with DEDUPE, each shared
+    file is kept only by the most specific entry matching it, and the input
+    paths of the other entries are rewritten to comma separated lists of the
+    paths they keep, as are their *listings*.
+
+    :type input_paths: list
+    :param input_paths: List of tuples containing directory name and input
+                        path glob
+
+    :type action: str
+    :param action: REJECT, DEDUPE or IGNORE
+
+    :type listings: dict
+    :param listings: mapping of directory name to the files of its input
+                     path, updated for rewritten entries; None to list the
+                     candidate entries
+
+    :rtype: list
+    :return: List of tuples containing directory name and input path;
+             entries left without files are dropped
+
+    :exception: OverlappingInputException
+    """
+    if action == IGNORE:
+        return input_paths
+
+    # Entries listed twice would write the same output directory
+    counts = dict()
+    for name, _ in input_paths:
+        counts[name] = counts.get(name, 0) + 1
+    repeated = sorted(name for name, count in counts.items() if count > 1)
+    if repeated and action == REJECT:
+        raise OverlappingInputException(
+            "Directories listed more than once: %s" % ", ".join(repeated))
+    elif repeated:
+        logger.warning("Ignoring repeated directories: %s",
+                       ", ".join(repeated))
+        seen = set()
+        input_paths = [(name, ipath) for name, ipath in input_paths
+                       if name not in seen and not seen.add(name)]
+
+    shared, found = find_overlaps(input_paths, listings)
+    if not shared:
+        return input_paths
+
+    if action == REJECT:
+        examples = sorted(shared.items())[:5]
+        raise OverlappingInputException(
+            "%d input files are matched by more than one directory: %s" % (
+                len(shared), "; ".join("%s (%s)" % (fpath, ", ".join(names))
+                                       for fpath, names in examples)))
+    elif action != DEDUPE:
+        raise OverlappingInputException(
+            "Unsupported overlap action '%s'" % action)
+
+    globs = dict(input_paths)
+    removed = dict()
+    for fpath, names in shared.items():
+        keeper = max(names, key=lambda n: (specificity(globs[n]), n))
+        for name in names:
+            if name != keeper:
+                removed.setdefault(name, set()).add(fpath)
+
+    deduped = []
+    for name, ipath in input_paths:
+        if name not in removed:
+            deduped.append((name, ipath))
+            continue
+        kept = [(fpath, size) for fpath, size in found[name]
+                if fpath not in removed[name]]
+        if listings is not None:
+            listings[name] = kept
+        logger.warning("%s: %d input files are merged by more specific "
+                       "directories", name, len(removed[name]))
+        if not kept:
+            logger.warning("%s: no input files left; skipping", name)
+            continue
+        root = posixpath.dirname(
+            hdfs.literal_prefix(hdfs.split_paths(ipath)[0]))
+        deduped.append((name, ",".join(compact_paths(
+            [fpath for fpath, _ in kept], removed[name], root))))
+    return deduped
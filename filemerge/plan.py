@@ -0,0 +1,585 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Programmatic interface to filemerge. A MergePlan is built from the same
+options as the command line and goes through four steps:
+
+    plan = MergePlan.create(topic="clickstream", input_prefix="/data/cs",
+                            output_prefix="/data/cs-merged", queue="etl",
+                            lookback=3, verify=True)
+    plan.discover()   # directories to merge
+    plan.schedule()   # Pig scripts or local merges, one per directory
+    plan.execute()    # run them under the supervisor
+    plan.report()     # per-directory metrics
+
+A long-lived process can drive many plans and pass one PigSupervisor to
+execute() for all of them. A plan reads HDFS files with a pool of threads,
+which close() stops; plans can also share a pool passed to them.
+"""
+
+import os
+import logging
+from optparse import OptionParser
+import filemerge as fm
+
+
+logger = logging.getLogger(__name__)
+
+
+class QuietOptionParser(OptionParser):
+    """
+    Option parser of the programmatic interface: invalid options raise the
+    exceptions of filemerge.check_options without printing the command line
+    usage
+    """
+
+    def print_help(self, file=None):
+        pass
+
+
+class MergeJob(object):
+    """
+    A directory of the plan: where it is read from and written to, and the
+    state collected for it while the plan runs
+    """
+
+    __slots__ = ("name", "input_path", "output_path", "files", "previous",
+                 "previous_files", "header", "snapshot", "runner",
+                 "cleaning")
+
+    def __init__(self, name, input_path, output_path):
+        self.name = name
+        self.input_path = input_path
+        self.output_path = output_path
+        self.files = None
+        self.previous = None
+        self.previous_files = []
+        self.header = None
+        self.snapshot = None
+        self.runner = None
+        self.cleaning = False
+
+    @property
+    def merge_input(self):
+        """
+        Input path of the merge: the sources, if any, and the previous output
+        folded into the merge
+        """
+        paths = [self.input_path] if self.files or self.files is None else []
+        if self.previous:
+            paths.append(self.previous)
+        return ",".join(paths)
+
+    def __repr__(self):
+        return "MergeJob(%r, %r, %r)" % (self.name, self.input_path,
+                                         self.output_path)
+
+
+class MergePlan(object):
+    """
+    Merges the directories of one topic
+    """
+
+    def __init__(self, options, mode=None, pool=None):
+        """
+        :type options: object
+        :param options: Options object as parsed by filemerge's OptionParser
+
+        :type mode: str
+        :param mode: Type of input source (see filemerge.check_options);
+                     None to check the options and derive it
+
+        :type pool: multiprocessing.pool.ThreadPool
+        :param pool: thread pool reading HDFS files for the plan; None for a
+                     pool of the plan, stopped by close()
+        """
+        if mode is None:
+            parser = QuietOptionParser()
+            fm.add_options(parser)
+            mode = fm.check_options(parser, options)
+        self.options = options
+        self.mode = mode
+        self.jobs = []
+        self.skipped = []
+        self._pool = pool
+        self._own_pool = pool is None
+
+    @classmethod
+    def create(cls, pool=None, **kwargs):
+        """
+        Builds a plan from keyword arguments named like the destinations of
+        the command line options (e.g. input_prefix, num_reducers, verify).
+        Options that are not given take their command line defaults.
+
+        :type pool: multiprocessing.pool.ThreadPool
+        :param pool: thread pool reading HDFS files for the plan; None for a
+                     pool of the plan
+
+        :rtype: MergePlan
+        :return: The plan
+
+        :exception: TypeError for unknown options, and the exceptions of
+                    filemerge.check_options
+        """
+        parser = QuietOptionParser()
+        fm.add_options(parser)
+        options = parser.get_default_values()
+        unknown = sorted(set(kwargs) - set(vars(options)))
+        if unknown:
+            raise TypeError("Unknown options: %s" % ", ".join(unknown))
+        for key, value in kwargs.items():
+            setattr(options, key, value)
+        return cls(options, fm.check_options(parser, options), pool)
+
+    @property
+    def pool(self):
+        """
+        Thread pool of the overlap check, header detection, index builds and
+        verifications of the plan. It is created on first use, with
+        '--verify-workers' threads for each of the '--parallel' jobs.
+        """
+        if self._pool is None:
+            from multiprocessing.pool import ThreadPool
+            self._pool = ThreadPool(max(1, int(self.options.verify_workers)) *
+                                    max(1, int(self.options.parallel)))
+        return self._pool
+
+    def close(self):
+        """
+        Stops the thread pool of the plan; a pool passed to the plan is left
+        running
+        """
+        if self._own_pool and self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+    def discover(self, input_paths=None):
+        """
+        Computes the directories to merge
+
+        :type input_paths: list
+        :param input_paths: List of tuples containing directory name and input
+                            path glob, as returned by filemerge.getpaths; None
+                            to compute it from the options
+
+        :rtype: list
+        :return: MergeJob instances; directories whose output would be
+                   overwritten although its sources may have been removed are
+                   left out, and listed in *skipped*
+
+        :exception: overlap.OverlappingInputException
+        """
+        import hdfs
+        import overlap
+
+        if input_paths is None:
+            input_paths = fm.getpaths(self.options, mode=self.mode)
+
+        # List the input files of all directories once
+        listings = dict()
+        for (dirname, _), files in zip(input_paths, hdfs.ls_each(
+                [ipath for _, ipath in input_paths])):
+            listings.setdefault(dirname, files)
+
+        # Make sure that every input file is merged into one output only
+        input_paths = overlap.check_overlaps(
+            input_paths, self.options.overlap, listings)
+        self.jobs = [MergeJob(dirname, ipath,
+                              os.path.join(self.options.output_prefix, dirname))
+                     for dirname, ipath in input_paths]
+        self._list_inputs(listings)
+        logger.info("Planned %d directories for topic '%s'", len(self.jobs),
+                    self.options.topic)
+        return self.jobs
+
+    def _list_inputs(self, listings):
+        """
+        Assigns the input files of all jobs and drops the jobs that have
+        nothing to merge
+
+        :type listings: dict
+        :param listings: mapping of directory name to the files of its input
+                         path
+        """
+        for job in self.jobs:
+            job.files = listings[job.name]
+        if self._cleanup_action():
+            self._fold_outputs()
+
+        empty = [job for job in self.jobs
+                 if not job.files and not job.previous]
+        if empty:
+            logger.info("Skipping %d directories without input files",
+                        len(empty))
+            logger.debug("Directories without input files: %s",
+                         ", ".join(job.name for job in empty))
+            self.jobs = [job for job in self.jobs
+                         if job.files or job.previous]
+
+    def _fold_outputs(self):
+        """
+        Folds existing outputs into the input of their jobs. With source
+        cleanup, the sources of an existing output may be gone: overwriting
+        it with a merge of new sources only would lose their records.
+        """
+        import cleanup
+        import hdfs
+
+        previous = dict((job.name, os.path.join(
+            self.options.output_prefix, cleanup.PREVIOUS_DIR, job.name))
+            for job in self.jobs)
+        listings = hdfs.ls_each(
+            [job.output_path for job in self.jobs] +
+            [previous[job.name] for job in self.jobs], include_hidden=True)
+        outputs, staged = listings[:len(self.jobs)], listings[len(self.jobs):]
+
+        self.skipped = []
+        for job, output, staged_files in zip(self.jobs, outputs, staged):
+            staged_files = [(fpath, size) for fpath, size in staged_files
+                            if not hdfs.is_hidden(fpath, previous[job.name])]
+            data = [(fpath, size) for fpath, size in output
+                    if not hdfs.is_hidden(fpath, job.output_path)]
+            markers = set(os.path.basename(fpath) for fpath, _ in output)
+            if staged_files:
+                # An earlier fold did not complete; merge its staged output
+                job.previous = previous[job.name]
+                job.previous_files = staged_files
+            elif data and job.files and "_SUCCESS" in markers:
+                # Outputs of failed jobs are incomplete and can be replaced
+                if cleanup.CLEANUP_FILE not in markers:
+                    self.skipped.append(job)
+                    continue
+                job.previous = previous[job.name]
+                job.previous_files = data
+
+        if self.skipped:
+            logger.error("Skipping %d directories; refusing to overwrite "
+                         "outputs that were not written with source cleanup, "
+                         "their sources may be gone: %s", len(self.skipped),
+                         ", ".join(job.output_path for job in self.skipped))
+            self.jobs = [job for job in self.jobs if job not in self.skipped]
+
+    def _sort_records(self):
+        """
+        Returns the Pig statements sorting the records by the sort key
+        """
+        import headers
+        import index
+
+        if self.options.sort_key is None:
+            return ""
+        return "\n    ".join([
+            "S = foreach B generate $0 AS line, "
+            "(chararray)STRSPLIT($0, %s, %d).$%d AS key;" % (
+                headers.pig_string(index.pig_regex(self.delimiter)),
+                self.options.sort_key + 2, self.options.sort_key),
+            "O = order S by key;",
+            "B = foreach O generate line;"])
+
+    @property
+    def delimiter(self):
+        """
+        Field delimiter of the sort key; escapes such as '\\t' are decoded
+        """
+        return self.options.delimiter.decode("string_escape")
+
+    def _pig_script(self):
+        """
+        Returns the path of the parameterized Pig script of the plan. The
+        paths of a job and its header are passed as the parameters INPUT,
+        OUTPUT and HEADER, along with its resource settings.
+        """
+        import resources
+        import scriptcache
+
+        options = self.options
+        num_reducers = options.num_reducers if options.num_reducers else 10
+
+        # Assign compression codec
+        if options.codec:
+            set_compression_enabled = "set output.compression.enabled true"
+            set_compression_codec = "set output.compression.codec %s" % \
+                                    fm.get_compression_codec(options.codec)
+        else:
+            set_compression_enabled = "set output.compression.enabled false"
+            set_compression_codec = ""
+
+        # Filter out the common header of the input files
+        filter_header = ""
+        if options.header:
+            filter_header = "A = filter A by line != '$HEADER';"
+
+        # Container sizes are passed with the parameters of every job
+        set_resources = ""
+        if options.resource_profile != resources.NONE:
+            set_resources = resources.set_statements()
+
+        substitutions = {
+            "@OUTPUT_PATH": "$OUTPUT",
+            "@INPUT_PATH": "$INPUT",
+            "@NUM_REDUCERS": num_reducers,
+            "@SET_COMPRESSION_ENABLED": set_compression_enabled,
+            "@SET_COMPRESSION_CODEC": set_compression_codec,
+            "@QUEUE": options.queue,
+            "@FILTER_HEADER": filter_header,
+            "@SORT_RECORDS": self._sort_records(),
+            "@SET_RESOURCES": set_resources
+        }
+
+        # Generate the Pig script using substitutions, unless it is cached
+        scriptcache.prune_scripts(
+            retention_days=int(options.script_retention))
+        pig_script_str = fm.materialize(fm.PIG_TEMPLATE, substitutions)
+        return scriptcache.cached_script(options.topic, pig_script_str)
+
+    def schedule(self):
+        """
+        Creates the runner of every job: a run of the plan's Pig script,
+        cached in 'scripts/', or a merge by the local engine
+
+        :rtype: list
+        :return: PigJob (or LocalJob) instances
+        """
+        import headers
+        import resources
+        from supervisor import PigJob, LocalJob
+
+        options = self.options
+        num_reducers = options.num_reducers if options.num_reducers else 10
+        script = None
+
+        # List the inputs of Pig jobs that need their size or header
+        use_resources = options.resource_profile != resources.NONE
+        profiles = None
+        if use_resources and options.resource_profiles:
+            profiles = resources.load_profiles(options.resource_profiles)
+
+        for job in self.jobs:
+            log_path = os.path.join("logs", "%s-%s.log" % (options.topic,
+                                                           job.name))
+
+            # The local engine handles headers itself and needs no script
+            if options.engine == "local":
+                codec = options.codec.lower() if options.codec else None
+                job.runner = LocalJob(job.name, job.merge_input,
+                                      job.output_path, int(num_reducers),
+                                      options.header, codec, log_path,
+                                      options.sort_key, self.delimiter,
+                                      int(options.sort_buffer))
+                continue
+
+            if script is None:
+                script = self._pig_script()
+            params = {"INPUT": job.merge_input, "OUTPUT": job.output_path}
+
+            # Find the common header of the input files, to be filtered out
+            if options.header:
+                job.header = headers.detect_header(
+                    job.files, int(options.verify_workers), self.pool)
+                params["HEADER"] = headers.pig_string(job.header or "")[1:-1]
+
+            # Size the containers for the input
+            job_resources = None
+            if use_resources:
+                job_resources = resources.job_resources(
+                    job.files + job.previous_files, profiles,
+                    options.resource_profile)
+                params.update(job_resources.pop("params"))
+
+            job.runner = PigJob(job.name, script, job.merge_input,
+                                job.output_path, log_path, params)
+            if job_resources:
+                job.runner.metrics["resources"] = job_resources
+
+        return [job.runner for job in self.jobs]
+
+    def dry_run(self):
+        """
+        Writes the parameters of every Pig job to a parameter file next to
+        the plan's script, and logs the command line running each job,
+        instead of executing them
+
+        :rtype: list
+        :return: Command lines of the jobs, one list of arguments per job
+        """
+        import scriptcache
+        from supervisor import command_line
+
+        commands = []
+        for job in self.jobs:
+            runner = job.runner
+            if runner.script is not None:
+                runner.param_file = scriptcache.write_params(
+                    self.options.topic, job.name, runner.params)
+            cmd = runner.command()
+            logger.info("%s: %s", job.name, command_line(cmd))
+            commands.append(cmd)
+        return commands
+
+    def _cleanup_action(self):
+        import cleanup
+
+        if self.options.delete_source:
+            return cleanup.DELETE
+        elif self.options.archive_source:
+            return cleanup.ARCHIVE
+        return None
+
+    def _start_job(self, job):
+        import hdfs
+
+        if not self._cleanup_action():
+            return
+
+        # Move an output that is folded into the merge out of its way, unless
+        # an earlier attempt did so already
+        if job.previous and not hdfs.ls(job.previous):
+            hdfs.rmr(job.previous)
+            hdfs.mkdir([os.path.dirname(job.previous)])
+            hdfs.mv([job.output_path], os.path.dirname(job.previous))
+
+        # List the inputs that a successful merge allows to clean up
+        job.snapshot = hdfs.ls(job.runner.input_path)
+
+    def _complete_job(self, job, supervisor):
+        import cleanup
+        import hdfs
+        import headers
+        import index
+        from verify import verify_merge, VerificationException
+
+        options = self.options
+        runner = job.runner
+
+        # Store the header next to the Pig output; the local engine writes
+        # it into every output file and the header file itself
+        header = None
+        if options.header:
+            header_file = os.path.join(job.output_path, headers.HEADER_FILE)
+            if options.engine == "local":
+                header = headers.first_line(header_file)
+            else:
+                header = job.header
+                if header is not None:
+                    hdfs.put_text(header_file, header + "\n")
+            runner.metrics["header"] = header
+
+        # Index the key range of every Pig output file; the local engine
+        # writes the index while merging
+        if options.sort_key is not None and options.engine != "local":
+            index.write_index(
+                job.output_path,
+                index.build_index(job.output_path, options.sort_key,
+                                  self.delimiter,
+                                  workers=int(options.verify_workers),
+                                  pool=self.pool),
+                options.sort_key, self.delimiter)
+
+        # Verify the output against the input
+        if options.verify:
+            result = verify_merge(runner.input_path, job.output_path,
+                                  int(options.verify_workers), header,
+                                  self.pool)
+            runner.metrics["verification"] = result
+            if not result["verified"]:
+                raise VerificationException(
+                    "Verification failed for '%s'" % job.output_path)
+
+        # Remove the merged inputs, unless the run has been interrupted
+        cleanup_action = self._cleanup_action()
+        if cleanup_action:
+            if supervisor.cancelled:
+                raise KeyboardInterrupt()
+            journal = options.journal or os.path.join(
+                "journal", "%s.jsonl" % options.topic)
+            cleanup.check_unchanged(job.snapshot,
+                                    runner.metrics["verification"])
+            # From here on, sources may be gone; the output must stay
+            job.cleaning = True
+            staged = job.previous + "/" if job.previous else None
+            previous = [(fpath, size) for fpath, size in job.snapshot
+                        if staged and fpath.startswith(staged)]
+            sources = [(fpath, size) for fpath, size in job.snapshot
+                       if not staged or not fpath.startswith(staged)]
+            runner.metrics["cleanup"] = cleanup.cleanup_source(
+                cleanup_action, sources, job.name,
+                options.input_prefix, journal,
+                archive_prefix=options.archive_source, previous=previous,
+                output_path=job.output_path)
+            if job.previous:
+                hdfs.rmr(job.previous)
+            cleanup.mark_output(job.output_path, runner.metrics["cleanup"])
+
+    def _fail_job(self, job):
+        """
+        Withdraws the output of a job that failed or was cancelled before its
+        sources were cleaned up: without _SUCCESS, the next run replaces it
+        instead of refusing to overwrite an output without cleanup marker
+        """
+        import hdfs
+
+        if not self._cleanup_action() or job.cleaning:
+            return
+        hdfs.rmr(os.path.join(job.output_path, "_SUCCESS"))
+        logger.warning("%s: output withdrawn; the next run merges it again",
+                       job.name)
+
+    def execute(self, supervisor=None):
+        """
+        Runs the scheduled jobs
+
+        :type supervisor: PigSupervisor
+        :param supervisor: supervisor to run the jobs with; None for a new one
+                           running '--parallel' jobs at a time
+
+        :rtype: list
+        :return: MergeJob instances
+
+        :exception: the first exception raised by a job, KeyboardInterrupt
+                    when interrupted
+        """
+        from supervisor import PigSupervisor
+
+        if supervisor is None:
+            supervisor = PigSupervisor(int(self.options.parallel))
+        if not os.path.exists("logs"):
+            os.mkdir("logs", 0o700)
+
+        jobs = dict((job.name, job) for job in self.jobs)
+        supervisor.run([job.runner for job in self.jobs],
+                       on_start=lambda runner: self._start_job(
+                           jobs[runner.name]),
+                       on_success=lambda runner: self._complete_job(
+                           jobs[runner.name], supervisor),
+                       on_failure=lambda runner: self._fail_job(
+                           jobs[runner.name]))
+        return self.jobs
+
+    def report(self):
+        """
+        Returns the metrics of every job that has been started, followed by
+        the directories that were skipped
+
+        :rtype: list
+        :return: List of dictionaries, one per directory
+        """
+        from supervisor import PENDING, SKIPPED
+
+        return [fm.job_metrics(job.runner) for job in self.jobs
+                if job.runner is not None and
+                job.runner.status != PENDING] + \
+            [{"dirname": job.name, "input_path": job.input_path,
+              "output_path": job.output_path, "status": SKIPPED}
+             for job in self.skipped]
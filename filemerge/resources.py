@@ -0,0 +1,182 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Resource profiles for Pig jobs. The container memory and split sizes of a job
+are derived from the size of its input: the profile is chosen by the total
+input size, which bounds the data every reducer handles, while mappers get
+the smallest profile when no split can exceed its split size. The settings
+are passed to the shared Pig script as parameters.
+"""
+
+import json
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+GB = 1024 * MB
+
+AUTO = "auto"
+NONE = "none"
+
+# Profiles in increasing order of size; a job gets the first profile whose
+# max_input_gb covers its input (None covers any input)
+PROFILES = [
+    {"name": "small", "max_input_gb": 1,
+     "map_memory_mb": 1024, "reduce_memory_mb": 1024, "split_mb": 128},
+    {"name": "medium", "max_input_gb": 50,
+     "map_memory_mb": 2048, "reduce_memory_mb": 2048, "split_mb": 256},
+    {"name": "large", "max_input_gb": 500,
+     "map_memory_mb": 3072, "reduce_memory_mb": 4096, "split_mb": 512},
+    {"name": "xlarge", "max_input_gb": None,
+     "map_memory_mb": 4096, "reduce_memory_mb": 8192, "split_mb": 1024}
+]
+
+# Share of the container memory given to the JVM heap
+HEAP_FRACTION = 0.8
+
+# Hadoop properties set by the Pig script and the parameters holding them
+PROPERTIES = [
+    ("mapreduce.map.memory.mb", "MAP_MEMORY_MB"),
+    ("mapreduce.map.java.opts", "MAP_JAVA_OPTS"),
+    ("mapreduce.reduce.memory.mb", "REDUCE_MEMORY_MB"),
+    ("mapreduce.reduce.java.opts", "REDUCE_JAVA_OPTS"),
+    ("mapreduce.input.fileinputformat.split.minsize", "SPLIT_MINSIZE"),
+    ("mapreduce.input.fileinputformat.split.maxsize", "SPLIT_MAXSIZE")
+]
+
+
+class ResourceProfileException(RuntimeError):
+    pass
+
+
+def load_profiles(path_):
+    """
+    Reads resource profiles from a JSON file holding a list of profiles in
+    the format of PROFILES
+
+    :type path_: str
+    :param path_: path to the local JSON file
+
+    :rtype: list
+    :return: Profiles in increasing order of size
+
+    :exception: ResourceProfileException
+    """
+    with open(path_) as fh:
+        profiles = json.load(fh)
+
+    keys = set(PROFILES[0])
+    for profile in profiles:
+        missing = keys - set(profile)
+        if missing:
+            raise ResourceProfileException(
+                "Profile %r in '%s' lacks %s" % (
+                    profile.get("name"), path_, ", ".join(sorted(missing))))
+    return sorted(profiles, key=lambda p: (p["max_input_gb"] is None,
+                                           p["max_input_gb"]))
+
+
+def select_profile(input_bytes, profiles=None, name=AUTO):
+    """
+    Returns the profile for an input of *input_bytes*, or the profile called
+    *name* unless it is AUTO
+
+    :type input_bytes: int
+    :param input_bytes: total size of the input
+
+    :type profiles: list
+    :param profiles: profiles in increasing order of size
+
+    :type name: str
+    :param name: profile name or AUTO
+
+    :rtype: dict
+    :return: The profile
+
+    :exception: ResourceProfileException
+    """
+    profiles = profiles or PROFILES
+    if name != AUTO:
+        for profile in profiles:
+            if profile["name"] == name:
+                return profile
+        raise ResourceProfileException("Unknown resource profile '%s'" % name)
+
+    for profile in profiles:
+        limit = profile["max_input_gb"]
+        if limit is None or input_bytes <= limit * GB:
+            return profile
+    return profiles[-1]
+
+
+def java_opts(memory_mb):
+    """
+    Returns the JVM options for a container of *memory_mb* megabytes
+    """
+    return "-Xmx%dm" % int(memory_mb * HEAP_FRACTION)
+
+
+def job_resources(files, profiles=None, name=AUTO):
+    """
+    Derives the resource settings of a job from its input files
+
+    :type files: list
+    :param files: List of tuples containing file path and size
+
+    :type profiles: list
+    :param profiles: profiles in increasing order of size
+
+    :type name: str
+    :param name: profile name or AUTO
+
+    :rtype: dict
+    :return: Chosen profile, input statistics and the Pig parameters
+    """
+    profiles = profiles or PROFILES
+    input_bytes = sum(size for _, size in files)
+    largest = max([size for _, size in files] or [0])
+    profile = select_profile(input_bytes, profiles, name)
+
+    # Mappers read one file each (split combination is off), so no mapper
+    # reads more than the largest file or the split size
+    map_memory = profile["map_memory_mb"]
+    if name == AUTO and min(largest, profile["split_mb"] * MB) <= \
+            profiles[0]["split_mb"] * MB:
+        map_memory = profiles[0]["map_memory_mb"]
+
+    split = str(profile["split_mb"] * MB)
+    params = {
+        "MAP_MEMORY_MB": str(map_memory),
+        "MAP_JAVA_OPTS": java_opts(map_memory),
+        "REDUCE_MEMORY_MB": str(profile["reduce_memory_mb"]),
+        "REDUCE_JAVA_OPTS": java_opts(profile["reduce_memory_mb"]),
+        "SPLIT_MINSIZE": split,
+        "SPLIT_MAXSIZE": split
+    }
+    return {"profile": profile["name"],
+            "input_files": len(files),
+            "input_bytes": input_bytes,
+            "largest_file": largest,
+            "params": params}
+
+
+def set_statements():
+    """
+    Returns the Pig statements applying the resource parameters
+    """
+    return "\n    ".join("set %s '$%s'" % (prop, param)
+                         for prop, param in PROPERTIES)
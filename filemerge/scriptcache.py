@@ -0,0 +1,173 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Cache of generated Pig scripts. Scripts are parameterized with Pig's
+``-param`` mechanism, so one script serves every directory of a topic and
+configuration. It is stored under a name derived from its content and only
+written if it does not exist yet; scripts not used for a while are pruned.
+Dry runs also store the parameters of every job in a Pig parameter file, so
+a job can be run by hand with ``pig -param_file <file> -f <script>``.
+"""
+
+import os
+import time
+import hashlib
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+SCRIPT_DIR = "scripts"
+
+# Scripts unused for this many days are deleted
+RETENTION_DAYS = 30
+
+
+def script_path(topic, content, directory=SCRIPT_DIR):
+    """
+    Returns the path under which the script *content* is cached
+
+    :type topic: str
+    :param topic: topic name, used as a readable prefix
+
+    :type content: str
+    :param content: Pig script
+
+    :type directory: str
+    :param directory: local script directory
+
+    :rtype: str
+    :return: Path of the script
+    """
+    digest = hashlib.sha1(content).hexdigest()[:12]
+    return os.path.join(directory, "%s-%s.pig" % (topic, digest))
+
+
+def cached_script(topic, content, directory=SCRIPT_DIR):
+    """
+    Writes the script *content* unless an identical script is cached, and
+    marks it as used
+
+    :type topic: str
+    :param topic: topic name, used as a readable prefix
+
+    :type content: str
+    :param content: Pig script
+
+    :type directory: str
+    :param directory: local script directory
+
+    :rtype: str
+    :return: Path of the script
+    """
+    path_ = script_path(topic, content, directory)
+    if os.path.exists(path_):
+        try:
+            # Refresh the modification time, which retention is based on
+            os.utime(path_, None)
+            logger.debug("Reusing Pig script %s", path_)
+            return path_
+        except OSError as ex:
+            # A concurrent run pruned it in the meantime; write it again
+            logger.debug("Could not reuse %s: %s", path_, ex)
+
+    _write(path_, content, directory)
+    logger.info("Wrote Pig script %s", path_)
+    return path_
+
+
+def _write(path_, content, directory):
+    """
+    Writes *content* to *path_* in *directory*, replacing it atomically
+    """
+    if not os.path.isdir(directory):
+        try:
+            os.mkdir(directory, 0o700)
+        except OSError:
+            # Created by a concurrent run
+            if not os.path.isdir(directory):
+                raise
+    # Write to a temporary name first; concurrent runs may race for the path
+    tmp_path = "%s.%d.tmp" % (path_, os.getpid())
+    with open(tmp_path, "w") as fh:
+        fh.write(content)
+    os.rename(tmp_path, path_)
+
+
+def write_params(topic, dirname, params, directory=SCRIPT_DIR):
+    """
+    Writes the parameters of the job of one directory to a Pig parameter
+    file, one KEY=VALUE line per parameter
+
+    :type topic: str
+    :param topic: topic name, used as a readable prefix
+
+    :type dirname: str
+    :param dirname: name of the directory merged by the job
+
+    :type params: dict
+    :param params: Pig parameters of the job
+
+    :type directory: str
+    :param directory: local script directory
+
+    :rtype: str
+    :return: Path of the parameter file
+    """
+    path_ = os.path.join(directory, "%s-%s.params" % (topic, dirname))
+    _write(path_, "".join("%s=%s\n" % (key, params[key])
+                          for key in sorted(params)), directory)
+    return path_
+
+
+def prune_scripts(directory=SCRIPT_DIR, retention_days=RETENTION_DAYS,
+                  now=None):
+    """
+    Deletes the scripts and parameter files in *directory* that have not
+    been used for *retention_days* days
+
+    :type directory: str
+    :param directory: local script directory
+
+    :type retention_days: int
+    :param retention_days: days after which an unused script is deleted
+
+    :type now: float
+    :param now: current time in seconds since the epoch
+
+    :rtype: list
+    :return: Paths of the deleted scripts
+    """
+    if not os.path.isdir(directory):
+        return []
+
+    cutoff = (now or time.time()) - retention_days * 86400
+    pruned = []
+    for name in sorted(os.listdir(directory)):
+        path_ = os.path.join(directory, name)
+        if not name.endswith((".pig", ".params")) or \
+                not os.path.isfile(path_):
+            continue
+        try:
+            if os.path.getmtime(path_) < cutoff:
+                os.remove(path_)
+                pruned.append(path_)
+        except OSError as ex:
+            # Another run may have pruned or refreshed it concurrently
+            logger.debug("Could not prune %s: %s", path_, ex)
+    if pruned:
+        logger.info("Pruned %d Pig scripts unused for %d days", len(pruned),
+                    retention_days)
+    return pruned
@@ -0,0 +1,413 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Supervisor for concurrent Pig jobs. Each job runs in its own ``pig``
+subprocess; a pool of worker threads launches them and parses their standard
+error while they run, picking up Hadoop job ids, progress percentages and the
+counters of Pig's final summary. The supervisor periodically logs an
+aggregate progress line for all jobs, and on SIGINT kills every job in flight.
+"""
+
+import os
+import re
+import sys
+import time
+import pipes
+import signal
+import logging
+import threading
+import subprocess as sp
+from collections import deque
+
+
+logger = logging.getLogger(__name__)
+
+PIG = "pig"
+MAPRED = "mapred"
+LOCAL_ENGINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "local.py")
+
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+# Planned, but left out of the run (see MergePlan.skipped)
+SKIPPED = "skipped"
+
+JOB_ID_RE = re.compile(r"\b(job_\d+_\d+)\b")
+PROGRESS_RE = re.compile(r"\b(\d{1,3})% complete")
+COUNTER_RE = re.compile(r"^\s*(Total [A-Za-z ]+?)\s*:\s*(\d+)\s*$")
+READ_RE = re.compile(r"Successfully read (\d+) records")
+STORED_RE = re.compile(r"Successfully stored (\d+) records")
+
+
+def command_line(cmd):
+    """
+    Formats the command *cmd* as a shell command line
+
+    :type cmd: list
+    :param cmd: command and arguments
+
+    :rtype: str
+    :return: Command line, quoted for the shell
+    """
+    return " ".join(pipes.quote(arg) for arg in cmd)
+
+
+class PigJob(object):
+    """
+    A Pig script to be run by the supervisor, together with the state the
+    supervisor tracks for it
+    """
+
+    __slots__ = ("name", "script", "input_path", "output_path", "log_path",
+                 "params", "param_file", "status", "progress", "job_ids",
+                 "counters", "returncode", "started", "finished", "metrics",
+                 "proc")
+
+    def __init__(self, name, script, input_path, output_path, log_path=None,
+                 params=None):
+        self.name = name
+        self.script = script
+        self.input_path = input_path
+        self.output_path = output_path
+        self.log_path = log_path
+        self.params = params or dict()
+        self.param_file = None
+        self.status = PENDING
+        self.progress = 0
+        self.job_ids = []
+        self.counters = dict()
+        self.returncode = None
+        self.started = None
+        self.finished = None
+        self.metrics = dict()
+        self.proc = None
+
+    def command(self):
+        """
+        Returns the command line running the job; the parameters are read
+        from *param_file* when it is set
+        """
+        cmd = [PIG]
+        if self.param_file:
+            cmd.extend(["-param_file", self.param_file])
+        else:
+            for key in sorted(self.params):
+                cmd.extend(["-param", "%s=%s" % (key, self.params[key])])
+        return cmd + ["-f", self.script]
+
+    def parse(self, line):
+        """
+        Updates the job state from a line of Pig output
+
+        :type line: str
+        :param line: line written by Pig to its standard error
+
+        :rtype: None
+        :return: None
+        """
+        for job_id in JOB_ID_RE.findall(line):
+            if job_id not in self.job_ids:
+                self.job_ids.append(job_id)
+                logger.info("%s: started Hadoop job %s", self.name, job_id)
+
+        match = PROGRESS_RE.search(line)
+        if match:
+            self.progress = min(100, int(match.group(1)))
+
+        match = COUNTER_RE.match(line)
+        if match:
+            key = match.group(1).lower().replace(" ", "_")
+            self.counters[key] = int(match.group(2))
+
+        for regex, key in ((READ_RE, "records_read"),
+                           (STORED_RE, "records_stored")):
+            match = regex.search(line)
+            if match:
+                self.counters[key] = \
+                    self.counters.get(key, 0) + int(match.group(1))
+
+    def summary(self):
+        """
+        Returns the job state as a dictionary for the run metrics
+        """
+        summary = {"status": self.status,
+                   "job_ids": list(self.job_ids),
+                   "counters": dict(self.counters),
+                   "returncode": self.returncode}
+        if self.started and self.finished:
+            summary["duration"] = round(self.finished - self.started, 3)
+        return summary
+
+
+class LocalJob(PigJob):
+    """
+    A merge run by the local streaming engine (local.py) instead of Pig
+    """
+
+    __slots__ = ("num_outputs", "header", "codec", "sort_key", "delimiter",
+                 "sort_buffer")
+
+    def __init__(self, name, input_path, output_path, num_outputs=1,
+                 header=False, codec=None, log_path=None, sort_key=None,
+                 delimiter="\t", sort_buffer=100000):
+        PigJob.__init__(self, name, None, input_path, output_path, log_path)
+        self.num_outputs = num_outputs
+        self.header = header
+        self.codec = codec
+        self.sort_key = sort_key
+        self.delimiter = delimiter
+        self.sort_buffer = sort_buffer
+
+    def command(self):
+        """
+        Returns the command line running the job
+        """
+        cmd = [sys.executable, LOCAL_ENGINE,
+               "-i", self.input_path, "-o", self.output_path,
+               "-n", str(self.num_outputs)]
+        if self.header:
+            cmd.append("--header")
+        if self.codec:
+            cmd.extend(["-c", self.codec])
+        if self.sort_key is not None:
+            cmd.extend(["--sort-key", str(self.sort_key),
+                        "--delimiter", self.delimiter,
+                        "--sort-buffer", str(self.sort_buffer)])
+        return cmd
+
+
+def kill_hadoop_job(job_id):
+    """
+    Kills a running Hadoop job
+
+    :type job_id: str
+    :param job_id: Hadoop job id
+
+    :rtype: int
+    :return: exit code of the kill command
+    """
+    try:
+        return sp.call([MAPRED, "job", "-kill", job_id])
+    except OSError as ex:
+        logger.error("Could not kill %s: %s", job_id, ex)
+        return -1
+
+
+class PigSupervisor(object):
+    """
+    Runs PigJob instances with bounded concurrency. The first failure stops
+    the scheduling of new jobs; jobs already running are allowed to finish.
+    """
+
+    def __init__(self, parallel=1, report_interval=30):
+        self.parallel = max(1, parallel)
+        self.report_interval = report_interval
+        self._lock = threading.RLock()
+        self._pending = deque()
+        self._jobs = []
+        self._error = None
+        self._cancelled = False
+
+    def _next_job(self):
+        with self._lock:
+            if self._cancelled or self._error or not self._pending:
+                return None
+            job = self._pending.popleft()
+            job.status = RUNNING
+            job.started = time.time()
+            return job
+
+    def _launch(self, job):
+        """
+        Runs the Pig process of *job* and streams its standard error
+        """
+        log = open(job.log_path, "w") if job.log_path else \
+            open(os.devnull, "w")
+        try:
+            with self._lock:
+                if self._cancelled:
+                    raise KeyboardInterrupt()
+                logger.debug("%s: running %s", job.name,
+                             command_line(job.command()))
+                job.proc = sp.Popen(job.command(), stdout=log, stderr=sp.PIPE)
+            for line in iter(job.proc.stderr.readline, ""):
+                log.write(line)
+                job.parse(line)
+            job.returncode = job.proc.wait()
+        finally:
+            log.close()
+
+        if job.returncode != 0:
+            raise sp.CalledProcessError(job.returncode,
+                                        " ".join(job.command()))
+
+    def _worker(self, on_start, on_success, on_failure):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            started = False
+            try:
+                if on_start:
+                    on_start(job)
+                started = True
+                self._launch(job)
+                job.progress = 100
+                # A job cancelled after Pig exited must not be completed
+                if self._cancelled:
+                    raise KeyboardInterrupt()
+                if on_success:
+                    on_success(job)
+                job.status = SUCCEEDED
+            except BaseException as ex:
+                job.status = CANCELLED if self._cancelled else FAILED
+                if not self._cancelled:
+                    logger.exception("%s: %s", job.name, ex)
+                with self._lock:
+                    if self._error is None:
+                        self._error = ex
+                if on_failure and started:
+                    try:
+                        on_failure(job)
+                    except Exception:
+                        logger.exception("%s: failure handling failed",
+                                         job.name)
+            finally:
+                job.finished = time.time()
+                self.report()
+
+    def report(self):
+        """
+        Logs the aggregate progress of all jobs
+
+        :rtype: dict
+        :return: Number of jobs per status and overall completion percentage
+        """
+        with self._lock:
+            counts = dict.fromkeys(
+                [PENDING, RUNNING, SUCCEEDED, FAILED, CANCELLED], 0)
+            total = 0
+            for job in self._jobs:
+                counts[job.status] += 1
+                total += 100 if job.status == SUCCEEDED else job.progress
+            percent = total // max(1, len(self._jobs))
+
+        logger.info("Progress: %d%% of %d jobs; %d running, %d succeeded, "
+                    "%d failed, %d pending", percent, len(self._jobs),
+                    counts[RUNNING], counts[SUCCEEDED],
+                    counts[FAILED] + counts[CANCELLED], counts[PENDING])
+        counts["percent"] = percent
+        return counts
+
+    @property
+    def cancelled(self):
+        """
+        Whether the current run has been cancelled
+        """
+        return self._cancelled
+
+    def cancel(self):
+        """
+        Stops scheduling and kills all running Pig processes along with the
+        Hadoop jobs they launched
+
+        :rtype: None
+        :return: None
+        """
+        with self._lock:
+            self._cancelled = True
+            running = [job for job in self._jobs
+                       if job.status == RUNNING and job.proc]
+
+        for job in running:
+            if job.proc.poll() is None:
+                logger.warning("%s: killing Pig process %d", job.name,
+                               job.proc.pid)
+                job.proc.terminate()
+            for job_id in job.job_ids:
+                kill_hadoop_job(job_id)
+
+    def _interrupt(self, signum, frame):
+        logger.warning("Interrupted; cancelling in-flight jobs")
+        self.cancel()
+
+    def run(self, jobs, on_start=None, on_success=None, on_failure=None):
+        """
+        Runs *jobs* and blocks until all of them finished
+
+        :type jobs: list
+        :param jobs: PigJob instances
+
+        :type on_start: callable
+        :param on_start: called with the job before its Pig process starts
+
+        :type on_success: callable
+        :param on_success: called with the job after Pig exited successfully,
+                           unless the run has been cancelled; an exception
+                           fails the job
+
+        :type on_failure: callable
+        :param on_failure: called with a job that failed or was cancelled
+                           after on_start returned
+
+        :rtype: list
+        :return: The jobs
+
+        :exception: KeyboardInterrupt when cancelled, otherwise the first
+                    exception raised by a job
+        """
+        self._jobs = list(jobs)
+        self._pending = deque(self._jobs)
+        self._error = None
+        self._cancelled = False
+
+        workers = []
+        for _ in range(min(self.parallel, len(self._jobs))):
+            worker = threading.Thread(target=self._worker,
+                                      args=(on_start, on_success,
+                                            on_failure))
+            worker.daemon = True
+            workers.append(worker)
+
+        # Signal handlers can only be installed from the main thread
+        handler = None
+        if threading.current_thread().name == "MainThread":
+            handler = signal.signal(signal.SIGINT, self._interrupt)
+
+        try:
+            for worker in workers:
+                worker.start()
+            last_report = time.time()
+            while True:
+                alive = [worker for worker in workers if worker.is_alive()]
+                if not alive:
+                    break
+                # Join with a timeout; a blocking join would defer SIGINT
+                alive[0].join(0.5)
+                if time.time() - last_report >= self.report_interval:
+                    self.report()
+                    last_report = time.time()
+        finally:
+            if handler is not None:
+                signal.signal(signal.SIGINT, handler)
+
+        if self._cancelled:
+            raise KeyboardInterrupt()
+        if self._error is not None:
+            raise self._error
+        return self._jobs
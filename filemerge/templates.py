@@ -19,11 +19,18 @@ PIG_TEMPLATE = \
     @SET_COMPRESSION_ENABLED
     @SET_COMPRESSION_CODEC
     set pig.splitCombination false
+    @SET_RESOURCES
 
     rmf @OUTPUT_PATH
     A = load '@INPUT_PATH' using PigStorage('\u0001', '-tagFile') AS (filename: chararray,line: chararray);
+    @FILTER_HEADER
     B = foreach (group A by filename) generate FLATTEN(A.line);
+    @SORT_RECORDS
     store B into '@OUTPUT_PATH';
     '''
 
 DATE_TEMPLATE = "d_%d%02d%02d"
+
+HOUR_TEMPLATE = DATE_TEMPLATE + "-%02d00"
+
+MONTH_TEMPLATE = "d_%d%02d"
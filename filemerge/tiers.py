@@ -0,0 +1,300 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tiered compaction. Raw directories (d_YYYYMMDD-HHMM) are merged per hour as
+soon as the hour is over, hourly outputs are merged per day once the day is
+over, and daily outputs per month once the month is over:
+
+    <input-prefix>/d_20150225-1310        raw
+    <output-prefix>/hourly/d_20150225-1300
+    <output-prefix>/daily/d_20150225-0000
+    <output-prefix>/monthly/d_201502
+
+Every tier reads only the outputs of the tier below it, and the inputs of a
+promotion are removed (or archived) after a verified merge, so data that
+arrives on time is rewritten once per tier. A period is promoted only when
+nothing of it is left in the tiers below. Data arriving late for a period
+that has already been promoted is promoted again: the existing output is
+folded into the merge of the late data (see cleanup), and the emptied source
+directories are removed. This rewrites the whole period, at every tier it
+had reached: a single late raw file rewrites its hour and, once they are
+promoted again, its day and month. Late data is therefore best kept within
+the lag of the hourly tier.
+"""
+
+import os
+import re
+import copy
+import datetime
+import logging
+import hdfs
+import filemerge as fm
+from templates import DATE_TEMPLATE, HOUR_TEMPLATE, MONTH_TEMPLATE
+
+
+logger = logging.getLogger(__name__)
+
+RAW = "raw"
+HOURLY = "hourly"
+DAILY = "daily"
+MONTHLY = "monthly"
+TIERS = [HOURLY, DAILY, MONTHLY]
+
+ENTRY_RE = re.compile(r"^d_(\d{4})(\d{2})(\d{2})?(?:-(\d{2})\d{2})?")
+
+
+def parse_entry(name):
+    """
+    Parses the date of a directory name
+
+    :type name: str
+    :param name: directory name such as 'd_20150225-1310' or 'd_201502'
+
+    :rtype: tuple
+    :return: Tuple of year, month, day and hour (day and hour may be None),
+             None if the name does not follow the naming convention
+    """
+    match = ENTRY_RE.match(name)
+    if not match:
+        return None
+    return tuple(int(v) if v else None for v in match.groups())
+
+
+def entry_names(files, root):
+    """
+    Returns the names of the entries directly below *root* holding *files*
+
+    :type files: list
+    :param files: List of tuples containing file path and size
+
+    :type root: str
+    :param root: parent directory of the entries
+
+    :rtype: set
+    :return: Entry names
+    """
+    prefix = root.rstrip("/") + "/"
+    return set(fpath[len(prefix):].split("/")[0] for fpath, _ in files
+               if fpath.startswith(prefix))
+
+
+class TierPolicy(object):
+    """
+    Decides which periods of every tier are ready to be promoted
+    """
+
+    def __init__(self, input_prefix, output_prefix, window=7, hourly_lag=1,
+                 daily_lag=1, monthly_lag=1):
+        """
+        :type input_prefix: str
+        :param input_prefix: root folder of the raw data
+
+        :type output_prefix: str
+        :param output_prefix: root folder of the tiers
+
+        :type window: int
+        :param window: number of days, counting back from today, in which raw
+                       and hourly data is looked for
+
+        :type hourly_lag: int
+        :param hourly_lag: hours to wait after the end of an hour
+
+        :type daily_lag: int
+        :param daily_lag: days to wait after the end of a day
+
+        :type monthly_lag: int
+        :param monthly_lag: days to wait after the end of a month
+        """
+        self.input_prefix = input_prefix
+        self.output_prefix = output_prefix
+        self.window = window
+        self.hourly_lag = hourly_lag
+        self.daily_lag = daily_lag
+        self.monthly_lag = monthly_lag
+
+    def root(self, tier):
+        """
+        Returns the folder holding the outputs of *tier*
+        """
+        if tier == RAW:
+            return self.input_prefix
+        return os.path.join(self.output_prefix, tier)
+
+    def source(self, tier):
+        """
+        Returns the tier whose outputs *tier* merges
+        """
+        return ([RAW] + TIERS)[TIERS.index(tier)]
+
+    def _entries(self, tier, today):
+        """
+        Returns the names of the non-empty entries of *tier* for the days of
+        the window
+        """
+        root = self.root(tier)
+        tomorrow = today + datetime.timedelta(days=1)
+        globs = [ipath for _, ipath in
+                 fm.getpaths_fromwindow(root, self.window + 1, tomorrow)]
+        return entry_names(hdfs.ls(",".join(globs)), root)
+
+    def _all_entries(self, tier):
+        """
+        Returns the names of all non-empty entries of *tier*
+        """
+        root = self.root(tier)
+        return entry_names(hdfs.ls(os.path.join(root, "d_*")), root)
+
+    def ready(self, tier, now=None):
+        """
+        Returns the periods of *tier* that are ready to be merged
+
+        :type tier: str
+        :param tier: HOURLY, DAILY or MONTHLY
+
+        :type now: datetime.datetime
+        :param now: current time
+
+        :rtype: list
+        :return: List of tuples containing output directory name and input
+                 path, like filemerge.getpaths
+        """
+        now = now or datetime.datetime.now()
+        if tier == HOURLY:
+            return self._ready_hours(now)
+        elif tier == DAILY:
+            return self._ready_days(now.date())
+        elif tier == MONTHLY:
+            return self._ready_months(now.date())
+        raise ValueError("Unknown tier '%s'" % tier)
+
+    def _ready_hours(self, now):
+        today = now.date()
+        cutoff = now - datetime.timedelta(hours=self.hourly_lag)
+
+        hours = set()
+        for name in self._entries(RAW, today):
+            parsed = parse_entry(name)
+            if parsed is None or None in parsed:
+                logger.debug("Ignoring raw entry '%s'", name)
+                continue
+            hours.add(parsed)
+
+        input_paths = []
+        for year, month, day, hour in sorted(hours):
+            end = datetime.datetime(year, month, day, hour) + \
+                datetime.timedelta(hours=1)
+            dirname = HOUR_TEMPLATE % (year, month, day, hour)
+            if end > cutoff:
+                continue
+            input_paths.append((dirname, os.path.join(
+                self.input_prefix, "%s*" % dirname[:-2])))
+        return input_paths
+
+    def _ready_days(self, today):
+        if self.window <= self.daily_lag:
+            return []
+        start = today - datetime.timedelta(days=self.daily_lag)
+        hourly = set(name[:10] for name in self._entries(HOURLY, today))
+        raw = set(name[:10] for name in self._entries(RAW, today))
+
+        input_paths = []
+        for dirname, ipath in sorted(fm.getpaths_fromwindow(
+                self.root(HOURLY), self.window - self.daily_lag, start)):
+            day = dirname[:10]
+            if day not in hourly or day in raw:
+                continue
+            input_paths.append((dirname, ipath))
+        return input_paths
+
+    def _ready_months(self, today):
+        daily = self._all_entries(DAILY)
+        pending = set(name[:8] for name in self._all_entries(HOURLY))
+        pending.update(name[:8] for name in self._entries(RAW, today))
+
+        input_paths = []
+        for month in sorted(set(name[:8] for name in daily)):
+            parsed = parse_entry(month)
+            if parsed is None:
+                continue
+            year, mm = parsed[:2]
+            first = datetime.date(year + mm // 12, mm % 12 + 1, 1)
+            if first + datetime.timedelta(days=self.monthly_lag) > today:
+                continue
+            dirname = MONTH_TEMPLATE % (year, mm)
+            if month in pending:
+                continue
+            input_paths.append((dirname, os.path.join(
+                self.root(DAILY), "%s*" % dirname)))
+        return input_paths
+
+
+def tier_options(options, policy, tier):
+    """
+    Returns a copy of *options* that merges the sources of *tier*
+    """
+    tier_opts = copy.copy(options)
+    source = policy.source(tier)
+    tier_opts.topic = "%s-%s" % (options.topic, tier)
+    tier_opts.input_prefix = policy.root(source)
+    tier_opts.output_prefix = policy.root(tier)
+    if options.archive_source:
+        tier_opts.archive_source = os.path.join(options.archive_source, source)
+    return tier_opts
+
+
+def run_tiers(options, now=None):
+    """
+    Promotes the ready periods of every tier, lowest tier first
+
+    :type options: object
+    :param options: Options object as parsed by filemerge's OptionParser
+
+    :type now: datetime.datetime
+    :param now: current time
+
+    :rtype: list
+    :return: Metrics of the jobs run, one dictionary per directory
+    """
+    from plan import MergePlan
+
+    policy = TierPolicy(options.input_prefix, options.output_prefix,
+                        int(options.tier_window))
+    run_metrics = []
+    try:
+        for tier in TIERS:
+            input_paths = policy.ready(tier, now)
+            if not input_paths:
+                logger.info("No %s periods ready to merge", tier)
+                continue
+
+            plan = MergePlan(tier_options(options, policy, tier), "tiered")
+            try:
+                plan.discover(input_paths)
+                plan.schedule()
+                if options.dry_run:
+                    plan.dry_run()
+                    continue
+                try:
+                    plan.execute()
+                finally:
+                    for record in plan.report():
+                        record["tier"] = tier
+                        run_metrics.append(record)
+            finally:
+                plan.close()
+    finally:
+        if options.metrics_file:
+            fm.write_metrics(options.metrics_file, run_metrics)
+    return run_metrics
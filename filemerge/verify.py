@@ -0,0 +1,213 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Verification of merge results. The inputs and the outputs of a merge are
+streamed file by file (see hdfs.read_each) and reduced to a record count and
+an order independent digest: the sum, modulo 2^64, of a 64 bit hash of every
+line. The last line of a file ends a record whether or not it ends with a
+newline, as it does for Pig and the local engine. Merging reorders lines but
+must neither drop nor duplicate them, so a correct merge produces identical
+counts and digests on both sides.
+"""
+
+import struct
+import hashlib
+import logging
+import hdfs
+
+
+logger = logging.getLogger(__name__)
+
+DIGEST_MASK = (1 << 64) - 1
+
+# Number of files digested by one worker; read_each streams them with as few
+# ``hadoop fs`` calls as their sizes allow
+BATCH_SIZE = 64
+
+
+class VerificationException(RuntimeError):
+    pass
+
+
+def line_hash(line):
+    """
+    Returns a 64 bit hash of *line*, ignoring the line terminator
+
+    :type line: str
+    :param line: line of text
+
+    :rtype: int
+    :return: hash of the line
+    """
+    md5 = hashlib.md5(line.rstrip("\r\n")).digest()
+    return struct.unpack(">Q", md5[:8])[0]
+
+
+def digest_lines(lines, exclude=None):
+    """
+    Computes record count and digest of an iterable of lines in constant
+    memory
+
+    :type lines: iterable
+    :param lines: lines of text
+
+    :type exclude: str
+    :param exclude: line left out of the count and digest, None for none
+
+    :rtype: tuple
+    :return: Tuple containing record count and digest
+    """
+    count, digest = 0, 0
+    for line in lines:
+        if exclude is not None and line.rstrip("\r\n") == exclude:
+            continue
+        count += 1
+        digest = (digest + line_hash(line)) & DIGEST_MASK
+    return count, digest
+
+
+def digest_files(files, exclude=None):
+    """
+    Computes record count and digest of a batch of HDFS files, reading every
+    file on its own so that lines never run across files
+
+    :type files: list
+    :param files: List of tuples containing file path and size
+
+    :type exclude: str
+    :param exclude: line left out of the count and digest, None for none
+
+    :rtype: tuple
+    :return: Tuple containing record count and digest
+    """
+    count, digest = 0, 0
+    for _, lines in hdfs.read_each(files):
+        c, d = digest_lines(lines, exclude)
+        count += c
+        digest = (digest + d) & DIGEST_MASK
+    return count, digest
+
+
+def batches(items, size):
+    """
+    Splits *items* into lists of at most *size* elements
+
+    :type items: list
+    :param items: items to split
+
+    :type size: int
+    :param size: maximum batch size
+
+    :rtype: list
+    :return: List of batches
+    """
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def digest_listing(files, workers=4, exclude=None, pool=None):
+    """
+    Computes record count and digest over all *files*, streaming batches of
+    files in parallel
+
+    :type files: list
+    :param files: List of tuples containing file path and size
+
+    :type workers: int
+    :param workers: number of concurrent ``hadoop fs`` streams
+
+    :type exclude: str
+    :param exclude: line left out of the count and digest, None for none
+
+    :type pool: multiprocessing.pool.ThreadPool
+    :param pool: thread pool streaming the batches; None for a new pool of
+                 *workers* threads
+
+    :rtype: tuple
+    :return: Tuple containing record count and digest
+    """
+    # Imported here; the thread pool is only needed when verifying
+    from multiprocessing.pool import ThreadPool
+
+    count, digest = 0, 0
+    own_pool = pool is None
+    if own_pool:
+        pool = ThreadPool(max(1, workers))
+    try:
+        for c, d in pool.imap_unordered(
+                lambda batch: digest_files(batch, exclude),
+                batches(files, BATCH_SIZE)):
+            count += c
+            digest = (digest + d) & DIGEST_MASK
+    finally:
+        if own_pool:
+            pool.terminate()
+    return count, digest
+
+
+def summarize(prefix, files, count, digest):
+    """
+    Returns the metrics of one side of the merge as a dictionary
+    """
+    return {
+        "%s_files" % prefix: len(files),
+        "%s_bytes" % prefix: sum(size for _, size in files),
+        "%s_records" % prefix: count,
+        "%s_digest" % prefix: "%016x" % digest
+    }
+
+
+def verify_merge(input_path, output_path, workers=4, header=None,
+                 pool=None):
+    """
+    Compares record counts and digests of the merge inputs and outputs. When
+    the inputs start with a header row, every line equal to it is excluded on
+    both sides, so only data records are compared: the Pig job filters all of
+    them out, the local engine writes the header back into every output file.
+    Counting the lines, rather than the files expected to hold one, also
+    holds for files without lines, such as an empty gzip file.
+
+    :type input_path: str
+    :param input_path: input path (or glob) of the merge
+
+    :type output_path: str
+    :param output_path: output directory of the merge
+
+    :type workers: int
+    :param workers: number of concurrent ``hadoop fs`` streams
+
+    :type header: str
+    :param header: header row of the input files, None if there is none
+
+    :type pool: multiprocessing.pool.ThreadPool
+    :param pool: thread pool streaming the files; None for a new pool of
+                 *workers* threads per side
+
+    :rtype: dict
+    :return: Verification metrics; the "verified" key holds the outcome
+    """
+    input_files = hdfs.ls(input_path)
+    output_files = hdfs.ls(output_path)
+
+    in_count, in_digest = digest_listing(input_files, workers, header, pool)
+    out_count, out_digest = digest_listing(output_files, workers, header,
+                                           pool)
+
+    result = {"verified": (in_count, in_digest) == (out_count, out_digest)}
+    result.update(summarize("input", input_files, in_count, in_digest))
+    result.update(summarize("output", output_files, out_count, out_digest))
+
+    logger.info("Verification of %s: %s (records in=%d out=%d)", output_path,
+                "OK" if result["verified"] else "FAILED", in_count, out_count)
+    return result
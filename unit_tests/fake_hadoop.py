@@ -0,0 +1,282 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Stand-in for the ``hadoop fs`` commands used by filemerge, backed by the local
+directory in FAKE_HDFS_ROOT. HDFS path '/a/b' is stored as
+'$FAKE_HDFS_ROOT/a/b'. Globs are expanded like Hadoop does, and listings are
+printed in the format of ``hadoop fs -ls``.
+
+Environment:
+    FAKE_HDFS_ROOT      local directory holding the file system (required)
+    FAKE_HDFS_LATENCY   seconds every command sleeps before it runs
+    FAKE_HDFS_TRASH     HDFS trash checkpoint that ``-rm`` moves files to,
+                        e.g. /user/u/.Trash/Current; unset to delete them
+"""
+
+import os
+import sys
+import bz2
+import time
+import gzip
+import bisect
+import shutil
+import fnmatch
+
+
+ROOT = os.environ.get("FAKE_HDFS_ROOT", "")
+
+
+def local_path(path_):
+    """
+    Maps an HDFS path to its local file
+    """
+    return os.path.join(ROOT, path_.lstrip("/"))
+
+
+def hdfs_path(local_):
+    """
+    Maps a local file to its HDFS path
+    """
+    return "/" + os.path.relpath(local_, ROOT).replace(os.sep, "/")
+
+
+# Sorted directory entries, cached while a command expands many globs
+_entries = dict()
+
+
+def entries(local_):
+    if local_ not in _entries:
+        _entries[local_] = sorted(os.listdir(local_)) \
+            if os.path.isdir(local_) else []
+    return _entries[local_]
+
+
+def expand(pattern):
+    """
+    Expands an HDFS glob into the sorted local paths it matches
+    """
+    matches = [ROOT]
+    for part in pattern.strip("/").split("/"):
+        wildcards = [part.index(c) for c in "*?[" if c in part]
+        if not wildcards:
+            matches = [os.path.join(m, part) for m in matches
+                       if os.path.exists(os.path.join(m, part))]
+            continue
+        prefix = part[:min(wildcards)]
+        expanded = []
+        for match in matches:
+            names = entries(match)
+            for name in names[bisect.bisect_left(names, prefix):]:
+                if not name.startswith(prefix):
+                    break
+                if fnmatch.fnmatchcase(name, part):
+                    expanded.append(os.path.join(match, name))
+        matches = expanded
+    return sorted(m for m in matches if os.path.lexists(m))
+
+
+def missing(command, path_):
+    sys.stderr.write("%s: `%s': No such file or directory\n" % (command,
+                                                                path_))
+    return 1
+
+
+def listing_line(local_):
+    is_dir = os.path.isdir(local_)
+    size = 0 if is_dir else os.path.getsize(local_)
+    return "%s   %s user group %12d 2016-08-04 12:00 %s\n" % (
+        "drwxr-xr-x" if is_dir else "-rw-r--r--", "-" if is_dir else "3",
+        size, hdfs_path(local_))
+
+
+def walk(local_):
+    """
+    Yields *local_* and everything below it, like ``ls -R``
+    """
+    if not os.path.isdir(local_):
+        yield local_
+        return
+    for name in sorted(os.listdir(local_)):
+        child = os.path.join(local_, name)
+        yield child
+        if os.path.isdir(child):
+            for entry in walk(child):
+                if entry != child:
+                    yield entry
+
+
+def ls(args):
+    recursive = "-R" in args
+    paths = [a for a in args if not a.startswith("-")]
+    status = 0
+    for pattern in paths:
+        matches = expand(pattern)
+        if not matches:
+            status = missing("ls", pattern)
+        for match in matches:
+            if not recursive:
+                sys.stdout.write(listing_line(match))
+                continue
+            for entry in walk(match):
+                if entry != match or not os.path.isdir(match):
+                    sys.stdout.write(listing_line(entry))
+    return status
+
+
+def open_decoded(local_):
+    if local_.endswith(".gz"):
+        return gzip.open(local_, "rb")
+    elif local_.endswith(".bz2"):
+        return bz2.BZ2File(local_, "rb")
+    return open(local_, "rb")
+
+
+def copy(command, args, opener):
+    out = getattr(sys.stdout, "buffer", sys.stdout)
+    for pattern in args:
+        matches = expand(pattern)
+        if not matches:
+            return missing(command, pattern)
+        for match in matches:
+            with opener(match) as fh:
+                shutil.copyfileobj(fh, out)
+    return 0
+
+
+def text(args):
+    return copy("text", args, open_decoded)
+
+
+def cat(args):
+    return copy("cat", args, lambda local_: open(local_, "rb"))
+
+
+def tail(args):
+    local_ = local_path(args[-1])
+    if not os.path.isfile(local_):
+        return missing("tail", args[-1])
+    with open(local_, "rb") as fh:
+        fh.seek(max(0, os.path.getsize(local_) - 1024))
+        shutil.copyfileobj(fh, getattr(sys.stdout, "buffer", sys.stdout))
+    return 0
+
+
+def put(args):
+    force = "-f" in args
+    source, destination = [a for a in args if a != "-f"][-2:]
+    if source != "-":
+        sys.stderr.write("put: only '-' is supported as source\n")
+        return 1
+    target = local_path(destination)
+    if os.path.exists(target) and not force:
+        sys.stderr.write("put: `%s': File exists\n" % destination)
+        return 1
+    if not os.path.isdir(os.path.dirname(target)):
+        os.makedirs(os.path.dirname(target))
+    with open(target, "wb") as fh:
+        shutil.copyfileobj(getattr(sys.stdin, "buffer", sys.stdin), fh)
+    return 0
+
+
+def mkdir(args):
+    for path_ in [a for a in args if not a.startswith("-")]:
+        target = local_path(path_)
+        if not os.path.isdir(target):
+            os.makedirs(target)
+    return 0
+
+
+def rm(args):
+    recursive = "-r" in args
+    force = "-f" in args
+    trash = os.environ.get("FAKE_HDFS_TRASH")
+    if "-skipTrash" in args:
+        trash = None
+    status = 0
+    for pattern in [a for a in args if not a.startswith("-")]:
+        matches = expand(pattern)
+        if not matches and not force:
+            status = missing("rm", pattern)
+        for match in matches:
+            if os.path.isdir(match):
+                if not recursive:
+                    sys.stderr.write("rm: `%s': Is a directory\n" % pattern)
+                    status = 1
+                    continue
+            if trash:
+                target = local_path(trash.rstrip("/") + hdfs_path(match))
+                if os.path.exists(target):
+                    # HDFS keeps both, suffixing the later one
+                    target += str(int(time.time() * 1000))
+                if not os.path.isdir(os.path.dirname(target)):
+                    os.makedirs(os.path.dirname(target))
+                shutil.move(match, target)
+            elif os.path.isdir(match):
+                shutil.rmtree(match)
+            else:
+                os.remove(match)
+    return status
+
+
+def rmdir(args):
+    ignore = "--ignore-fail-on-non-empty" in args
+    status = 0
+    for path_ in [a for a in args if not a.startswith("-")]:
+        target = local_path(path_)
+        if not os.path.isdir(target):
+            status = missing("rmdir", path_)
+        elif os.listdir(target):
+            if not ignore:
+                sys.stderr.write("rmdir: `%s': Directory is not empty\n" %
+                                 path_)
+                status = 1
+        else:
+            os.rmdir(target)
+    return status
+
+
+def mv(args):
+    sources, destination = args[:-1], local_path(args[-1])
+    status = 0
+    for pattern in sources:
+        matches = expand(pattern)
+        if not matches:
+            status = missing("mv", pattern)
+        for match in matches:
+            target = destination
+            if os.path.isdir(destination):
+                target = os.path.join(destination, os.path.basename(match))
+            os.rename(match, target)
+    return status
+
+
+COMMANDS = {"-ls": ls, "-text": text, "-cat": cat, "-tail": tail,
+            "-put": put, "-mkdir": mkdir, "-rm": rm, "-rmdir": rmdir,
+            "-mv": mv}
+
+
+def main(argv):
+    if not ROOT:
+        sys.stderr.write("FAKE_HDFS_ROOT is not set\n")
+        return 2
+    if len(argv) < 2 or argv[0] != "fs" or argv[1] not in COMMANDS:
+        sys.stderr.write("Unsupported command: %s\n" % " ".join(argv))
+        return 2
+    time.sleep(float(os.environ.get("FAKE_HDFS_LATENCY", "0")))
+    return COMMANDS[argv[1]](argv[2:])
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,201 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Stand-in for ``pig -param K=V ... -f script`` (or ``pig -param_file F -f
+script``) running filemerge's Pig script against the fake file system of
+fake_hadoop. The records of the files in
+$INPUT are concatenated into $OUTPUT/part-r-00000, one newline terminated
+record per line like PigStorage writes them, less the lines equal to
+$HEADER, and Pig's progress and summary lines are written to standard error.
+Like Pig, a job whose $INPUT matches no files removes $OUTPUT and fails.
+
+Environment:
+    FAKE_HDFS_ROOT          local directory holding the file system
+    FAKE_PIG_STATE          directory for the event log and attempt counters
+    FAKE_PIG_LATENCY        seconds every job runs
+    FAKE_PIG_FAILURE_RATE   probability that an attempt fails
+    FAKE_PIG_SEED           seed making failures reproducible; an attempt's
+                            outcome depends on the seed, $OUTPUT and the
+                            number of earlier attempts for $OUTPUT
+    FAKE_PIG_FAIL           regular expression; jobs whose $OUTPUT matches
+                            it always fail
+    FAKE_PIG_OUTPUT_BYTES   write this many synthetic bytes instead of the
+                            merged records
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import hashlib
+import fake_hadoop as fs
+
+
+def parse_args(argv):
+    """
+    Returns the parameters and the script path of a pig command line
+    """
+    params = dict()
+    script = None
+    args = iter(argv)
+    for arg in args:
+        if arg == "-param":
+            key, _, value = next(args).partition("=")
+            params[key] = value
+        elif arg == "-param_file":
+            with open(next(args)) as fh:
+                for line in fh:
+                    key, _, value = line.rstrip("\n").partition("=")
+                    params[key] = value
+        elif arg == "-f":
+            script = next(args)
+    return params, script
+
+
+def log_event(state, event, output):
+    """
+    Appends a line to the event log, from which the harness derives
+    throughput and concurrency
+    """
+    with open(os.path.join(state, "events.log"), "a") as fh:
+        fh.write("%.6f %s %s\n" % (time.time(), event, output))
+
+
+def next_attempt(state, output):
+    """
+    Counts an attempt for *output* and returns its number, starting at 1
+    """
+    directory = os.path.join(state, "attempts")
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            pass
+    counter = os.path.join(directory,
+                           hashlib.sha1(output.encode("utf-8")).hexdigest())
+    with open(counter, "a") as fh:
+        fh.write(".")
+    return os.path.getsize(counter)
+
+
+def should_fail(output, attempt):
+    pattern = os.environ.get("FAKE_PIG_FAIL")
+    if pattern and re.search(pattern, output):
+        return True
+    rate = float(os.environ.get("FAKE_PIG_FAILURE_RATE", "0"))
+    if rate <= 0:
+        return False
+    seed = os.environ.get("FAKE_PIG_SEED")
+    rng = random.Random("%s:%s:%d" % (seed, output, attempt)) \
+        if seed is not None else random.Random()
+    return rng.random() < rate
+
+
+def input_files(input_path):
+    """
+    Returns the local data files read by a job, skipping hidden files
+    """
+    files = []
+    for pattern in input_path.split(","):
+        for match in fs.expand(pattern):
+            for entry in fs.walk(match):
+                parts = os.path.relpath(entry, match).split(os.sep)
+                if os.path.isfile(entry) and not any(
+                        part[:1] in ("_", ".") for part in parts
+                        if part != "."):
+                    files.append(entry)
+    return files
+
+
+def unescape(value):
+    """
+    Reverses headers.pig_string
+    """
+    return re.sub(r"\\(.)", r"\1", value)
+
+
+def main(argv):
+    params, _ = parse_args(argv)
+    output = params["OUTPUT"]
+    state = os.environ.get("FAKE_PIG_STATE", fs.ROOT)
+    attempt = next_attempt(state, output)
+    job_id = "job_%d_%04d" % (int(time.time()), os.getpid() % 10000)
+    log_event(state, "start", output)
+
+    sys.stderr.write("INFO  HadoopJobId: %s\n" % job_id)
+    sys.stderr.write("INFO  0% complete\n")
+    sys.stderr.flush()
+    time.sleep(float(os.environ.get("FAKE_PIG_LATENCY", "0")))
+
+    # rmf $OUTPUT
+    target = fs.local_path(output)
+    fs.rm(["-r", "-f", output])
+
+    files = input_files(params["INPUT"])
+    if not files:
+        sys.stderr.write("ERROR org.apache.pig.tools.grunt.Grunt - "
+                         "Input path does not exist: %s\n" % params["INPUT"])
+        log_event(state, "fail", output)
+        return 2
+    os.makedirs(target)
+
+    if should_fail(output, attempt):
+        # A failed job leaves partial output behind, without _SUCCESS
+        with open(os.path.join(target, "part-r-00000"), "wb") as fh:
+            fh.write(b"partial\n")
+        sys.stderr.write("ERROR Job %s failed (attempt %d)\n" % (job_id,
+                                                                  attempt))
+        log_event(state, "fail", output)
+        return 2
+    sys.stderr.write("INFO  50% complete\n")
+
+    header = None
+    if "HEADER" in params:
+        header = unescape(params["HEADER"]).encode("utf-8") + b"\n"
+    records = 0
+    read_bytes = 0
+    with open(os.path.join(target, "part-r-00000"), "wb") as out:
+        synthetic = os.environ.get("FAKE_PIG_OUTPUT_BYTES")
+        if synthetic:
+            out.write(b"x" * int(synthetic))
+        for fpath in files:
+            read_bytes += os.path.getsize(fpath)
+            with fs.open_decoded(fpath) as fh:
+                for line in fh:
+                    # The last line of a file is a record, newline or not
+                    if not line.endswith(b"\n"):
+                        line += b"\n"
+                    if line == header:
+                        continue
+                    records += 1
+                    if not synthetic:
+                        out.write(line)
+    open(os.path.join(target, "_SUCCESS"), "w").close()
+    stored_bytes = os.path.getsize(os.path.join(target, "part-r-00000"))
+
+    sys.stderr.write("INFO  100% complete\n")
+    sys.stderr.write("Successfully read %d records (%d bytes) from: \"%s\"\n"
+                     % (records, read_bytes, params["INPUT"]))
+    sys.stderr.write("Successfully stored %d records (%d bytes) in: \"%s\"\n"
+                     % (records, stored_bytes, output))
+    sys.stderr.write("Total records written : %d\n" % records)
+    sys.stderr.write("Total bytes written : %d\n" % stored_bytes)
+    log_event(state, "end", output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
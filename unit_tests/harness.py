@@ -0,0 +1,283 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+End-to-end harness running filemerge against fake ``pig``, ``hadoop`` and
+``mapred`` executables (fake_pig.py and fake_hadoop.py) on a local directory
+standing in for HDFS. Latency, failure rate and output size of the Pig jobs
+are configurable, and every job is recorded in an event log from which
+throughput and concurrency are derived.
+
+    with FakeCluster(latency=0.1, failure_rate=0.2, seed=1) as cluster:
+        names = cluster.make_directories("/data/in", 100)
+        plan = cluster.plan(names, parallel="8", verify=True)
+        plan.execute()
+"""
+
+import os
+import sys
+import stat
+import shutil
+import tempfile
+import mock
+
+# The plan imports these lazily; import them before the working directory
+# changes, since the package may have been found through a relative path
+import filemerge.cleanup
+import filemerge.headers
+import filemerge.index
+import filemerge.overlap
+import filemerge.resources
+import filemerge.scriptcache
+import filemerge.supervisor
+import filemerge.verify
+from filemerge import MergePlan
+
+
+FAKES = os.path.dirname(os.path.abspath(__file__))
+
+WRAPPER = """#!/bin/sh
+exec "%s" "%s" "$@"
+"""
+
+# Environment variables read by the fakes, per FakeCluster setting
+ENVIRONMENT = {"latency": "FAKE_PIG_LATENCY",
+               "failure_rate": "FAKE_PIG_FAILURE_RATE",
+               "seed": "FAKE_PIG_SEED",
+               "fail": "FAKE_PIG_FAIL",
+               "output_bytes": "FAKE_PIG_OUTPUT_BYTES",
+               "hdfs_latency": "FAKE_HDFS_LATENCY",
+               "trash": "FAKE_HDFS_TRASH"}
+
+
+class FakeCluster(object):
+    """
+    A temporary fake cluster. While it is active, the fake executables come
+    first on the PATH and the working directory (where filemerge writes its
+    logs, scripts and journals) is a temporary directory.
+    """
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=None, fail=None,
+                 output_bytes=None, hdfs_latency=0.0, trash=None):
+        """
+        :type latency: float
+        :param latency: seconds every Pig job runs
+
+        :type failure_rate: float
+        :param failure_rate: probability that a Pig job attempt fails
+
+        :type seed: int
+        :param seed: seed making failures reproducible; None for random ones
+
+        :type fail: str
+        :param fail: regular expression for the outputs whose jobs always fail
+
+        :type output_bytes: int
+        :param output_bytes: size of the synthetic output of every job; None
+                             to write the merged records
+
+        :type hdfs_latency: float
+        :param hdfs_latency: seconds every ``hadoop fs`` command takes
+
+        :type trash: str
+        :param trash: HDFS trash checkpoint receiving deleted files; None to
+                      delete them
+        """
+        self.settings = dict(latency=latency, failure_rate=failure_rate,
+                             seed=seed, fail=fail, output_bytes=output_bytes,
+                             hdfs_latency=hdfs_latency, trash=trash)
+        self.tmpdir = None
+        self._cwd = None
+        self._env = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="fakecluster-")
+        self.root = os.path.join(self.tmpdir, "hdfs")
+        self.state = os.path.join(self.tmpdir, "state")
+        bin_dir = os.path.join(self.tmpdir, "bin")
+        for directory in (self.root, self.state, bin_dir):
+            os.mkdir(directory)
+
+        for name, target in (("pig", "fake_pig.py"),
+                             ("hadoop", "fake_hadoop.py")):
+            self._write_executable(os.path.join(bin_dir, name), WRAPPER % (
+                sys.executable, os.path.join(FAKES, target)))
+        self._write_executable(os.path.join(bin_dir, "mapred"),
+                               "#!/bin/sh\nexit 0\n")
+
+        self._env = mock.patch.dict(os.environ, {
+            "PATH": bin_dir + os.pathsep + os.environ.get("PATH", ""),
+            "FAKE_HDFS_ROOT": self.root,
+            "FAKE_PIG_STATE": self.state})
+        self._env.start()
+        self.configure(**self.settings)
+        self._cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+
+    def stop(self):
+        os.chdir(self._cwd)
+        self._env.stop()
+        shutil.rmtree(self.tmpdir)
+
+    @staticmethod
+    def _write_executable(path_, content):
+        with open(path_, "w") as fh:
+            fh.write(content)
+        os.chmod(path_, stat.S_IRWXU)
+
+    def configure(self, latency=None, failure_rate=None, seed=None,
+                  fail=None, output_bytes=None, hdfs_latency=None,
+                  trash=None):
+        """
+        Changes the behaviour of the fakes for the jobs started from now on;
+        settings given as None are cleared
+        """
+        self.settings = dict(latency=latency, failure_rate=failure_rate,
+                             seed=seed, fail=fail, output_bytes=output_bytes,
+                             hdfs_latency=hdfs_latency, trash=trash)
+        for setting, value in self.settings.items():
+            key = ENVIRONMENT[setting]
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = str(value)
+
+    def local_path(self, path_):
+        """
+        Returns the local file backing the HDFS path *path_*
+        """
+        return os.path.join(self.root, path_.lstrip("/"))
+
+    def write_file(self, path_, lines):
+        local_ = self.local_path(path_)
+        if not os.path.isdir(os.path.dirname(local_)):
+            os.makedirs(os.path.dirname(local_))
+        with open(local_, "w") as fh:
+            fh.writelines(line + "\n" for line in lines)
+
+    def make_directories(self, prefix, count, files_per_dir=2,
+                         lines_per_file=10, header=None):
+        """
+        Creates *count* input directories below *prefix*
+
+        :rtype: list
+        :return: Names of the directories
+        """
+        names = ["d_%05d" % i for i in range(count)]
+        for name in names:
+            for part in range(files_per_dir):
+                lines = ["%s\t%d\t%d" % (name, part, i)
+                         for i in range(lines_per_file)]
+                self.write_file("%s/%s/part-%05d" % (prefix, name, part),
+                                ([header] if header else []) + lines)
+        return names
+
+    def read_records(self, path_):
+        """
+        Returns the lines of the data files in the HDFS directory *path_*
+        """
+        local_ = self.local_path(path_)
+        lines = []
+        for name in sorted(os.listdir(local_)):
+            if name[:1] in ("_", "."):
+                continue
+            with open(os.path.join(local_, name)) as fh:
+                lines.extend(line.rstrip("\n") for line in fh)
+        return lines
+
+    def plan(self, names, input_prefix="/data/in", output_prefix="/data/out",
+             **options):
+        """
+        Returns a MergePlan of the directories *names*, discovered and
+        scheduled; *options* are passed to MergePlan.create
+        """
+        list_file = os.path.join(self.tmpdir, "directories.txt")
+        with open(list_file, "w") as fh:
+            fh.writelines(name + "\n" for name in names)
+        options.setdefault("topic", "harness")
+        options.setdefault("queue", "default")
+        plan = MergePlan.create(input_prefix=input_prefix,
+                                output_prefix=output_prefix,
+                                file=list_file, **options)
+        plan.discover()
+        plan.schedule()
+        return plan
+
+    def events(self):
+        """
+        Returns the Pig job events as tuples of time, event ('start', 'end'
+        or 'fail') and output path
+        """
+        log = os.path.join(self.state, "events.log")
+        if not os.path.exists(log):
+            return []
+        events = []
+        with open(log) as fh:
+            for line in fh:
+                timestamp, event, output = line.rstrip("\n").split(" ", 2)
+                events.append((float(timestamp), event, output))
+        return sorted(events)
+
+    def max_concurrency(self):
+        """
+        Returns the largest number of Pig jobs that ran at the same time
+        """
+        running = peak = 0
+        for _, event, _ in self.events():
+            running += 1 if event == "start" else -1
+            peak = max(peak, running)
+        return peak
+
+    def throughput(self):
+        """
+        Returns the number of successful Pig jobs per second, measured from
+        the first start to the last event
+        """
+        events = self.events()
+        if not events:
+            return 0.0
+        succeeded = sum(1 for _, event, _ in events if event == "end")
+        return succeeded / max(events[-1][0] - events[0][0], 1e-6)
+
+
+def merge_until_done(cluster, names, max_rounds=10, **options):
+    """
+    Merges *names*, resuming after failures: every round reruns the
+    directories whose jobs failed or never started in the previous round
+
+    :rtype: list
+    :return: The metrics of every round, one list of dictionaries per round
+    """
+    from filemerge.supervisor import SUCCEEDED
+
+    rounds = []
+    remaining = list(names)
+    while remaining and len(rounds) < max_rounds:
+        plan = cluster.plan(remaining, **options)
+        try:
+            plan.execute()
+        except Exception:
+            # The report tells which jobs failed
+            pass
+        rounds.append(plan.report())
+        remaining = [job.name for job in plan.jobs
+                     if job.runner.status != SUCCEEDED]
+    return rounds
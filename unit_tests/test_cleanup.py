@@ -0,0 +1,177 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import mock
+import filemerge.cleanup as cl
+
+
+FILES = [("/in/d_20160804-0000/a", 10),
+         ("/in/d_20160804-0000/b", 20),
+         ("/in/d_20160804-0100/a", 30)]
+
+
+class TestCleanup(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(dir=".")
+        self.journal = os.path.join(self.tmpdir, "journal", "topic.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_check_unchanged(self):
+        verification = {"verified": True, "input_files": 3, "input_bytes": 60,
+                        "input_records": 6}
+        cl.check_unchanged(FILES, verification)
+
+        # An empty input verifies trivially; it never allows a cleanup
+        with self.assertRaises(cl.CleanupException):
+            cl.check_unchanged([], {"verified": True, "input_files": 0,
+                                    "input_bytes": 0, "input_records": 0})
+
+        verification["input_bytes"] = 70
+        with self.assertRaises(cl.CleanupException):
+            cl.check_unchanged(FILES, verification)
+
+        with self.assertRaises(cl.CleanupException):
+            cl.check_unchanged(FILES, {"verified": False})
+
+    def test_archive_destinations(self):
+        expected = {
+            "/arch/d_20160804-0000": ["/in/d_20160804-0000/a",
+                                      "/in/d_20160804-0000/b"],
+            "/arch/d_20160804-0100": ["/in/d_20160804-0100/a"]
+        }
+        self.assertEqual(expected,
+                         cl.archive_destinations(FILES, "/in/", "/arch"))
+        with self.assertRaises(cl.CleanupException):
+            cl.archive_destinations(FILES, "/other", "/arch")
+
+    @mock.patch("filemerge.cleanup.hdfs")
+    def test_cleanup_source_delete(self, mock_hdfs):
+        metrics = cl.cleanup_source(cl.DELETE, FILES, "d_20160804-0000",
+                                    "/in", self.journal,
+                                    output_path="/out/d_20160804-0000")
+        mock_hdfs.rm.assert_called_once_with([f for f, _ in FILES])
+        self.assertEqual({"action": "delete", "files": 3, "bytes": 60,
+                          "previous_files": 0}, metrics)
+
+        entries = cl.read_journal(self.journal)
+        self.assertEqual(1, len(entries))
+        self.assertEqual([[f, s] for f, s in FILES], entries[0]["files"])
+
+        cl.undo(entries[0], trash_root="/user/u/.Trash/Current")
+        # The output holding the records of the files goes first
+        self.assertEqual([mock.call("/out/d_20160804-0000"),
+                          mock.call("/out/_previous/d_20160804-0000")],
+                         mock_hdfs.rmr.call_args_list)
+        mock_hdfs.mv.assert_any_call(
+            ["/user/u/.Trash/Current/in/d_20160804-0000/a",
+             "/user/u/.Trash/Current/in/d_20160804-0000/b"],
+            "/in/d_20160804-0000")
+
+    @mock.patch("filemerge.cleanup.hdfs")
+    def test_cleanup_source_archive(self, mock_hdfs):
+        cl.cleanup_source(cl.ARCHIVE, FILES, "d_20160804-0000", "/in",
+                          self.journal, archive_prefix="/arch",
+                          output_path="/out/d_20160804-0000")
+        mock_hdfs.mkdir.assert_called_once_with(["/arch/d_20160804-0000",
+                                                 "/arch/d_20160804-0100"])
+        self.assertEqual(2, mock_hdfs.mv.call_count)
+        mock_hdfs.mv.assert_any_call(["/in/d_20160804-0100/a"],
+                                     "/arch/d_20160804-0100")
+
+        mock_hdfs.reset_mock()
+        cl.undo(cl.read_journal(self.journal)[0])
+        mock_hdfs.mv.assert_any_call(["/arch/d_20160804-0100/a"],
+                                     "/in/d_20160804-0100")
+        mock_hdfs.rmr.assert_any_call("/out/d_20160804-0000")
+
+        # Without its output, restoring the files would duplicate records
+        entry = cl.read_journal(self.journal)[0]
+        del entry["output_path"]
+        with self.assertRaises(cl.CleanupException):
+            cl.undo(entry)
+
+    @mock.patch("filemerge.cleanup.hdfs")
+    def test_cleanup_source_previous(self, mock_hdfs):
+        previous = [("/out/_previous/d_20160804-0000/part-r-00000", 50)]
+        metrics = cl.cleanup_source(cl.DELETE, FILES, "d_20160804-0000",
+                                    "/in", self.journal, previous=previous,
+                                    output_path="/out/d_20160804-0000")
+        mock_hdfs.rm.assert_called_once_with(
+            [f for f, _ in FILES] + [previous[0][0]])
+        self.assertEqual(1, metrics["previous_files"])
+        self.assertEqual(60, metrics["bytes"])
+        self.assertEqual([[previous[0][0], 50]],
+                         cl.read_journal(self.journal)[0]["previous"])
+
+        # Undo puts the previous output back where the fold staged it
+        mock_hdfs.reset_mock()
+        cl.undo(cl.read_journal(self.journal)[0],
+                trash_root="/user/u/.Trash/Current")
+        mock_hdfs.mv.assert_any_call(
+            ["/user/u/.Trash/Current" + previous[0][0]],
+            "/out/_previous/d_20160804-0000")
+
+        # The previous output is merged data, which is never archived
+        mock_hdfs.reset_mock()
+        cl.cleanup_source(cl.ARCHIVE, FILES, "d_20160804-0000", "/in",
+                          self.journal, archive_prefix="/arch",
+                          previous=previous,
+                          output_path="/out/d_20160804-0000")
+        self.assertEqual(2, mock_hdfs.mv.call_count)
+        mock_hdfs.rm.assert_called_once_with([previous[0][0]])
+        with self.assertRaises(cl.CleanupException):
+            cl.undo(cl.read_journal(self.journal)[1])
+
+    @mock.patch("filemerge.cleanup.hdfs")
+    def test_remove_empty_dirs(self, mock_hdfs):
+        files = FILES + [("/in/d_20160804-0200/x/a", 5)]
+        listings = {
+            "/in/d_20160804-0000": [("/in/d_20160804-0000/_SUCCESS", 0),
+                                    ("/in/d_20160804-0000/_cleanup.json", 9)],
+            # A late file keeps its directory
+            "/in/d_20160804-0100": [("/in/d_20160804-0100/late", 5),
+                                    ("/in/d_20160804-0100/_SUCCESS", 0)],
+            "/in/d_20160804-0200": [],
+            "/in/d_20160804-0200/x": []}
+        mock_hdfs.ls_each.side_effect = lambda paths, include_hidden: \
+            [listings[p] for p in paths]
+
+        cl.remove_empty_dirs(files, "/in/")
+        mock_hdfs.rm.assert_called_once_with(
+            ["/in/d_20160804-0000/_SUCCESS",
+             "/in/d_20160804-0000/_cleanup.json"])
+        mock_hdfs.rmdir.assert_called_once_with(
+            ["/in/d_20160804-0200/x", "/in/d_20160804-0000",
+             "/in/d_20160804-0200"])
+
+        # The input prefix itself is kept
+        mock_hdfs.reset_mock()
+        cl.remove_empty_dirs([("/in/a", 1)], "/in")
+        self.assertFalse(mock_hdfs.ls_each.called)
+
+    @mock.patch("filemerge.cleanup.hdfs")
+    def test_mark_output(self, mock_hdfs):
+        cl.mark_output("/out/d_20160804-0000", {"action": "delete",
+                                                "files": 3})
+        path, text = mock_hdfs.put_text.call_args[0]
+        self.assertEqual("/out/d_20160804-0000/_cleanup.json", path)
+        marker = json.loads(text)
+        self.assertEqual(3, marker["files"])
+        self.assertIn("time", marker)
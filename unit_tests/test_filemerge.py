@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import os
+import json
 import unittest
 import datetime
 import mock
@@ -20,6 +21,7 @@ from optparse import OptionParser
 import re
 import tempfile
 import filemerge.filemerge as fm
+from filemerge.verify import VerificationException
 import subprocess as sp
 
 class Bunch(object):
@@ -41,21 +43,58 @@ def tempfile_write(fileobj, txt):
     fileobj.seek(0)
 
 
+def run_jobs(jobs, on_start=None, on_success=None, on_failure=None):
+    for job in jobs:
+        on_start(job)
+        on_success(job)
+        job.status = "succeeded"
+    return jobs
+
+
+def list_inputs(paths, include_hidden=False):
+    # Every input glob matches a file; no output exists yet
+    if include_hidden:
+        return [[] for _ in paths]
+    return [[(path.rstrip("*") + "/a", 10)] for path in paths]
+
+
 OPTIONS_KEYS = ["month", "topic", "directory",
                 "file", "year", "day",
                 "dry_run", "input_prefix", "lookback",
                 "queue", "window", "output_prefix",
-                "num_reducers", "codec"]
+                "num_reducers", "codec", "verify",
+                "verify_workers", "metrics_file", "delete_source",
+                "archive_source", "journal", "parallel",
+                "log_level", "log_format", "header", "engine",
+                "sort_key", "delimiter", "sort_buffer", "overlap",
+                "tiered", "tier_window", "script_retention",
+                "resource_profile", "resource_profiles"]
 
 
 class TestFilemerge(unittest.TestCase):
     def setUp(self):
+        patcher = mock.patch("filemerge.hdfs.ls_each", side_effect=list_inputs)
+        self.mock_ls_each = patcher.start()
+        self.addCleanup(patcher.stop)
         self._parser = OptionParser()
         self._options_dict = dict.fromkeys(OPTIONS_KEYS)
         self._options_dict.update({"topic": "foo1",
                                    "input_prefix": "foo2",
                                    "output_prefix": "foo3",
-                                   "queue": "foo4"})
+                                   "queue": "foo4",
+                                   "log_level": "DEBUG",
+                                   "log_format": "text",
+                                   "header": False,
+                                   "engine": "pig",
+                                   "delimiter": "\\t",
+                                   "sort_buffer": "100000",
+                                   "overlap": "reject",
+                                   "verify_workers": "4",
+                                   "parallel": "1",
+                                   "tiered": False,
+                                   "tier_window": "7",
+                                   "script_retention": "30",
+                                   "resource_profile": "none"})
 
     def test_getpaths_fromymd_day(self):
         year, month, day = 2015, 02, 12
@@ -195,7 +234,85 @@ class TestFilemerge(unittest.TestCase):
                       help="Mapreduce job queue"),
             mock.call("-r", "--dry-run",
                       dest="dry_run", action="store_true", default=False,
-                      help="Dry run; create, but dont execute the Pig script")
+                      help="Dry run; write the Pig script and a parameter file "
+                           "per job and log the pig commands, but dont "
+                           "run them"),
+            mock.call("-p", "--parallel",
+                      dest="parallel", action="store", default="1",
+                      help="Number of Pig jobs to run concurrently"),
+            mock.call("--log-level",
+                      dest="log_level", action="store", default="DEBUG",
+                      type="choice", choices=fm.LOG_LEVELS,
+                      help="Log level (DEBUG, INFO, WARNING, ERROR)"),
+            mock.call("--log-format",
+                      dest="log_format", action="store", default="text",
+                      type="choice", choices=["text", "json"],
+                      help="Log format (text or json)"),
+            mock.call("--header",
+                      dest="header", action="store_true", default=False,
+                      help="Input files start with a header row; store it "
+                           "once, in the output's _header file"),
+            mock.call("--engine",
+                      dest="engine", action="store", default="pig",
+                      type="choice", choices=["pig", "local"],
+                      help="Merge engine (pig or local)"),
+            mock.call("-v", "--verify",
+                      dest="verify", action="store_true", default=False,
+                      help="Verify record counts and digests of the output"),
+            mock.call("--verify-workers",
+                      dest="verify_workers", action="store", default="4",
+                      help="Number of parallel streams used for verification"),
+            mock.call("--metrics-file",
+                      dest="metrics_file", action="store",
+                      help="File to write the run metrics to (JSON)"),
+            mock.call("--delete-source",
+                      dest="delete_source", action="store_true", default=False,
+                      help="Delete the merged input files (requires --verify)"),
+            mock.call("--archive-source",
+                      dest="archive_source", action="store",
+                      help="Move the merged input files to this HDFS directory"
+                           " (requires --verify)"),
+            mock.call("--journal",
+                      dest="journal", action="store",
+                      help="Journal of source cleanups (default: "
+                           "journal/<topic>.jsonl)"),
+            mock.call("--sort-key",
+                      dest="sort_key", action="store", type="int",
+                      help="Sort the output by this field (zero based) and "
+                           "index the key range of every output file"),
+            mock.call("--delimiter",
+                      dest="delimiter", action="store", default="\\t",
+                      help="Field delimiter for --sort-key (default: tab)"),
+            mock.call("--sort-buffer",
+                      dest="sort_buffer", action="store", default="100000",
+                      help="Lines sorted in memory by the local engine"),
+            mock.call("--overlap",
+                      dest="overlap", action="store", default="reject",
+                      type="choice", choices=["reject", "dedupe", "ignore"],
+                      help="Input files matched by more than one directory: "
+                           "reject the plan, dedupe, or ignore"),
+            mock.call("--tiered",
+                      dest="tiered", action="store_true", default=False,
+                      help="Merge raw data hourly, then roll it up into "
+                           "daily and monthly outputs"),
+            mock.call("--tier-window",
+                      dest="tier_window", action="store", default="7",
+                      help="Days in which raw and hourly data is looked for "
+                           "by --tiered"),
+            mock.call("--script-retention",
+                      dest="script_retention", action="store", default="30",
+                      help="Days after which unused Pig scripts are deleted"),
+            mock.call("--resource-profile",
+                      dest="resource_profile", action="store", default="none",
+                      help="Resource profile of the Pig jobs: none (cluster "
+                           "defaults), auto (derived from the input size) or "
+                           "a profile name; split combination is off, so "
+                           "split sizes only affect files larger than a "
+                           "split"),
+            mock.call("--resource-profiles",
+                      dest="resource_profiles", action="store",
+                      help="JSON file with resource profiles replacing the "
+                           "built-in ones")
         ]
 
         fm.add_options(_parser)
@@ -234,6 +351,41 @@ class TestFilemerge(unittest.TestCase):
         with self.assertRaises(fm.InvalidSourceException):
             mode = fm.check_options(self._parser, _options)
 
+    def test_check_options_cleanup(self):
+        self._options_dict.update({"year": "2016", "delete_source": True})
+        _options = Bunch(**self._options_dict)
+        with self.assertRaises(fm.MissingRequiredOptionsException):
+            fm.check_options(self._parser, _options)
+
+        self._options_dict.update({"verify": True})
+        _options = Bunch(**self._options_dict)
+        self.assertEqual("year", fm.check_options(self._parser, _options))
+
+        self._options_dict.update({"archive_source": "/archive"})
+        _options = Bunch(**self._options_dict)
+        with self.assertRaises(fm.ConflictingOptionsException):
+            fm.check_options(self._parser, _options)
+
+    def test_check_options_tiered(self):
+        self._options_dict.update({"tiered": True})
+        _options = Bunch(**self._options_dict)
+        with self.assertRaises(fm.MissingRequiredOptionsException):
+            fm.check_options(self._parser, _options)
+
+        self._options_dict.update({"verify": True, "delete_source": True})
+        _options = Bunch(**self._options_dict)
+        self.assertEqual("tiered", fm.check_options(self._parser, _options))
+
+        self._options_dict.update({"header": True})
+        _options = Bunch(**self._options_dict)
+        with self.assertRaises(fm.ConflictingOptionsException):
+            fm.check_options(self._parser, _options)
+
+        self._options_dict.update({"year": "2016"})
+        _options = Bunch(**self._options_dict)
+        with self.assertRaises(fm.InvalidSourceException):
+            fm.check_options(self._parser, _options)
+
     @mock.patch("filemerge.filemerge.getpaths_fromymd")
     def test_get_paths_ymd(self, mock_getpaths_fromymd):
         src_keys = ["year", "month", "day"]
@@ -332,30 +484,41 @@ class TestFilemerge(unittest.TestCase):
         returned = fm.materialize(template, subs)
         self.assertEqual(expected, returned)
 
-    @mock.patch("filemerge.filemerge.sp.check_call")
-    def test_runpig(self, mock_check_call):
-        script_path = "/path/to/script"
-        result = fm.runpig(script_path)
-        cmd = "pig -f %s" % script_path
-        mock_check_call.assert_called_with(cmd.split(" "))
+    def test_materialize_backslash(self):
+        template = "A = filter A by line != @HEADER;"
+        returned = fm.materialize(template, {"@HEADER": "'a\\\\tb'"})
+        self.assertEqual("A = filter A by line != 'a\\\\tb';", returned)
 
-    @mock.patch("__builtin__.open")
+    def test_check_options_local_codec(self):
+        self._options_dict.update({"year": "2016", "engine": "local",
+                                   "codec": "gzip"})
+        _options = Bunch(**self._options_dict)
+        self.assertEqual("year", fm.check_options(self._parser, _options))
+
+        self._options_dict.update({"codec": "lzo"})
+        _options = Bunch(**self._options_dict)
+        with self.assertRaises(fm.ConflictingOptionsException):
+            fm.check_options(self._parser, _options)
+
+    @mock.patch("filemerge.scriptcache.write_params")
+    @mock.patch("filemerge.scriptcache.cached_script")
     @mock.patch("filemerge.filemerge.materialize")
     @mock.patch("filemerge.filemerge.get_compression_codec")
     @mock.patch("filemerge.filemerge.OptionParser")
     @mock.patch("filemerge.filemerge.add_options")
     @mock.patch("filemerge.filemerge.check_options")
     @mock.patch("filemerge.filemerge.getpaths")
-    @mock.patch("filemerge.filemerge.runpig")
+    @mock.patch("filemerge.supervisor.PigSupervisor")
     def test_main_dry_run(self,
-                          mock_runpig,
+                          mock_supervisor,
                           mock_getpaths,
                           mock_check_options,
                           mock_add_options,
                           mock_option_parser,
                           mock_get_comp_codec,
                           mock_materialize,
-                          mock_open):
+                          mock_cached_script,
+                          mock_write_params):
         _options_dict = {
             "month": "08",
             "topic": "topicfoo",
@@ -370,19 +533,42 @@ class TestFilemerge(unittest.TestCase):
             "window": "10",
             "output_prefix": "/path/to/output",
             "num_reducers": "10",
-            "codec": "lzo"
+            "codec": "lzo",
+            "verify": False,
+            "verify_workers": "4",
+            "metrics_file": None,
+            "delete_source": False,
+            "archive_source": None,
+            "journal": None,
+            "parallel": "2",
+            "log_level": "DEBUG",
+            "log_format": "text",
+            "header": False,
+            "engine": "pig",
+            "sort_key": None,
+            "delimiter": "\\t",
+            "sort_buffer": "100000",
+            "overlap": "reject",
+            "tiered": False,
+            "tier_window": "7",
+            "script_retention": "30",
+            "resource_profile": "none",
+            "resource_profiles": None
         }
         _options = Bunch(**_options_dict)
         input_paths = [('d_20160804-0000', 'foo/d_20160804*')]
         mock_getpaths.return_value = input_paths
         for dirname, ipath in input_paths:
             substitutions = {
-                "@OUTPUT_PATH": os.path.join(_options.output_prefix, dirname),
-                "@INPUT_PATH": ipath,
+                "@OUTPUT_PATH": "$OUTPUT",
+                "@INPUT_PATH": "$INPUT",
                 "@NUM_REDUCERS": _options_dict["num_reducers"],
                 "@SET_COMPRESSION_ENABLED": "set output.compression.enabled true",
                 "@SET_COMPRESSION_CODEC": "set output.compression.codec com.hadoop.compression.lzo.LzopCodec",
-                "@QUEUE": _options.queue
+                "@QUEUE": _options.queue,
+                "@FILTER_HEADER": "",
+                "@SORT_RECORDS": "",
+                "@SET_RESOURCES": ""
             }
 
         parser = mock_option_parser.return_value
@@ -390,8 +576,8 @@ class TestFilemerge(unittest.TestCase):
         mock_check_options.return_value = "ymd"
         mock_get_comp_codec.return_value = "com.hadoop.compression.lzo.LzopCodec"
         mock_materialize.return_value = "materialized_foo"
-        tf = make_tempfile()
-        mock_open.return_value.__enter__.return_value = tf
+        filename = os.path.join("scripts", "topicfoo-0123456789ab.pig")
+        mock_cached_script.return_value = filename
 
         fm.main()
 
@@ -401,14 +587,310 @@ class TestFilemerge(unittest.TestCase):
         mock_getpaths.assert_called_with(_options, mode="ymd")
         mock_get_comp_codec.assert_called_with(_options_dict["codec"])
         mock_materialize.assert_called_with(fm.PIG_TEMPLATE, substitutions)
-        filename = os.path.join("scripts", "%s-%s.pig" %(_options.topic, dirname))
-        mock_runpig.assert_called_with(filename)
-
-        mock_runpig.side_effect = sp.CalledProcessError(1, "foo")
+        mock_cached_script.assert_called_with("topicfoo", "materialized_foo")
+        mock_supervisor.assert_called_with(2)
+        supervisor = mock_supervisor.return_value
+        jobs = supervisor.run.call_args[0][0]
+        self.assertEqual([filename], [job.script for job in jobs])
+        self.assertEqual([ipath], [job.input_path for job in jobs])
+        self.assertEqual(["pig",
+                          "-param", "INPUT=%s" % ipath,
+                          "-param", "OUTPUT=/path/to/output/%s" % dirname,
+                          "-f", filename], jobs[0].command())
+
+        supervisor.run.side_effect = sp.CalledProcessError(1, "foo")
         with self.assertRaises(sp.CalledProcessError):
             fm.main()
 
-        mock_runpig.side_effect = Exception()
+        supervisor.run.side_effect = Exception()
         with self.assertRaises(Exception):
             fm.main()
 
+        supervisor.run.reset_mock()
+        supervisor.run.side_effect = None
+        _options.dry_run = True
+        param_file = os.path.join("scripts", "topicfoo-%s.params" % dirname)
+        mock_write_params.return_value = param_file
+        fm.main()
+        self.assertFalse(supervisor.run.called)
+        mock_write_params.assert_called_with(
+            "topicfoo", dirname,
+            {"INPUT": ipath, "OUTPUT": "/path/to/output/%s" % dirname})
+
+
+    @mock.patch("filemerge.filemerge.write_metrics")
+    @mock.patch("filemerge.verify.verify_merge")
+    @mock.patch("filemerge.filemerge.OptionParser")
+    @mock.patch("filemerge.filemerge.check_options")
+    @mock.patch("filemerge.filemerge.getpaths")
+    @mock.patch("filemerge.supervisor.PigSupervisor")
+    def test_main_verify(self,
+                         mock_supervisor,
+                         mock_getpaths,
+                         mock_check_options,
+                         mock_option_parser,
+                         mock_verify_merge,
+                         mock_write_metrics):
+        self._options_dict.update({"dry_run": False,
+                                   "parallel": "1",
+                                   "verify": True,
+                                   "verify_workers": "2",
+                                   "metrics_file": "metrics.json"})
+        _options = Bunch(**self._options_dict)
+        mock_option_parser.return_value.parse_args.return_value = (_options, [])
+        mock_getpaths.return_value = [("d_20160804-0000", "foo/d_20160804*")]
+        mock_verify_merge.return_value = {"verified": True}
+        mock_supervisor.return_value.run.side_effect = run_jobs
+
+        with mock.patch("filemerge.scriptcache.cached_script"):
+            fm.main()
+
+        mock_verify_merge.assert_called_with("foo/d_20160804*",
+                                             "foo3/d_20160804-0000", 2, None,
+                                             mock.ANY)
+        self.assertEqual("metrics.json", mock_write_metrics.call_args[0][0])
+        records = mock_write_metrics.call_args[0][1]
+        self.assertEqual(1, len(records))
+        self.assertEqual("d_20160804-0000", records[0]["dirname"])
+        self.assertEqual("foo3/d_20160804-0000", records[0]["output_path"])
+        self.assertEqual("succeeded", records[0]["status"])
+        self.assertEqual({"verified": True}, records[0]["verification"])
+
+        mock_verify_merge.return_value = {"verified": False}
+        with mock.patch("filemerge.scriptcache.cached_script"):
+            with self.assertRaises(VerificationException):
+                fm.main()
+
+    @mock.patch("filemerge.cleanup.mark_output")
+    @mock.patch("filemerge.cleanup.cleanup_source")
+    @mock.patch("filemerge.cleanup.check_unchanged")
+    @mock.patch("filemerge.hdfs.ls")
+    @mock.patch("filemerge.verify.verify_merge")
+    @mock.patch("filemerge.filemerge.OptionParser")
+    @mock.patch("filemerge.filemerge.check_options")
+    @mock.patch("filemerge.filemerge.getpaths")
+    @mock.patch("filemerge.supervisor.PigSupervisor")
+    def test_main_cleanup(self,
+                          mock_supervisor,
+                          mock_getpaths,
+                          mock_check_options,
+                          mock_option_parser,
+                          mock_verify_merge,
+                          mock_hdfs_ls,
+                          mock_check_unchanged,
+                          mock_cleanup_source,
+                          mock_mark_output):
+        self._options_dict.update({"dry_run": False,
+                                   "parallel": "1",
+                                   "verify": True,
+                                   "verify_workers": "2",
+                                   "delete_source": True})
+        _options = Bunch(**self._options_dict)
+        mock_option_parser.return_value.parse_args.return_value = (_options, [])
+        mock_getpaths.return_value = [("d_20160804-0000", "foo/d_20160804*")]
+        mock_verify_merge.return_value = {"verified": True}
+        snapshot = [("foo2/d_20160804-0000/a", 10)]
+        mock_hdfs_ls.return_value = snapshot
+        mock_supervisor.return_value.run.side_effect = run_jobs
+        mock_supervisor.return_value.cancelled = False
+
+        with mock.patch("filemerge.scriptcache.cached_script"):
+            fm.main()
+
+        mock_hdfs_ls.assert_called_with("foo/d_20160804*")
+        mock_check_unchanged.assert_called_with(snapshot, {"verified": True})
+        mock_cleanup_source.assert_called_with(
+            "delete", snapshot, "d_20160804-0000", "foo2",
+            os.path.join("journal", "foo1.jsonl"), archive_prefix=None,
+            previous=[], output_path="foo3/d_20160804-0000")
+        mock_mark_output.assert_called_with(
+            "foo3/d_20160804-0000", mock_cleanup_source.return_value)
+
+        # Sources stay when the run is interrupted during verification
+        mock_cleanup_source.reset_mock()
+        mock_supervisor.return_value.cancelled = True
+        with mock.patch("filemerge.scriptcache.cached_script"):
+            with self.assertRaises(KeyboardInterrupt):
+                fm.main()
+        self.assertFalse(mock_cleanup_source.called)
+
+        mock_supervisor.return_value.cancelled = False
+        mock_verify_merge.return_value = {"verified": False}
+        with mock.patch("filemerge.scriptcache.cached_script"):
+            with self.assertRaises(VerificationException):
+                fm.main()
+        self.assertFalse(mock_cleanup_source.called)
+
+    @mock.patch("filemerge.supervisor.PigSupervisor")
+    @mock.patch("filemerge.filemerge.configure_logging")
+    @mock.patch("filemerge.filemerge.OptionParser")
+    @mock.patch("filemerge.filemerge.check_options")
+    @mock.patch("filemerge.filemerge.getpaths")
+    def test_main_empty_plan(self,
+                             mock_getpaths,
+                             mock_check_options,
+                             mock_option_parser,
+                             mock_configure_logging,
+                             mock_supervisor):
+        self._options_dict.update({"log_level": "INFO", "log_format": "json"})
+        _options = Bunch(**self._options_dict)
+        mock_option_parser.return_value.parse_args.return_value = (_options, [])
+        mock_getpaths.return_value = []
+
+        self.assertEqual(0, fm.main())
+        mock_configure_logging.assert_called_with("INFO", "json")
+        self.assertFalse(mock_supervisor.called)
+        self.assertFalse(self.mock_ls_each.called)
+
+        # Directories without input files are dropped before scheduling
+        mock_getpaths.return_value = [("d_20160804-0000", "foo/d_20160804*")]
+        self.mock_ls_each.side_effect = lambda paths, include_hidden=False: \
+            [[] for _ in paths]
+        with mock.patch("filemerge.scriptcache.cached_script") as mock_cached:
+            self.assertEqual(0, fm.main())
+        self.assertEqual(1, self.mock_ls_each.call_count)
+        self.assertFalse(mock_cached.called)
+        self.assertFalse(mock_supervisor.called)
+
+    def test_json_formatter(self):
+        record = fm.logger.makeRecord(fm.logger.name, fm.logging.INFO,
+                                      "fn", 1, "merged %d", (3,), None,
+                                      func="main")
+        formatted = json.loads(fm.JsonFormatter().format(record))
+        self.assertEqual("merged 3", formatted["message"])
+        self.assertEqual("INFO", formatted["level"])
+        self.assertEqual("main", formatted["func"])
+
+    @mock.patch("filemerge.hdfs.put_text")
+    @mock.patch("filemerge.hdfs.ls")
+    @mock.patch("filemerge.headers.detect_header")
+    @mock.patch("filemerge.filemerge.materialize")
+    @mock.patch("filemerge.filemerge.OptionParser")
+    @mock.patch("filemerge.filemerge.check_options")
+    @mock.patch("filemerge.filemerge.getpaths")
+    @mock.patch("filemerge.supervisor.PigSupervisor")
+    def test_main_header(self,
+                         mock_supervisor,
+                         mock_getpaths,
+                         mock_check_options,
+                         mock_option_parser,
+                         mock_materialize,
+                         mock_detect_header,
+                         mock_hdfs_ls,
+                         mock_put_text):
+        self._options_dict.update({"dry_run": False,
+                                   "parallel": "1",
+                                   "verify_workers": "4",
+                                   "header": True})
+        _options = Bunch(**self._options_dict)
+        mock_option_parser.return_value.parse_args.return_value = (_options, [])
+        mock_getpaths.return_value = [("d_20160804-0000", "foo/d_20160804*")]
+        mock_detect_header.return_value = "id,'name'"
+        mock_materialize.return_value = "materialized_foo"
+        mock_supervisor.return_value.run.side_effect = run_jobs
+
+        with mock.patch("filemerge.scriptcache.cached_script"):
+            fm.main()
+
+        substitutions = mock_materialize.call_args[0][1]
+        self.assertEqual("A = filter A by line != '$HEADER';",
+                         substitutions["@FILTER_HEADER"])
+        jobs = mock_supervisor.return_value.run.call_args[0][0]
+        self.assertEqual("id,\\'name\\'", jobs[0].params["HEADER"])
+        mock_put_text.assert_called_with("foo3/d_20160804-0000/_header",
+                                         "id,'name'\n")
+
+    @mock.patch("filemerge.filemerge.OptionParser")
+    @mock.patch("filemerge.filemerge.check_options")
+    @mock.patch("filemerge.filemerge.getpaths")
+    @mock.patch("filemerge.supervisor.PigSupervisor")
+    def test_main_local_engine(self,
+                               mock_supervisor,
+                               mock_getpaths,
+                               mock_check_options,
+                               mock_option_parser):
+        self._options_dict.update({"dry_run": False,
+                                   "parallel": "1",
+                                   "num_reducers": "3",
+                                   "codec": "GZIP",
+                                   "header": True,
+                                   "engine": "local"})
+        _options = Bunch(**self._options_dict)
+        mock_option_parser.return_value.parse_args.return_value = (_options, [])
+        mock_getpaths.return_value = [("d_20160804-0000", "foo/d_20160804*")]
+
+        fm.main()
+
+        jobs = mock_supervisor.return_value.run.call_args[0][0]
+        self.assertEqual(1, len(jobs))
+        command = jobs[0].command()
+        self.assertTrue(command[1].endswith("local.py"))
+        self.assertEqual(["-i", "foo/d_20160804*",
+                          "-o", "foo3/d_20160804-0000",
+                          "-n", "3", "--header", "-c", "gzip"], command[2:])
+
+    @mock.patch("filemerge.index.write_index")
+    @mock.patch("filemerge.index.build_index")
+    @mock.patch("filemerge.filemerge.materialize")
+    @mock.patch("filemerge.filemerge.OptionParser")
+    @mock.patch("filemerge.filemerge.check_options")
+    @mock.patch("filemerge.filemerge.getpaths")
+    @mock.patch("filemerge.supervisor.PigSupervisor")
+    def test_main_sort_key(self,
+                           mock_supervisor,
+                           mock_getpaths,
+                           mock_check_options,
+                           mock_option_parser,
+                           mock_materialize,
+                           mock_build_index,
+                           mock_write_index):
+        self._options_dict.update({"dry_run": False,
+                                   "parallel": "1",
+                                   "verify_workers": "4",
+                                   "sort_key": 2,
+                                   "delimiter": "|"})
+        _options = Bunch(**self._options_dict)
+        mock_option_parser.return_value.parse_args.return_value = (_options, [])
+        mock_getpaths.return_value = [("d_20160804-0000", "foo/d_20160804*")]
+        mock_materialize.return_value = "materialized_foo"
+        mock_build_index.return_value = ["entries"]
+        mock_supervisor.return_value.run.side_effect = run_jobs
+
+        with mock.patch("filemerge.scriptcache.cached_script"):
+            fm.main()
+
+        substitutions = mock_materialize.call_args[0][1]
+        self.assertEqual(
+            "S = foreach B generate $0 AS line, "
+            "(chararray)STRSPLIT($0, '\\\\|', 4).$2 AS key;\n"
+            "    O = order S by key;\n"
+            "    B = foreach O generate line;",
+            substitutions["@SORT_RECORDS"])
+        mock_build_index.assert_called_with("foo3/d_20160804-0000", 2, "|",
+                                            workers=4, pool=mock.ANY)
+        mock_write_index.assert_called_with("foo3/d_20160804-0000",
+                                            ["entries"], 2, "|")
+
+    @mock.patch("filemerge.filemerge.OptionParser")
+    @mock.patch("filemerge.filemerge.check_options")
+    @mock.patch("filemerge.filemerge.getpaths")
+    @mock.patch("filemerge.supervisor.PigSupervisor")
+    def test_main_local_engine_sort_key(self,
+                                        mock_supervisor,
+                                        mock_getpaths,
+                                        mock_check_options,
+                                        mock_option_parser):
+        self._options_dict.update({"dry_run": False,
+                                   "parallel": "1",
+                                   "num_reducers": "2",
+                                   "engine": "local",
+                                   "sort_key": 0})
+        _options = Bunch(**self._options_dict)
+        mock_option_parser.return_value.parse_args.return_value = (_options, [])
+        mock_getpaths.return_value = [("d_20160804-0000", "foo/d_20160804*")]
+
+        fm.main()
+
+        jobs = mock_supervisor.return_value.run.call_args[0][0]
+        self.assertEqual(["--sort-key", "0", "--delimiter", "\t",
+                          "--sort-buffer", "100000"], jobs[0].command()[8:])
@@ -0,0 +1,323 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import datetime
+import unittest
+import subprocess as sp
+import mock
+import filemerge.hdfs
+import filemerge.cleanup as cl
+import filemerge.supervisor as su
+import filemerge.tiers as tr
+from filemerge import MergePlan
+from harness import FakeCluster, merge_until_done
+
+
+HEADER = "name\tpart\trow"
+
+# Number of directories of the scale test; raise it (e.g. to 10000) to
+# exercise the scheduler at production scale
+SCALE_DIRS = int(os.environ.get("FILEMERGE_HARNESS_DIRS", "200"))
+
+
+class TestHarness(unittest.TestCase):
+    def expected_records(self, name, files_per_dir=2, lines_per_file=10):
+        return ["%s\t%d\t%d" % (name, part, i) for part in range(files_per_dir)
+                for i in range(lines_per_file)]
+
+    def test_pig_merge_verify_cleanup(self):
+        with FakeCluster(latency=0.2) as cluster:
+            names = cluster.make_directories("/data/in", 8, header=HEADER)
+            plan = cluster.plan(names, parallel="4", verify=True, header=True,
+                                delete_source=True)
+            plan.execute()
+
+            report = plan.report()
+            self.assertEqual([su.SUCCEEDED] * 8,
+                             [r["status"] for r in report])
+            for name, record in zip(names, report):
+                self.assertEqual(self.expected_records(name),
+                                 cluster.read_records("/data/out/" + name))
+                self.assertTrue(record["verification"]["verified"])
+                self.assertEqual(20, record["counters"]["records_stored"])
+                self.assertEqual(HEADER, record["header"])
+                self.assertFalse(os.path.exists(
+                    cluster.local_path("/data/in/" + name)))
+
+            self.assertTrue(1 < cluster.max_concurrency() <= 4)
+
+    def test_local_engine(self):
+        with FakeCluster() as cluster:
+            names = cluster.make_directories("/data/in", 3, header=HEADER)
+            plan = cluster.plan(names, parallel="3", verify=True, header=True,
+                                engine="local", num_reducers="1")
+            plan.execute()
+
+            for name, record in zip(names, plan.report()):
+                self.assertTrue(record["verification"]["verified"])
+                self.assertEqual([HEADER] + self.expected_records(name),
+                                 cluster.read_records("/data/out/" + name))
+
+    def test_dry_run_commands(self):
+        with FakeCluster() as cluster:
+            names = cluster.make_directories("/data/in", 2, header=HEADER)
+            plan = cluster.plan(names, header=True)
+            commands = plan.dry_run()
+            self.assertFalse(os.path.exists(cluster.local_path("/data/out")))
+
+            # The logged commands run the jobs by hand
+            for name, cmd in zip(names, commands):
+                self.assertEqual("-param_file", cmd[1])
+                sp.check_call(cmd, stderr=open(os.devnull, "w"))
+                self.assertEqual(self.expected_records(name),
+                                 cluster.read_records("/data/out/" + name))
+
+    def test_files_without_trailing_newline(self):
+        for engine in ("pig", "local"):
+            with FakeCluster() as cluster:
+                records = []
+                for part in range(3):
+                    lines = ["a%d" % part, "b%d" % part]
+                    cluster.write_file("/data/in/d_00000/part-%d" % part,
+                                       lines)
+                    # Strip the newline ending the file
+                    local_ = cluster.local_path(
+                        "/data/in/d_00000/part-%d" % part)
+                    with open(local_, "r+") as fh:
+                        fh.truncate(os.path.getsize(local_) - 1)
+                    records.extend(lines)
+
+                plan = cluster.plan(["d_00000"], verify=True, engine=engine,
+                                    num_reducers="1")
+                plan.execute()
+                self.assertEqual(sorted(records), sorted(
+                    cluster.read_records("/data/out/d_00000")))
+                self.assertEqual(6, plan.report()[0]["verification"][
+                    "output_records"])
+
+    def test_failure_stops_dispatch(self):
+        with FakeCluster(fail="d_00002$") as cluster:
+            names = cluster.make_directories("/data/in", 5)
+            plan = cluster.plan(names, parallel="1", verify=True)
+            with self.assertRaises(sp.CalledProcessError):
+                plan.execute()
+
+            self.assertEqual([su.SUCCEEDED, su.SUCCEEDED, su.FAILED],
+                             [r["status"] for r in plan.report()])
+            self.assertEqual([su.PENDING, su.PENDING],
+                             [job.runner.status for job in plan.jobs[3:]])
+            self.assertEqual(["end", "end", "fail"],
+                             [event for _, event, _ in cluster.events()
+                              if event != "start"])
+
+    def test_resume_after_failures(self):
+        with FakeCluster(failure_rate=0.4, seed=7) as cluster:
+            names = cluster.make_directories("/data/in", 12)
+            rounds = merge_until_done(cluster, names, parallel="3",
+                                      verify=True, delete_source=True)
+
+            # Some attempts failed, yet every directory was merged once
+            self.assertTrue(len(rounds) > 1)
+            succeeded = [r["dirname"] for records in rounds
+                         for r in records if r["status"] == su.SUCCEEDED]
+            self.assertEqual(sorted(names), sorted(succeeded))
+            for name in names:
+                self.assertEqual(self.expected_records(name),
+                                 cluster.read_records("/data/out/" + name))
+
+            failures = [e for e in cluster.events() if e[1] == "fail"]
+            attempts = [e for e in cluster.events() if e[1] == "start"]
+            self.assertEqual(len(names) + len(failures), len(attempts))
+
+    def test_rerun_after_delete_source(self):
+        with FakeCluster() as cluster:
+            names = cluster.make_directories("/data/in", 2)
+            options = dict(verify=True, delete_source=True)
+            cluster.plan(names, **options).execute()
+
+            # The merged directories are gone; a rerun has nothing to do and
+            # leaves the outputs alone
+            plan = cluster.plan(names, **options)
+            self.assertEqual([], plan.jobs)
+            plan.execute()
+            self.assertEqual([], plan.report())
+            for name in names:
+                self.assertEqual(self.expected_records(name),
+                                 cluster.read_records("/data/out/" + name))
+            self.assertEqual(2, len([e for e in cluster.events()
+                                     if e[1] == "start"]))
+
+            # Pig itself would remove an output whose input is gone, and fail
+            output = "/data/out/" + names[0]
+            with open(os.devnull, "w") as devnull:
+                self.assertEqual(2, sp.call(
+                    ["pig", "-param", "INPUT=/data/in/%s/*" % names[0],
+                     "-param", "OUTPUT=" + output, "-f", "merge.pig"],
+                    stderr=devnull))
+            self.assertFalse(os.path.exists(cluster.local_path(output)))
+
+    def test_rerun_after_failed_verification(self):
+        with FakeCluster(output_bytes=7) as cluster:
+            names = cluster.make_directories("/data/in", 2)
+            options = dict(parallel="2", verify=True, delete_source=True)
+            with self.assertRaises(Exception):
+                cluster.plan(names, **options).execute()
+            # The unverified outputs are withdrawn, their sources kept
+            for name in names:
+                self.assertFalse(os.path.exists(cluster.local_path(
+                    "/data/out/%s/_SUCCESS" % name)))
+
+            cluster.configure()
+            # An output written without cleanup only blocks its directory
+            cluster.write_file("/data/out/d_00001/part-r-00000", ["x"])
+            cluster.write_file("/data/out/d_00001/_SUCCESS", [])
+            plan = cluster.plan(names, **options)
+            plan.execute()
+            self.assertEqual([su.SUCCEEDED, su.SKIPPED],
+                             [r["status"] for r in plan.report()])
+            self.assertEqual(self.expected_records("d_00000"),
+                             cluster.read_records("/data/out/d_00000"))
+            self.assertEqual(["x"], cluster.read_records("/data/out/d_00001"))
+
+    def test_late_files_fold_into_output(self):
+        with FakeCluster() as cluster:
+            names = cluster.make_directories("/data/in", 2)
+            options = dict(verify=True, delete_source=True)
+            cluster.plan(names, **options).execute()
+            late = "d_00000\tlate\t0"
+            cluster.write_file("/data/in/d_00000/late-00000", [late])
+
+            # The merge of the late file fails after its output moved aside
+            cluster.configure(fail="d_00000$")
+            plan = cluster.plan(names, **options)
+            self.assertEqual(["d_00000"], [job.name for job in plan.jobs])
+            with self.assertRaises(sp.CalledProcessError):
+                plan.execute()
+
+            cluster.configure()
+            plan = cluster.plan(names, **options)
+            plan.execute()
+            self.assertEqual(
+                sorted(self.expected_records("d_00000") + [late]),
+                sorted(cluster.read_records("/data/out/d_00000")))
+            self.assertEqual(21, plan.report()[0]["verification"][
+                "input_records"])
+            self.assertEqual([], os.listdir(cluster.local_path(
+                "/data/out/_previous")))
+            self.assertTrue(os.path.exists(cluster.local_path(
+                "/data/out/d_00000/_cleanup.json")))
+
+    def test_undo_cleanup(self):
+        trash = "/user/u/.Trash/Current"
+        with FakeCluster(trash=trash) as cluster:
+            names = cluster.make_directories("/data/in", 1)
+            journal = os.path.join(cluster.tmpdir, "journal.jsonl")
+            options = dict(verify=True, archive_source="/data/archive",
+                           journal=journal)
+            cluster.plan(names, **options).execute()
+            late = "d_00000\tlate\t0"
+            cluster.write_file("/data/in/d_00000/late-00000", [late])
+            cluster.plan(names, **options).execute()
+            expected = sorted(self.expected_records("d_00000") + [late])
+
+            # Undoing the fold stages the previous output again
+            entries = cl.read_journal(journal)
+            cl.undo(entries[1], trash)
+            self.assertFalse(os.path.exists(cluster.local_path(
+                "/data/out/d_00000")))
+            self.assertEqual(
+                self.expected_records("d_00000"),
+                cluster.read_records("/data/out/_previous/d_00000"))
+            cl.undo(entries[0], trash)
+            self.assertFalse(os.path.exists(cluster.local_path(
+                "/data/out/_previous/d_00000")))
+
+            # A rerun merges the restored sources once
+            plan = cluster.plan(names, **options)
+            plan.execute()
+            self.assertEqual(expected, sorted(cluster.read_records(
+                "/data/out/d_00000")))
+            self.assertEqual(21, plan.report()[0]["verification"][
+                "output_records"])
+
+    def test_tiers_late_raw_files(self):
+        with FakeCluster() as cluster:
+            now = datetime.datetime(2016, 3, 2, 10, 30)
+            options = MergePlan.create(
+                topic="harness", input_prefix="/data/raw",
+                output_prefix="/data/tiers", queue="default", tiered=True,
+                verify=True, delete_source=True).options
+            cluster.write_file("/data/raw/d_20160229-2310/part-0", ["a", "b"])
+            cluster.write_file("/data/raw/d_20160302-0810/part-0", ["c"])
+            tr.run_tiers(options, now)
+
+            self.assertEqual(["a", "b"], cluster.read_records(
+                "/data/tiers/monthly/d_201602"))
+            # Promoted directories are removed, sidecar files and all
+            self.assertEqual([], os.listdir(cluster.local_path("/data/raw")))
+            self.assertEqual([], os.listdir(
+                cluster.local_path("/data/tiers/daily")))
+            self.assertEqual(["d_20160302-0800"], os.listdir(
+                cluster.local_path("/data/tiers/hourly")))
+
+            # Late data for a promoted month, and for a promoted hour
+            cluster.write_file("/data/raw/d_20160229-2350/late-0", ["d"])
+            cluster.write_file("/data/raw/d_20160302-0820/late-0", ["e"])
+            metrics = tr.run_tiers(options, now)
+
+            self.assertEqual(["hourly", "hourly", "daily", "monthly"],
+                             [r["tier"] for r in metrics])
+            self.assertEqual(["a", "b", "d"], sorted(cluster.read_records(
+                "/data/tiers/monthly/d_201602")))
+            self.assertEqual(["c", "e"], sorted(cluster.read_records(
+                "/data/tiers/hourly/d_20160302-0800")))
+            self.assertEqual([], os.listdir(cluster.local_path("/data/raw")))
+            self.assertEqual([], os.listdir(
+                cluster.local_path("/data/tiers/daily")))
+
+    def test_scale(self):
+        with FakeCluster(output_bytes=64) as cluster:
+            names = cluster.make_directories("/data/in", SCALE_DIRS,
+                                             files_per_dir=1,
+                                             lines_per_file=1)
+            plan = cluster.plan(names, parallel="16")
+            plan.execute()
+
+            self.assertEqual(SCALE_DIRS, len([
+                r for r in plan.report() if r["status"] == su.SUCCEEDED]))
+            self.assertEqual(1, len(set(job.runner.script
+                                        for job in plan.jobs)))
+            self.assertTrue(cluster.max_concurrency() <= 16)
+            self.assertTrue(cluster.throughput() > 0)
+
+    def test_plan_many_directories(self):
+        with FakeCluster() as cluster:
+            names = cluster.make_directories("/data/in", 10000,
+                                             files_per_dir=1,
+                                             lines_per_file=1)
+            with mock.patch("filemerge.hdfs._run",
+                            wraps=filemerge.hdfs._run) as mock_run:
+                plan = cluster.plan(names + ["d_empty"])
+
+            # One listing per thousand directories; empty ones are skipped
+            self.assertEqual(11, mock_run.call_count)
+            self.assertEqual(names, [job.name for job in plan.jobs])
+            self.assertEqual([("/data/in/d_00042/part-00000", 12)],
+                             plan.jobs[42].files)
+            self.assertEqual(1, len(set(job.runner.script
+                                        for job in plan.jobs)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,220 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import zlib
+import unittest
+from StringIO import StringIO
+import mock
+import filemerge.hdfs as hdfs
+import filemerge.headers as hd
+import filemerge.index as ix
+import filemerge.local as lc
+
+
+class FakeFS(object):
+    """
+    In-memory stand-in for the hdfs module functions used by the local engine
+    """
+
+    def __init__(self, files):
+        self.files = dict(files)
+
+    def ls(self, path_):
+        return [(p, len(c)) for p, c in sorted(self.files.items())
+                if p.startswith(path_.rstrip("*"))]
+
+    def text(self, paths_):
+        return (line for p in paths_
+                for line in StringIO(self.files[p]).readlines())
+
+    def read_each(self, files):
+        return ((p, iter(StringIO(self.files[p]).readlines()))
+                for p, _ in files)
+
+    def put(self, path_):
+        fs = self
+
+        class Stdin(StringIO):
+            def close(self):
+                fs.files[path_] = self.getvalue()
+
+        return mock.Mock(stdin=Stdin(), wait=mock.Mock(return_value=0))
+
+    def put_text(self, path_, text_):
+        self.files[path_] = text_
+
+    def rmr(self, path_):
+        for p in list(self.files):
+            if p.startswith(path_ + "/"):
+                del self.files[p]
+
+    def mkdir(self, paths_):
+        pass
+
+
+def patch_fs(fs):
+    patches = [mock.patch("filemerge.hdfs.%s" % name, getattr(fs, name))
+               for name in ("ls", "text", "read_each", "put", "put_text",
+                            "rmr", "mkdir")]
+    for patch in patches:
+        patch.start()
+    return patches
+
+
+class TestLocal(unittest.TestCase):
+    def setUp(self):
+        self.fs = FakeFS({
+            "in/a": "id,ts\n1,x\n2,y\n",
+            "in/b": "id,ts\n3,z\n",
+            "in/c": "id,ts\n4,w\n5,v\n6,u\n",
+            "out/stale": "old\n"
+        })
+        self.patches = patch_fs(self.fs)
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+
+    def test_assign_outputs(self):
+        files = [("a", 10), ("b", 7), ("c", 5), ("d", 4)]
+        groups = lc.assign_outputs(files, 2)
+        self.assertEqual([[("a", 10), ("d", 4)], [("b", 7), ("c", 5)]],
+                         groups)
+        self.assertEqual([files[:1]], lc.assign_outputs(files[:1], 5))
+
+    def test_merge_with_header(self):
+        progress = StringIO()
+        with mock.patch("filemerge.local.sys.stderr", progress):
+            counters = lc.merge("in/", "out", num_outputs=2, header=True)
+
+        self.assertEqual(6, counters["records"])
+        self.assertEqual(2, counters["outputs"])
+        self.assertNotIn("out/stale", self.fs.files)
+        self.assertEqual("id,ts\n", self.fs.files["out/_header"])
+        self.assertIn("out/_SUCCESS", self.fs.files)
+
+        lines = []
+        for i in range(2):
+            content = self.fs.files["out/part-m-%05d" % i].splitlines()
+            self.assertEqual("id,ts", content[0])
+            self.assertNotIn("id,ts", content[1:])
+            lines.extend(content[1:])
+        self.assertEqual(["1,x", "2,y", "3,z", "4,w", "5,v", "6,u"],
+                         sorted(lines))
+        self.assertIn("100% complete", progress.getvalue())
+
+    def test_merge_header_mismatch(self):
+        self.fs.files["in/b"] = "id,timestamp\n3,z\n"
+        with mock.patch("filemerge.local.sys.stderr", StringIO()):
+            with self.assertRaises(hd.HeaderMismatchException):
+                lc.merge("in/", "out", num_outputs=1, header=True)
+
+    def test_merge_compressed(self):
+        with mock.patch("filemerge.local.sys.stderr", StringIO()):
+            lc.merge("in/", "out", num_outputs=1, codec="gzip")
+        data = zlib.decompress(self.fs.files["out/part-m-00000.gz"],
+                               16 + zlib.MAX_WBITS)
+        self.assertEqual(9, len(data.splitlines()))
+
+    def test_detect_header(self):
+        files = self.fs.ls("in/")
+        self.assertEqual("id,ts", hd.detect_header(files, workers=2))
+
+        self.fs.files["in/c"] = "id\n4\n"
+        with self.assertRaises(hd.HeaderMismatchException):
+            hd.detect_header(self.fs.ls("in/"))
+        self.assertIsNone(hd.detect_header([("in/empty", 0)]))
+
+        # Files without lines are ignored, whatever their size
+        self.fs.files.update({"in/c": "id,ts\n", "in/empty.gz": ""})
+        self.assertEqual("id,ts", hd.detect_header(
+            self.fs.ls("in/") + [("in/empty.gz", 20)]))
+
+    def test_first_lines(self):
+        with mock.patch("filemerge.headers.BATCH_FILE_BYTES", 14), \
+                mock.patch("filemerge.hdfs.read_each",
+                           wraps=self.fs.read_each) as mock_read_each:
+            found = hd.first_lines(self.fs.ls("in/"), workers=2)
+        self.assertEqual({"in/a": "id,ts", "in/b": "id,ts", "in/c": "id,ts"},
+                         found)
+        # The small files in one batch per worker, in/c on its own
+        self.assertEqual([[("in/a", 14)], [("in/b", 10)]],
+                         sorted(c[0][0] for c in mock_read_each.call_args_list))
+
+    def test_pig_string(self):
+        self.assertEqual("'a\\\\b'", hd.pig_string("a\\b"))
+        self.assertEqual("'it\\'s'", hd.pig_string("it's"))
+
+    def test_sort_key(self):
+        self.assertEqual("b", ix.sort_key("a\tb\tc\n", 1, "\t"))
+        self.assertEqual("c", ix.sort_key("a,b,c\r\n", 2, ","))
+        self.assertEqual("", ix.sort_key("a,b\n", 5, ","))
+        self.assertEqual("a\\|b\\.", ix.pig_regex("a|b."))
+
+    def test_select_files(self):
+        index = {"files": [
+            {"file": "part-m-00000", "records": 2, "min": "a", "max": "c"},
+            {"file": "part-m-00001", "records": 2, "min": "d", "max": "f"},
+            {"file": "part-m-00002", "records": 0, "min": None, "max": None},
+            {"file": "part-r-00003", "records": None, "min": "b", "max": "b"}]}
+        self.assertEqual(["part-m-00000", "part-m-00001", "part-r-00003"],
+                         ix.select_files(index))
+        self.assertEqual(["part-m-00001"], ix.select_files(index, low="d"))
+        self.assertEqual(["part-m-00000", "part-r-00003"],
+                         ix.select_files(index, high="b"))
+
+    def test_build_index(self):
+        self.fs.files.update({"out/part-r-00000": "1,a\n2,b\n3,c\n",
+                              "out/part-r-00001": "",
+                              "out/part-r-00002.gz": "4,d\n5,e\n",
+                              "out/part-r-00003": "6,f\n" + "7" * 2000 + "\n"})
+        tails = {p: c[-hdfs.TAIL_BYTES:] for p, c in self.fs.files.items()}
+        with mock.patch("filemerge.hdfs.tail", side_effect=tails.get), \
+                mock.patch("filemerge.hdfs.text",
+                           wraps=self.fs.text) as mock_text:
+            entries = ix.build_index("out/part", 0, ",", workers=2)
+
+        self.assertEqual([("part-r-00000", "1", "3", None),
+                          ("part-r-00001", None, None, 0),
+                          ("part-r-00002.gz", "4", "5", 2),
+                          ("part-r-00003", "6", "7" * 2000, 2)],
+                         [(e["file"], e["min"], e["max"], e["records"])
+                          for e in entries])
+        # Only the last two files were streamed in full
+        self.assertEqual(["out/part-r-00000", "out/part-r-00002.gz",
+                          "out/part-r-00003"],
+                         sorted(c[0][0][0] for c in mock_text.call_args_list))
+
+    def test_merge_sorted(self):
+        self.fs.files.update({"in/a": "id,ts\n5,x\n1,y\n",
+                              "in/b": "id,ts\n3,z\n",
+                              "in/c": "id,ts\n6,w\n2,v\n4,u\n"})
+        with mock.patch("filemerge.local.MAX_FAN_IN", 2), \
+                mock.patch("sys.stderr"):
+            counters = lc.merge("in/", "out", num_outputs=2, header=True,
+                                sort_field=0, delimiter=",", sort_buffer=2)
+
+        self.assertEqual(6, counters["records"])
+        self.assertEqual(2, counters["outputs"])
+        first = self.fs.files["out/part-m-00000"]
+        second = self.fs.files["out/part-m-00001"]
+        self.assertEqual("id,ts\n1,y\n2,v\n3,z\n", first)
+        self.assertEqual("id,ts\n4,u\n5,x\n6,w\n", second)
+
+        index = json.loads(self.fs.files["out/_index.json"])
+        self.assertEqual(0, index["sort_key"])
+        self.assertEqual([("part-m-00000", "1", "3", 3),
+                          ("part-m-00001", "4", "6", 3)],
+                         [(e["file"], e["min"], e["max"], e["records"])
+                          for e in index["files"]])
@@ -0,0 +1,105 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import unittest
+import mock
+import filemerge.overlap as ov
+
+
+def list_each(paths):
+    return [LISTINGS[path] for path in paths]
+
+
+LISTINGS = {
+    "in/d_201502*": [("in/d_20150224/a", 1), ("in/d_20150225/a", 2),
+                     ("in/d_20150225/b", 3), ("in/d_20150226/a", 4)],
+    "in/d_20150225*": [("in/d_20150225/a", 2), ("in/d_20150225/b", 3)],
+    "in/d_20150301*": [("in/d_20150301/a", 5)]
+}
+
+INPUT_PATHS = [("d_201502", "in/d_201502*"),
+               ("d_20150225", "in/d_20150225*"),
+               ("d_20150301", "in/d_20150301*")]
+
+
+class TestOverlap(unittest.TestCase):
+    def test_candidate_overlaps(self):
+        self.assertEqual([("d_201502", "d_20150225")],
+                         ov.candidate_overlaps(INPUT_PATHS))
+        self.assertEqual([], ov.candidate_overlaps(
+            [("d_20150201", "in/d_20150201*"),
+             ("d_20150210", "in/d_20150210*")]))
+        self.assertEqual([("d_2015", "d_201502"), ("d_2015", "d_20150225"),
+                          ("d_201502", "d_20150225")],
+                         ov.candidate_overlaps(
+                             [("d_20150225", "in/d_20150225*"),
+                              ("d_2015", "in/d_2015*"),
+                              ("d_201502", "in/d_201502*")]))
+
+    @mock.patch("filemerge.hdfs.ls_each")
+    def test_no_candidates_no_listing(self, mock_ls_each):
+        input_paths = [("d_20150225", "in/d_20150225*"),
+                       ("d_20150301", "in/d_20150301*")]
+        self.assertEqual(input_paths, ov.check_overlaps(input_paths))
+        self.assertFalse(mock_ls_each.called)
+
+    @mock.patch("filemerge.hdfs.ls_each")
+    def test_reject(self, mock_ls_each):
+        mock_ls_each.side_effect = list_each
+        with self.assertRaises(ov.OverlappingInputException):
+            ov.check_overlaps(INPUT_PATHS, ov.REJECT)
+        self.assertEqual(INPUT_PATHS,
+                         ov.check_overlaps(INPUT_PATHS, ov.IGNORE))
+
+        with self.assertRaises(ov.OverlappingInputException):
+            ov.check_overlaps(INPUT_PATHS + INPUT_PATHS[2:], ov.REJECT)
+
+        # The candidates are listed with one call
+        self.assertEqual(1, mock_ls_each.call_count)
+        mock_ls_each.assert_called_with(["in/d_201502*", "in/d_20150225*"])
+
+    @mock.patch("filemerge.hdfs.ls_each")
+    def test_dedupe(self, mock_ls_each):
+        mock_ls_each.side_effect = list_each
+        deduped = ov.check_overlaps(INPUT_PATHS + INPUT_PATHS[2:], ov.DEDUPE)
+        self.assertEqual([("d_201502", "in/d_20150224,in/d_20150226"),
+                          ("d_20150225", "in/d_20150225*"),
+                          ("d_20150301", "in/d_20150301*")], deduped)
+
+        # Listings passed in are used, and updated for rewritten entries
+        mock_ls_each.reset_mock()
+        listings = dict((name, LISTINGS[ipath]) for name, ipath in INPUT_PATHS)
+        ov.check_overlaps(INPUT_PATHS, ov.DEDUPE, listings)
+        self.assertFalse(mock_ls_each.called)
+        self.assertEqual([("in/d_20150224/a", 1), ("in/d_20150226/a", 4)],
+                         listings["d_201502"])
+        self.assertEqual(LISTINGS["in/d_20150225*"], listings["d_20150225"])
+
+        # An entry whose files are all merged elsewhere is dropped
+        mock_ls_each.side_effect = lambda paths: \
+            [LISTINGS["in/d_20150225*"] for _ in paths]
+        deduped = ov.check_overlaps([("d_201502", "in/d_201502*"),
+                                     ("d_20150225", "in/d_20150225*")],
+                                    ov.DEDUPE)
+        self.assertEqual([("d_20150225", "in/d_20150225*")], deduped)
+
+    def test_compact_paths(self):
+        files = ["in/d_1/a", "in/d_1/b", "in/d_2/h=1/a", "in/d_2/h=2/a",
+                 "in/top"]
+        removed = set(["in/d_2/h=2/b"])
+        self.assertEqual(["in/d_1", "in/d_2/h=1", "in/d_2/h=2/a", "in/top"],
+                         ov.compact_paths(files, removed, "in"))
+
+
+if __name__ == "__main__":
+    unittest.main()
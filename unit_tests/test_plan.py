@@ -0,0 +1,301 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import unittest
+from StringIO import StringIO
+import mock
+import filemerge
+import filemerge.filemerge as fm
+import filemerge.plan as pl
+from filemerge.overlap import OverlappingInputException
+
+
+def run_jobs(jobs, on_start=None, on_success=None, on_failure=None):
+    for job in jobs:
+        on_start(job)
+        on_success(job)
+        job.status = "succeeded"
+    return jobs
+
+
+def list_inputs(paths, include_hidden=False):
+    # Every input glob matches a file; no output exists yet
+    if include_hidden:
+        return [[] for _ in paths]
+    return [[(path.rstrip("*") + "/a", 10)] for path in paths]
+
+
+class TestPlan(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch("filemerge.hdfs.ls_each", side_effect=list_inputs)
+        self.mock_ls_each = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create(self, **kwargs):
+        options = {"topic": "foo1", "input_prefix": "foo2",
+                   "output_prefix": "foo3", "queue": "foo4",
+                   "year": "2016", "month": "8", "day": "4"}
+        options.update(kwargs)
+        return pl.MergePlan.create(**options)
+
+    def test_exports(self):
+        self.assertIs(pl.MergePlan, filemerge.MergePlan)
+        self.assertIs(pl.MergeJob, filemerge.MergeJob)
+
+    def test_create(self):
+        plan = self.create(parallel=3)
+        self.assertEqual("year", plan.mode)
+        self.assertEqual(3, plan.options.parallel)
+        self.assertEqual("pig", plan.options.engine)
+        self.assertEqual("\t", plan.delimiter)
+
+        with self.assertRaises(TypeError):
+            self.create(reducers=3)
+
+        # The library API raises without printing the command line usage
+        with mock.patch("sys.stdout", new_callable=StringIO) as mock_stdout:
+            with self.assertRaises(fm.InvalidSourceException):
+                self.create(directory="d_2016")
+            options = self.create().options
+            options.directory = "d_2016"
+            with self.assertRaises(fm.InvalidSourceException):
+                pl.MergePlan(options)
+        self.assertEqual("", mock_stdout.getvalue())
+
+    def test_shared_pool(self):
+        pool = mock.Mock()
+        plan = self.create(pool=pool)
+        self.assertIs(pool, plan.pool)
+        plan.close()
+        self.assertFalse(pool.terminate.called)
+
+        plan = self.create(verify_workers="2", parallel="3")
+        own = plan.pool
+        self.assertEqual(6, len(own._pool))
+        self.assertIs(own, plan.pool)
+        plan.close()
+        self.assertIsNone(plan._pool)
+
+    def test_discover(self):
+        plan = self.create()
+        jobs = plan.discover()
+        self.assertEqual(1, len(jobs))
+        self.assertEqual("d_20160804-0000", jobs[0].name)
+        self.assertEqual("foo2/d_20160804*", jobs[0].input_path)
+        self.assertEqual("foo3/d_20160804-0000", jobs[0].output_path)
+
+        jobs = plan.discover([("a", "foo2/a*"), ("b", "foo2/b*")])
+        self.assertEqual(["a", "b"], [job.name for job in plan.jobs])
+
+    def test_discover_overlap(self):
+        self.mock_ls_each.side_effect = lambda paths, include_hidden=False: \
+            [[] if include_hidden else [("foo2/d_20160804/a", 1)]
+             for _ in paths]
+        input_paths = [("d_201608", "foo2/d_201608*"),
+                       ("d_20160804", "foo2/d_20160804*")]
+        with self.assertRaises(OverlappingInputException):
+            self.create().discover(input_paths)
+
+        self.mock_ls_each.reset_mock()
+        jobs = self.create(overlap="dedupe").discover(input_paths)
+        self.assertEqual(["d_20160804"], [job.name for job in jobs])
+        self.assertEqual([("foo2/d_20160804/a", 1)], jobs[0].files)
+        # The inputs are listed once, for the overlap check and the plan
+        self.assertEqual(1, self.mock_ls_each.call_count)
+
+    def test_discover_skips_empty(self):
+        self.mock_ls_each.side_effect = lambda paths, include_hidden=False: \
+            [[("foo2/a/x", 1)], []]
+        jobs = self.create().discover([("a", "foo2/a*"), ("b", "foo2/b*")])
+        self.assertEqual(["a"], [job.name for job in jobs])
+        self.assertEqual([("foo2/a/x", 1)], jobs[0].files)
+        self.assertEqual("foo2/a*", jobs[0].merge_input)
+
+    def test_discover_fold_outputs(self):
+        listings = {
+            "foo2/a*": [("foo2/a/late", 1)],
+            "foo2/b*": [("foo2/b/x", 1)],
+            "foo3/a": [("foo3/a/part-r-00000", 5), ("foo3/a/_SUCCESS", 0),
+                       ("foo3/a/_cleanup.json", 9)],
+            "foo3/b": [("foo3/b/part-r-00000", 5)],
+            "foo3/c": [("foo3/c/part-r-00000", 5), ("foo3/c/_SUCCESS", 0)],
+            "foo3/_previous/c": [("foo3/_previous/c/part-r-00000", 5),
+                                 ("foo3/_previous/c/_SUCCESS", 0)]
+        }
+        self.mock_ls_each.side_effect = lambda paths, include_hidden=False: \
+            [listings.get(path, []) for path in paths]
+        input_paths = [("a", "foo2/a*"), ("b", "foo2/b*"), ("c", "foo2/c*")]
+
+        jobs = self.create(verify=True,
+                           delete_source=True).discover(input_paths)
+        self.assertEqual(["a", "b", "c"], [job.name for job in jobs])
+        # The sources of 'a' are gone: its output is merged with the new ones
+        self.assertEqual("foo3/_previous/a", jobs[0].previous)
+        self.assertEqual([("foo3/a/part-r-00000", 5)], jobs[0].previous_files)
+        self.assertEqual("foo2/a*,foo3/_previous/a", jobs[0].merge_input)
+        # The output of 'b' is incomplete and simply replaced
+        self.assertEqual("foo2/b*", jobs[1].merge_input)
+        # 'c' resumes a fold that did not complete
+        self.assertEqual("foo3/_previous/c", jobs[2].merge_input)
+
+        # Without cleanup, outputs are replaced and 'c' has nothing to merge
+        jobs = self.create().discover(input_paths)
+        self.assertEqual(["foo2/a*", "foo2/b*"],
+                         [job.merge_input for job in jobs])
+
+        # A complete output without the marker may be all that is left of
+        # its sources; only its directory is skipped
+        listings["foo3/a"].pop()
+        plan = self.create(verify=True, delete_source=True)
+        self.assertEqual(["b", "c"],
+                         [job.name for job in plan.discover(input_paths)])
+        self.assertEqual(["a"], [job.name for job in plan.skipped])
+        self.assertEqual([{"dirname": "a", "input_path": "foo2/a*",
+                           "output_path": "foo3/a", "status": "skipped"}],
+                         plan.report())
+
+    @mock.patch("filemerge.cleanup.mark_output")
+    @mock.patch("filemerge.cleanup.cleanup_source")
+    @mock.patch("filemerge.verify.verify_merge")
+    @mock.patch("filemerge.hdfs.mv")
+    @mock.patch("filemerge.hdfs.mkdir")
+    @mock.patch("filemerge.hdfs.rmr")
+    @mock.patch("filemerge.hdfs.ls")
+    def test_execute_fold(self, mock_ls, mock_rmr, mock_mkdir, mock_mv,
+                          mock_verify_merge, mock_cleanup_source,
+                          mock_mark_output):
+        listings = {
+            "foo3/d_20160804-0000": [
+                ("foo3/d_20160804-0000/part-r-00000", 5),
+                ("foo3/d_20160804-0000/_SUCCESS", 0),
+                ("foo3/d_20160804-0000/_cleanup.json", 9)]
+        }
+        self.mock_ls_each.side_effect = lambda paths, include_hidden=False: \
+            [listings.get(path, [("foo2/d_20160804-0000/late", 1)]
+                          if "*" in path else []) for path in paths]
+        previous = "foo3/_previous/d_20160804-0000"
+        snapshot = [("foo2/d_20160804-0000/late", 1),
+                    (previous + "/part-r-00000", 5)]
+        mock_ls.side_effect = lambda path: \
+            [] if path == previous else snapshot
+        mock_verify_merge.return_value = {
+            "verified": True, "input_files": 2, "input_bytes": 6,
+            "input_records": 3}
+
+        plan = self.create(engine="local", verify=True, delete_source=True)
+        plan.discover()
+        runners = plan.schedule()
+        self.assertEqual("foo2/d_20160804*," + previous,
+                         runners[0].input_path)
+        supervisor = mock.Mock(cancelled=False)
+        supervisor.run.side_effect = run_jobs
+        plan.execute(supervisor)
+
+        # The output moves out of the way before the merge and is removed
+        # with the sources after it
+        mock_mkdir.assert_called_with(["foo3/_previous"])
+        mock_mv.assert_called_with(["foo3/d_20160804-0000"],
+                                   "foo3/_previous")
+        mock_ls.assert_called_with("foo2/d_20160804*," + previous)
+        self.assertEqual(snapshot[:1], mock_cleanup_source.call_args[0][1])
+        self.assertEqual(snapshot[1:],
+                         mock_cleanup_source.call_args[1]["previous"])
+        mock_rmr.assert_called_with(previous)
+        mock_mark_output.assert_called_with(
+            "foo3/d_20160804-0000", mock_cleanup_source.return_value)
+
+    @mock.patch("filemerge.scriptcache.cached_script")
+    @mock.patch("filemerge.filemerge.materialize")
+    def test_schedule_resources(self, mock_materialize, mock_cached_script):
+        self.mock_ls_each.side_effect = lambda paths, include_hidden=False: \
+            [[("foo2/d_20160804-0000/a", 2 * 1024 ** 3)]]
+        mock_cached_script.return_value = "scripts/foo1-0123456789ab.pig"
+        plan = self.create(resource_profile="auto")
+        plan.discover()
+        runners = plan.schedule()
+
+        substitutions = mock_materialize.call_args[0][1]
+        self.assertIn("set mapreduce.reduce.memory.mb '$REDUCE_MEMORY_MB'",
+                      substitutions["@SET_RESOURCES"])
+        self.assertEqual("2048", runners[0].params["REDUCE_MEMORY_MB"])
+        self.assertEqual("medium",
+                         runners[0].metrics["resources"]["profile"])
+        self.assertIn("REDUCE_MEMORY_MB=2048", runners[0].command())
+
+        plan = self.create(resource_profile="none")
+        plan.discover()
+        self.assertEqual(["INPUT", "OUTPUT"],
+                         sorted(plan.schedule()[0].params))
+        self.assertEqual("", mock_materialize.call_args[0][1]["@SET_RESOURCES"])
+
+    @mock.patch("filemerge.scriptcache.write_params")
+    @mock.patch("filemerge.scriptcache.cached_script")
+    def test_dry_run(self, mock_cached_script, mock_write_params):
+        mock_cached_script.return_value = "scripts/foo1-0123456789ab.pig"
+        mock_write_params.return_value = "scripts/foo1-d_20160804-0000.params"
+        plan = self.create(resource_profile="none")
+        plan.discover()
+        plan.schedule()
+
+        self.assertEqual([["pig", "-param_file",
+                           "scripts/foo1-d_20160804-0000.params",
+                           "-f", "scripts/foo1-0123456789ab.pig"]],
+                         plan.dry_run())
+        mock_write_params.assert_called_with(
+            "foo1", "d_20160804-0000",
+            {"INPUT": "foo2/d_20160804*",
+             "OUTPUT": "foo3/d_20160804-0000"})
+
+    @mock.patch("filemerge.hdfs.rmr")
+    def test_fail_job(self, mock_rmr):
+        job = pl.MergeJob("a", "foo2/a*", "foo3/a")
+        self.create()._fail_job(job)
+        self.assertFalse(mock_rmr.called)
+
+        # Failed outputs are withdrawn until their sources are cleaned up
+        plan = self.create(verify=True, delete_source=True)
+        plan._fail_job(job)
+        mock_rmr.assert_called_once_with("foo3/a/_SUCCESS")
+        mock_rmr.reset_mock()
+        job.cleaning = True
+        plan._fail_job(job)
+        self.assertFalse(mock_rmr.called)
+
+    def test_job_slots(self):
+        job = pl.MergeJob("a", "foo2/a*", "foo3/a")
+        with self.assertRaises(AttributeError):
+            job.attempts = 1
+
+    @mock.patch("filemerge.verify.verify_merge")
+    def test_schedule_execute_report(self, mock_verify_merge):
+        plan = self.create(engine="local", verify=True, num_reducers="2")
+        plan.discover()
+        runners = plan.schedule()
+        self.assertEqual(["-n", "2"], runners[0].command()[6:8])
+        self.assertEqual([], plan.report())
+
+        mock_verify_merge.return_value = {"verified": True}
+        supervisor = mock.Mock()
+        supervisor.run.side_effect = run_jobs
+        plan.execute(supervisor)
+
+        self.assertEqual(runners, supervisor.run.call_args[0][0])
+        records = plan.report()
+        self.assertEqual(1, len(records))
+        self.assertEqual("d_20160804-0000", records[0]["dirname"])
+        self.assertEqual("succeeded", records[0]["status"])
+        self.assertEqual({"verified": True}, records[0]["verification"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import json
+import tempfile
+import unittest
+import filemerge.resources as rs
+
+
+GB = rs.GB
+MB = rs.MB
+
+
+class TestResources(unittest.TestCase):
+    def test_select_profile(self):
+        self.assertEqual("small", rs.select_profile(10 * MB)["name"])
+        self.assertEqual("small", rs.select_profile(GB)["name"])
+        self.assertEqual("medium", rs.select_profile(GB + 1)["name"])
+        self.assertEqual("xlarge", rs.select_profile(900 * GB)["name"])
+        self.assertEqual("large", rs.select_profile(0, name="large")["name"])
+        with self.assertRaises(rs.ResourceProfileException):
+            rs.select_profile(0, name="huge")
+
+    def test_job_resources_small_files(self):
+        files = [("f%d" % i, 20 * MB) for i in range(1000)]
+        resources = rs.job_resources(files)
+        self.assertEqual("medium", resources["profile"])
+        self.assertEqual(1000, resources["input_files"])
+        self.assertEqual(20 * MB, resources["largest_file"])
+        params = resources["params"]
+        # No mapper reads more than 20 MB
+        self.assertEqual("1024", params["MAP_MEMORY_MB"])
+        self.assertEqual("-Xmx819m", params["MAP_JAVA_OPTS"])
+        self.assertEqual("2048", params["REDUCE_MEMORY_MB"])
+        self.assertEqual(str(256 * MB), params["SPLIT_MAXSIZE"])
+
+    def test_job_resources_large_files(self):
+        files = [("f%d" % i, 10 * GB) for i in range(60)]
+        params = rs.job_resources(files)["params"]
+        self.assertEqual("4096", params["MAP_MEMORY_MB"])
+        self.assertEqual("8192", params["REDUCE_MEMORY_MB"])
+        self.assertEqual(str(1024 * MB), params["SPLIT_MINSIZE"])
+
+        # A named profile is used as is
+        params = rs.job_resources(files[:1], name="large")["params"]
+        self.assertEqual("3072", params["MAP_MEMORY_MB"])
+
+    def test_load_profiles(self):
+        fd, path_ = tempfile.mkstemp(suffix=".json")
+        profiles = [
+            {"name": "big", "max_input_gb": None, "map_memory_mb": 8192,
+             "reduce_memory_mb": 8192, "split_mb": 512},
+            {"name": "tiny", "max_input_gb": 0.1, "map_memory_mb": 512,
+             "reduce_memory_mb": 512, "split_mb": 64}]
+        with os.fdopen(fd, "w") as fh:
+            json.dump(profiles, fh)
+        try:
+            loaded = rs.load_profiles(path_)
+            self.assertEqual(["tiny", "big"], [p["name"] for p in loaded])
+            self.assertEqual("big", rs.job_resources(
+                [("f", GB)], loaded)["profile"])
+
+            del profiles[0]["split_mb"]
+            with open(path_, "w") as fh:
+                json.dump(profiles, fh)
+            with self.assertRaises(rs.ResourceProfileException):
+                rs.load_profiles(path_)
+        finally:
+            os.remove(path_)
+
+    def test_set_statements(self):
+        statements = rs.set_statements().split("\n    ")
+        self.assertEqual(len(rs.PROPERTIES), len(statements))
+        self.assertEqual("set mapreduce.map.memory.mb '$MAP_MEMORY_MB'",
+                         statements[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import mock
+import filemerge.scriptcache as sc
+
+
+class TestScriptCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.scripts = os.path.join(self.tmpdir, "scripts")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_cached_script(self):
+        path_ = sc.cached_script("foo", "A = load '$INPUT';", self.scripts)
+        self.assertEqual(path_, sc.script_path("foo", "A = load '$INPUT';",
+                                               self.scripts))
+        with open(path_) as fh:
+            self.assertEqual("A = load '$INPUT';", fh.read())
+
+        # Identical content is reused, different content gets its own file
+        os.utime(path_, (0, 0))
+        self.assertEqual(path_, sc.cached_script("foo", "A = load '$INPUT';",
+                                                 self.scripts))
+        self.assertTrue(os.path.getmtime(path_) > 0)
+        other = sc.cached_script("foo", "B = load '$INPUT';", self.scripts)
+        self.assertNotEqual(path_, other)
+        self.assertEqual(2, len(os.listdir(self.scripts)))
+
+        # A script pruned by a concurrent run after the lookup is rewritten
+        with mock.patch("os.utime", side_effect=OSError("pruned")):
+            self.assertEqual(path_, sc.cached_script(
+                "foo", "A = load '$INPUT';", self.scripts))
+        with open(path_) as fh:
+            self.assertEqual("A = load '$INPUT';", fh.read())
+
+    def test_write_params(self):
+        path_ = sc.write_params("foo", "d_1", {"OUTPUT": "/out/d_1",
+                                               "INPUT": "/in/d_1/*"},
+                                self.scripts)
+        self.assertEqual(os.path.join(self.scripts, "foo-d_1.params"), path_)
+        with open(path_) as fh:
+            self.assertEqual("INPUT=/in/d_1/*\nOUTPUT=/out/d_1\n", fh.read())
+
+        os.utime(path_, (0, 0))
+        self.assertEqual([path_], sc.prune_scripts(self.scripts, 30))
+
+    def test_prune_scripts(self):
+        self.assertEqual([], sc.prune_scripts(self.scripts))
+
+        old = sc.cached_script("foo", "old", self.scripts)
+        new = sc.cached_script("foo", "new", self.scripts)
+        notes = os.path.join(self.scripts, "notes.txt")
+        open(notes, "w").close()
+        for path_ in (old, notes):
+            os.utime(path_, (0, 0))
+
+        self.assertEqual([old], sc.prune_scripts(self.scripts, 30))
+        self.assertTrue(os.path.exists(new))
+        self.assertTrue(os.path.exists(notes))
+
+        now = time.time() + 31 * 86400
+        self.assertEqual([new], sc.prune_scripts(self.scripts, 30, now))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import subprocess as sp
+import mock
+import filemerge.supervisor as su
+
+
+# Stands in for pig: runs the "Pig script" passed with -f as a shell script
+FAKE_PIG = """#!/bin/sh
+exec sh "$2"
+"""
+
+SUCCESS_SCRIPT = """
+echo "HadoopJobId: job_1460000000000_0001" >&2
+echo "MapReduceLauncher - 50%% complete" >&2
+echo "Successfully read %d records (10 bytes) from: in" >&2
+echo "Total records written : %d" >&2
+echo "MapReduceLauncher - 100%% complete" >&2
+"""
+
+
+class TestSupervisor(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(dir=".")
+        pig = self.write("pig", FAKE_PIG)
+        os.chmod(pig, 0o755)
+        self.patcher = mock.patch("filemerge.supervisor.PIG", pig)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, "w") as fh:
+            fh.write(content)
+        return path
+
+    def make_job(self, name, content):
+        return su.PigJob(name, self.write(name + ".pig", content),
+                         "in/" + name, "out/" + name,
+                         log_path=os.path.join(self.tmpdir, name + ".log"))
+
+    def test_parse(self):
+        job = su.PigJob("foo", "foo.pig", "in", "out")
+        for line in (SUCCESS_SCRIPT % (7, 7)).splitlines():
+            job.parse(line[len('echo "'):-len('" >&2')])
+        self.assertEqual(["job_1460000000000_0001"], job.job_ids)
+        self.assertEqual(100, job.progress)
+        self.assertEqual({"records_read": 7, "total_records_written": 7},
+                         job.counters)
+
+    def test_command(self):
+        job = su.PigJob("foo", "foo.pig", "in", "out",
+                        params={"OUTPUT": "out", "INPUT": "in dir"})
+        self.assertEqual([su.PIG, "-param", "INPUT=in dir",
+                          "-param", "OUTPUT=out", "-f", "foo.pig"],
+                         job.command())
+        self.assertEqual("%s -param 'INPUT=in dir' -param OUTPUT=out "
+                         "-f foo.pig" % su.PIG,
+                         su.command_line(job.command()))
+
+        job.param_file = "foo.params"
+        self.assertEqual([su.PIG, "-param_file", "foo.params", "-f",
+                          "foo.pig"], job.command())
+
+    def test_run(self):
+        jobs = [self.make_job("job%d" % i, SUCCESS_SCRIPT % (i, i))
+                for i in range(5)]
+        completed = []
+        supervisor = su.PigSupervisor(parallel=3)
+        supervisor.run(jobs, on_success=lambda job: completed.append(job.name))
+
+        self.assertEqual(sorted(job.name for job in jobs), sorted(completed))
+        for i, job in enumerate(jobs):
+            self.assertEqual(su.SUCCEEDED, job.status)
+            self.assertEqual(i, job.counters["total_records_written"])
+            self.assertEqual(0, job.summary()["returncode"])
+            with open(job.log_path) as fh:
+                self.assertIn("HadoopJobId", fh.read())
+        self.assertEqual(100, supervisor.report()["percent"])
+
+    def test_run_failure(self):
+        jobs = [self.make_job("bad", "exit 3"),
+                self.make_job("good", SUCCESS_SCRIPT % (1, 1))]
+        with self.assertRaises(sp.CalledProcessError):
+            su.PigSupervisor(parallel=1).run(jobs)
+        self.assertEqual(su.FAILED, jobs[0].status)
+        self.assertEqual(3, jobs[0].returncode)
+        self.assertEqual(su.PENDING, jobs[1].status)
+
+    def test_run_callback_failure(self):
+        jobs = [self.make_job("job", SUCCESS_SCRIPT % (1, 1))]
+
+        def on_success(job):
+            raise RuntimeError("verification failed")
+
+        on_failure = mock.Mock()
+        with self.assertRaises(RuntimeError):
+            su.PigSupervisor().run(jobs, on_success=on_success,
+                                   on_failure=on_failure)
+        self.assertEqual(su.FAILED, jobs[0].status)
+        on_failure.assert_called_once_with(jobs[0])
+
+        # Jobs whose on_start failed have nothing to undo
+        on_failure.reset_mock()
+        with self.assertRaises(RuntimeError):
+            su.PigSupervisor().run(jobs, on_start=on_success,
+                                   on_failure=on_failure)
+        self.assertFalse(on_failure.called)
+
+    @mock.patch("filemerge.supervisor.kill_hadoop_job")
+    def test_cancel(self, mock_kill):
+        script = 'echo "HadoopJobId: job_1_0002" >&2\nexec sleep 30\n'
+        jobs = [self.make_job("slow%d" % i, script) for i in range(3)]
+        supervisor = su.PigSupervisor(parallel=2)
+        timer = threading.Timer(1.0, supervisor.cancel)
+        timer.start()
+        try:
+            with self.assertRaises(KeyboardInterrupt):
+                supervisor.run(jobs)
+        finally:
+            timer.cancel()
+        self.assertEqual([su.CANCELLED, su.CANCELLED, su.PENDING],
+                         [job.status for job in jobs])
+        mock_kill.assert_called_with("job_1_0002")
+
+    def test_cancel_after_pig_exited(self):
+        # Cancelling while Pig winds down must not run the completion step
+        jobs = [self.make_job("job", SUCCESS_SCRIPT % (1, 1))]
+        supervisor = su.PigSupervisor()
+        on_success = mock.Mock()
+        on_failure = mock.Mock()
+        launch = supervisor._launch
+
+        def launch_then_cancel(job):
+            launch(job)
+            supervisor.cancel()
+
+        with mock.patch.object(supervisor, "_launch", launch_then_cancel):
+            with self.assertRaises(KeyboardInterrupt):
+                supervisor.run(jobs, on_success=on_success,
+                               on_failure=on_failure)
+        self.assertFalse(on_success.called)
+        on_failure.assert_called_once_with(jobs[0])
+        self.assertTrue(supervisor.cancelled)
+        self.assertEqual(su.CANCELLED, jobs[0].status)
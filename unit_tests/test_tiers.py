@@ -0,0 +1,117 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import fnmatch
+import datetime
+import unittest
+import mock
+import filemerge.tiers as tr
+from filemerge.plan import MergePlan
+
+
+NOW = datetime.datetime(2016, 3, 2, 10, 30)
+
+
+class TestTiers(unittest.TestCase):
+    def setUp(self):
+        self.files = []
+        self.patches = [
+            mock.patch("filemerge.hdfs.ls", self.ls),
+            mock.patch("filemerge.hdfs.ls_each",
+                       lambda paths, include_hidden=False:
+                       [self.ls(p) for p in paths])]
+        for patch in self.patches:
+            patch.start()
+        self.policy = tr.TierPolicy("raw", "out", window=7)
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+
+    def ls(self, path_):
+        globs = [p + "/*" for p in path_.split(",")]
+        return [(f, 1) for f in self.files
+                if any(fnmatch.fnmatch(f, g) for g in globs)]
+
+    def test_parse_entry(self):
+        self.assertEqual((2015, 2, 25, 13), tr.parse_entry("d_20150225-1310"))
+        self.assertEqual((2015, 2, 25, None), tr.parse_entry("d_20150225"))
+        self.assertEqual((2015, 2, None, None), tr.parse_entry("d_201502"))
+        self.assertIsNone(tr.parse_entry("jan2016"))
+
+    def test_ready_hours(self):
+        self.files = ["raw/d_20160302-0810/a", "raw/d_20160302-0850/a",
+                      "raw/d_20160302-0910/a", "raw/d_20160301-2300/a",
+                      "raw/jan2016/a", "out/hourly/d_20160301-2300/part"]
+        # Late data of a promoted hour is promoted again
+        self.assertEqual([("d_20160301-2300", "raw/d_20160301-23*"),
+                          ("d_20160302-0800", "raw/d_20160302-08*")],
+                         self.policy.ready(tr.HOURLY, NOW))
+
+    def test_ready_days(self):
+        self.files = ["out/hourly/d_20160228-2300/part",
+                      "out/hourly/d_20160229-0000/part",
+                      "raw/d_20160229-2310/a",
+                      "out/hourly/d_20160227-0100/part",
+                      "out/daily/d_20160227-0000/part",
+                      "out/hourly/d_20160301-0000/part"]
+        self.assertEqual([("d_20160227-0000", "out/hourly/d_20160227*"),
+                          ("d_20160228-0000", "out/hourly/d_20160228*")],
+                         self.policy.ready(tr.DAILY, NOW))
+
+    def test_ready_months(self):
+        self.files = ["out/daily/d_20160101-0000/part",
+                      "out/daily/d_20160201-0000/part",
+                      "out/daily/d_20160229-0000/part",
+                      "out/daily/d_20160301-0000/part"]
+        self.policy.monthly_lag = 2
+        self.assertEqual([("d_201601", "out/daily/d_201601*")],
+                         self.policy.ready(tr.MONTHLY, NOW))
+
+        # February is complete once its last hour has been rolled up
+        self.policy.monthly_lag = 1
+        self.files.append("out/hourly/d_20160229-2300/part")
+        self.assertEqual(["d_201601"],
+                         [name for name, _ in
+                          self.policy.ready(tr.MONTHLY, NOW)])
+        self.files.pop()
+        self.assertEqual(["d_201601", "d_201602"],
+                         [name for name, _ in
+                          self.policy.ready(tr.MONTHLY, NOW)])
+
+    def test_tier_options(self):
+        options = mock.Mock(topic="cs", input_prefix="raw",
+                            output_prefix="out", archive_source="/archive")
+        daily = tr.tier_options(options, self.policy, tr.DAILY)
+        self.assertEqual("cs-daily", daily.topic)
+        self.assertEqual("out/hourly", daily.input_prefix)
+        self.assertEqual("out/daily", daily.output_prefix)
+        self.assertEqual("/archive/hourly", daily.archive_source)
+        self.assertEqual("raw", options.input_prefix)
+
+    @mock.patch("filemerge.plan.MergePlan.execute")
+    def test_run_tiers(self, mock_execute):
+        self.files = ["raw/d_20160302-0810/a",
+                      "out/hourly/d_20160228-2300/part"]
+        options = MergePlan.create(
+            topic="cs", input_prefix="raw", output_prefix="out",
+            queue="etl", tiered=True, verify=True, delete_source=True,
+            engine="local").options
+
+        tr.run_tiers(options, NOW)
+
+        self.assertEqual(2, mock_execute.call_count)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,209 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import bz2
+import zlib
+import unittest
+from StringIO import StringIO
+import mock
+import filemerge.hdfs as hdfs
+import filemerge.verify as vf
+
+
+LISTING = """Found 3 items
+drwxr-xr-x   - user group          0 2016-08-04 10:00 foo/d_20160804-0000
+-rw-r--r--   3 user group         12 2016-08-04 10:00 foo/d_20160804-0000/part 1
+-rw-r--r--   3 user group          0 2016-08-04 10:00 foo/d_20160804-0000/_SUCCESS
+-rw-r--r--   3 user group         30 2016-08-04 10:00 foo/d_20160804-0100/part-2
+"""
+
+
+class TestHdfs(unittest.TestCase):
+    def test_glob_root(self):
+        self.assertEqual("/a/b", hdfs.glob_root("/a/b/d_2016*/*"))
+        self.assertEqual("/a/b/c", hdfs.glob_root("/a/b/c"))
+
+    def test_is_hidden(self):
+        self.assertTrue(hdfs.is_hidden("/a/_b/c", "/a"))
+        self.assertTrue(hdfs.is_hidden("/a/b/.c", "/a"))
+        self.assertFalse(hdfs.is_hidden("/_a/b/c", "/_a"))
+
+    @mock.patch("filemerge.hdfs._run")
+    def test_ls(self, mock_run):
+        mock_run.return_value = LISTING
+        expected = [("foo/d_20160804-0000/part 1", 12),
+                    ("foo/d_20160804-0100/part-2", 30)]
+        self.assertEqual(expected, hdfs.ls("foo/d_20160804*"))
+        mock_run.assert_called_with(
+            ["hadoop", "fs", "-ls", "-R", "foo/d_20160804*"], missing_ok=True)
+
+    def test_glob_regex(self):
+        regex = hdfs.glob_regex("foo/d_2016080[4-5]*/{a,b?}")
+        self.assertTrue(regex.match("foo/d_20160804-0000/a"))
+        self.assertTrue(regex.match("foo/d_20160805/bc/part-0"))
+        self.assertFalse(regex.match("foo/d_20160806/a"))
+        self.assertFalse(regex.match("foo/d_20160804/x/a"))
+        self.assertFalse(regex.match("foo/d_20160804/ab"))
+        self.assertTrue(hdfs.glob_regex("foo/d_1/").match("foo/d_1/a"))
+        self.assertFalse(hdfs.glob_regex("foo/d_1").match("foo/d_10/a"))
+        self.assertEqual("foo/d_2016", hdfs.literal_prefix("foo/d_2016*/a"))
+
+    @mock.patch("filemerge.hdfs._run")
+    def test_ls_each(self, mock_run):
+        mock_run.return_value = LISTING
+        self.assertEqual(
+            [[("foo/d_20160804-0000/part 1", 12)],
+             [("foo/d_20160804-0100/part-2", 30)],
+             []],
+            hdfs.ls_each(["foo/d_20160804-00*", "foo/d_20160804-01*",
+                          "foo/d_20160805*"]))
+        mock_run.assert_called_once_with(
+            ["hadoop", "fs", "-ls", "-R", "foo/d_20160804-00*",
+             "foo/d_20160804-01*", "foo/d_20160805*"], missing_ok=True)
+
+        listing = hdfs.ls_each(["foo/d_20160804*"], include_hidden=True)
+        self.assertEqual(["foo/d_20160804-0000/part 1",
+                          "foo/d_20160804-0000/_SUCCESS",
+                          "foo/d_20160804-0100/part-2"],
+                         [fpath for fpath, _ in listing[0]])
+
+    @mock.patch("filemerge.hdfs._run")
+    def test_ls_each_fallback(self, mock_run):
+        # Files that match none of the globs are listed glob by glob
+        mock_run.return_value = LISTING
+        with mock.patch("filemerge.hdfs.ls") as mock_ls:
+            mock_ls.return_value = [("foo/x", 1)]
+            self.assertEqual([[("foo/x", 1)]], hdfs.ls_each(["bar/d_2016*"]))
+            mock_ls.assert_called_once_with("bar/d_2016*", False)
+
+    @staticmethod
+    def gzip(data):
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+
+    @mock.patch("filemerge.hdfs.sp.Popen")
+    def test_read_each(self, mock_popen):
+        contents = [("d/plain", "a\nb\nc"),
+                    ("d/empty.gz", self.gzip("")),
+                    ("d/two.gz", self.gzip("d\n") + self.gzip("e\nf\n")),
+                    ("d/x.bz2", bz2.compress("g\nh\n")),
+                    ("d/seq", "SEQ\x06binary"),
+                    ("d/last", "i\n")]
+        files = [(p, len(c)) for p, c in contents]
+        mock_popen.return_value.stdout = StringIO("".join(
+            c for _, c in contents))
+        mock_popen.return_value.wait.return_value = 0
+
+        with mock.patch("filemerge.hdfs.text") as mock_text:
+            mock_text.return_value = iter(["k\n"])
+            found = [(p, list(lines)) for p, lines in hdfs.read_each(files)]
+            mock_text.assert_called_once_with(["d/seq"])
+        self.assertEqual([("d/plain", ["a\n", "b\n", "c"]),
+                          ("d/empty.gz", []),
+                          ("d/two.gz", ["d\n", "e\n", "f\n"]),
+                          ("d/x.bz2", ["g\n", "h\n"]),
+                          ("d/seq", ["k\n"]),
+                          ("d/last", ["i\n"])], found)
+        self.assertEqual(["hadoop", "fs", "-cat"] + [p for p, _ in files],
+                         mock_popen.call_args[0][0])
+
+        # Unread lines are skipped
+        mock_popen.return_value.stdout = StringIO("a\nb\nc\nd\n")
+        self.assertEqual(["a\n", "c\n"], [
+            next(lines) for _, lines in hdfs.read_each([("1", 4), ("2", 4)])])
+
+        # Sizes that changed since listing fail
+        mock_popen.return_value.stdout = StringIO("a\n")
+        with self.assertRaises(IOError):
+            list(hdfs.read_each([("1", 4)]))
+        mock_popen.return_value.stdout = StringIO("a\nb\n")
+        with self.assertRaises(IOError):
+            list(hdfs.read_each([("1", 2)]))
+
+    def test_size_batches(self):
+        with mock.patch("filemerge.hdfs.CAT_BATCH_BYTES", 10):
+            self.assertEqual([[("a", 4), ("b", 6)], [("c", 20)], [("d", 1)]],
+                             hdfs._size_batches([("a", 4), ("b", 6),
+                                                 ("c", 20), ("d", 1)]))
+
+
+class TestVerify(unittest.TestCase):
+    def test_digest_lines_order_independent(self):
+        lines = ["a\n", "b\n", "c\n", "b\n"]
+        expected = vf.digest_lines(lines)
+        self.assertEqual(expected, vf.digest_lines(reversed(lines)))
+        self.assertEqual(4, expected[0])
+        self.assertEqual(expected, vf.digest_lines(["c", "b", "b", "a"]))
+
+    def test_digest_lines_detects_duplicates(self):
+        self.assertNotEqual(vf.digest_lines(["a\n", "b\n", "b\n"])[1],
+                            vf.digest_lines(["a\n", "c\n", "c\n"])[1])
+        self.assertNotEqual(vf.digest_lines(["a\n", "a\n"])[1],
+                            vf.digest_lines([])[1])
+
+    def test_batches(self):
+        self.assertEqual([[1, 2], [3, 4], [5]], vf.batches([1, 2, 3, 4, 5], 2))
+
+    @mock.patch("filemerge.verify.hdfs")
+    def test_verify_merge(self, mock_hdfs):
+        contents = {"in/1": ["x\n", "y\n"], "in/2": ["z\n"],
+                    "out/part-0": ["z\n", "x\n", "y\n"]}
+        mock_hdfs.read_each.side_effect = \
+            lambda files: [(p, iter(contents[p])) for p, _ in files]
+        mock_hdfs.ls.side_effect = lambda path: \
+            [(p, 1) for p in sorted(contents) if p.startswith(path)]
+
+        result = vf.verify_merge("in", "out", workers=2)
+        self.assertTrue(result["verified"])
+        self.assertEqual(3, result["input_records"])
+        self.assertEqual(2, result["input_files"])
+        self.assertEqual(result["input_digest"], result["output_digest"])
+
+        contents["out/part-0"] = ["z\n", "x\n"]
+        self.assertFalse(vf.verify_merge("in", "out")["verified"])
+
+    @mock.patch("filemerge.verify.hdfs")
+    def test_verify_merge_no_trailing_newline(self, mock_hdfs):
+        # The last line of a file ends a record, newline or not
+        contents = {"in/1": ["a0\n", "b0"], "in/2": ["a1\n", "b1"],
+                    "in/3": ["a2"],
+                    "out/part-0": ["a0\n", "b0\n", "a1\n", "b1\n", "a2\n"]}
+        mock_hdfs.read_each.side_effect = \
+            lambda files: [(p, iter(contents[p])) for p, _ in files]
+        mock_hdfs.ls.side_effect = lambda path: \
+            [(p, 1) for p in sorted(contents) if p.startswith(path)]
+
+        result = vf.verify_merge("in", "out", workers=2)
+        self.assertTrue(result["verified"])
+        self.assertEqual(5, result["input_records"])
+
+    @mock.patch("filemerge.verify.hdfs")
+    def test_verify_merge_header(self, mock_hdfs):
+        # in/3 is an empty gzip file: 20 bytes and no lines
+        contents = {"in/1": ["h\n", "x\n"], "in/2": ["h\n", "z\n"],
+                    "in/3": [],
+                    "out/part-0": ["h\n", "z\n", "x\n"],
+                    "out/part-1": ["h\n"]}
+        mock_hdfs.read_each.side_effect = \
+            lambda files: [(p, iter(contents[p])) for p, _ in files]
+        mock_hdfs.ls.side_effect = lambda path: \
+            [(p, 20) for p in sorted(contents) if p.startswith(path)]
+
+        result = vf.verify_merge("in", "out", header="h")
+        self.assertTrue(result["verified"])
+        self.assertEqual(2, result["input_records"])
+        self.assertEqual(2, result["output_records"])
+
+        contents["out/part-0"] = ["z\n", "x\n"]
+        self.assertTrue(vf.verify_merge("in", "out", header="h")["verified"])
+        self.assertFalse(vf.verify_merge("in", "out")["verified"])